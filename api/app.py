@@ -4,18 +4,227 @@ import os
 # Add the project root to the Python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import copy
+import json
+import time
 import uuid
-
-from flask import Flask, request, jsonify
-from proxy_checker.checker import check_proxy
-from celery_worker import celery_app, process_proxies_task
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+from flask import Flask, Response, request, jsonify, stream_with_context
+from prometheus_client import CONTENT_TYPE_LATEST
+from proxy_checker.checker import Deadline, check_proxy, fill_geo_data, filter_for_plan, geo_cache_stats
+from proxy_checker.options import parse_check_options, parse_checks, parse_max_age
+from proxy_checker.rate_limit import rate_limit_stats
+from proxy_checker.result_cache import cache_key, cached_check, result_cache_stats
+from proxy_checker.sessions import session_stats
+from proxy_checker.export import EXPORT_FORMATS, export_stream
+from proxy_checker.ingest import STREAM_FORMATS, iter_entries
+from proxy_checker.metrics import QueueDepthCollector, register_collector, render_metrics
+from proxy_checker.job_store import get_job_store
+from proxy_checker.results import render_result
+from proxy_checker.webhooks import delivery_stats
+from celery_worker import celery_app, dispatch_job, dispatch_stream, queue_depths, queue_for_plan
 
 app = Flask(__name__)
 
+# /metrics also reports the Celery queue depths, read from the broker at scrape time
+register_collector(QueueDepthCollector(queue_depths))
+
+# Bulk checks fan out over a bounded thread pool; whatever hasn't finished by
+# the deadline is reported as timed_out instead of holding the worker.
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '20'))
+BULK_DEADLINE_SECONDS = float(os.getenv('BULK_DEADLINE_SECONDS', '30'))
+
+# GET /check/async/<job_id>?wait=N holds the request until the job changes,
+# re-reading its state every LONG_POLL_INTERVAL seconds for at most N seconds.
+LONG_POLL_MAX_SECONDS = float(os.getenv('LONG_POLL_MAX_SECONDS', '30'))
+LONG_POLL_INTERVAL = float(os.getenv('LONG_POLL_INTERVAL', '0.5'))
+
+# Paging of async job results
+RESULTS_PAGE_LIMIT = int(os.getenv('RESULTS_PAGE_LIMIT', '1000'))
+RESULTS_PAGE_MAX = int(os.getenv('RESULTS_PAGE_MAX', '10000'))
+RESULT_STATUSES = ('alive', 'dead', 'timed_out', 'error')
+
+# Streamed /check/async uploads (NDJSON or ip:port lines) may be far larger than JSON bodies, up to a
+# limit per plan: ASYNC_STREAM_PLAN_LIMITS="ENTERPRISE=1000000,...", or ASYNC_STREAM_MAX_PROXIES for
+# plans without an entry.
+ASYNC_STREAM_MAX_PROXIES = int(os.getenv('ASYNC_STREAM_MAX_PROXIES', '100000'))
+ASYNC_STREAM_PLAN_LIMITS = {plan: int(limit) for plan, _, limit in
+                            (item.partition('=') for item in os.getenv('ASYNC_STREAM_PLAN_LIMITS', '').split(','))
+                            if limit}
+
+# ?output=compact returns error codes with a short detail instead of full error text, and drops null fields
+OUTPUT_MODES = ('verbose', 'compact')
+
+def compact_output():
+    """
+    Reads the output query parameter: True for compact, False for verbose,
+    None if it is invalid.
+    """
+    output = request.args.get('output', 'verbose')
+    return output == 'compact' if output in OUTPUT_MODES else None
+
+def invalid_output_response():
+    return jsonify({"error": f"'output' must be one of: {', '.join(OUTPUT_MODES)}."}), 400
+
+# ?checks= / ?fields= select the check stages for every proxy object that doesn't select its own
+CHECK_SELECTORS = ('checks', 'fields')
+
+def query_checks():
+    """
+    Returns the checks/fields query parameters to apply to proxy objects.
+    Raises ValueError with a client-facing message if they are invalid.
+    """
+    selection = {name: request.args[name] for name in CHECK_SELECTORS if name in request.args}
+    parse_checks(selection)
+    return selection
+
+def with_query_checks(proxy_data, selection):
+    if not selection or not isinstance(proxy_data, dict) or any(proxy_data.get(name) is not None
+                                                                for name in CHECK_SELECTORS):
+        return proxy_data
+    return {**proxy_data, **selection}
+
+def start_bulk_checks(executor, proxies_data, user_plan):
+    """
+    Submits a check for each distinct, valid entry to the executor.
+    Returns ({index: result} for entries that failed validation,
+    {future: index}, {index: [indexes of identical later entries]}).
+    """
+    results = {}
+    futures = {}
+    duplicates = {}
+    first_index = {}
+    for index, proxy_data in enumerate(proxies_data):
+        entry_key = json.dumps(proxy_data, sort_keys=True, default=str)
+        if entry_key in first_index:
+            duplicates.setdefault(first_index[entry_key], []).append(index)
+            continue
+        first_index[entry_key] = index
+
+        proxy = proxy_data.get('proxy')
+        proxy_type = proxy_data.get('type')
+        username = proxy_data.get('username')
+        password = proxy_data.get('password')
+        target_url = proxy_data.get('target_url')
+
+        if not proxy or not proxy_type:
+            results[index] = {"error": "Missing 'proxy' or 'type' in one of the proxy objects."}
+            continue
+
+        try:
+            options = parse_check_options(proxy_data)
+            max_age = parse_max_age(proxy_data)
+        except ValueError as e:
+            results[index] = {"error": str(e)}
+            continue
+
+        # Geo data is resolved afterwards in batched lookups for live proxies
+        key = cache_key(proxy, proxy_type, username, password, target_url, user_plan, geo_lookup=False, **options)
+        check = partial(check_proxy, proxy, proxy_type, username, password, target_url, user_plan,
+                        geo_lookup=False, **options)
+        future = executor.submit(cached_check, key, check, max_age)
+        futures[future] = index
+    return results, futures, duplicates
+
+def bulk_timed_out_result():
+    return {
+        "status": "timed_out",
+        "error": f"Check did not finish within the {BULK_DEADLINE_SECONDS:g}s request deadline."
+    }
+
+def bulk_executor(proxies_data):
+    return ThreadPoolExecutor(max_workers=max(1, min(BULK_CONCURRENCY, len(proxies_data))))
+
+def run_bulk_checks(proxies_data, user_plan):
+    """
+    Checks the proxies concurrently and returns results in input order.
+    Identical entries are checked once, and recent results come from the
+    result cache. Entries still running when the deadline passes come back
+    as timed_out.
+    """
+    deadline = Deadline(BULK_DEADLINE_SECONDS * 1000)
+    results = [None] * len(proxies_data)
+    executor = bulk_executor(proxies_data)
+    try:
+        invalid, futures, duplicates = start_bulk_checks(executor, proxies_data, user_plan)
+        done, not_done = wait(futures, timeout=deadline.budget(BULK_DEADLINE_SECONDS))
+    finally:
+        # Don't wait for stragglers; their threads finish in the background.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for index, result in invalid.items():
+        results[index] = result
+
+    checked = []
+    for future in done:
+        index = futures[future]
+        results[index] = filter_for_plan(future.result(), user_plan)
+        checked.append((proxies_data[index]['proxy'], results[index]))
+    # Geo lookups get what is left of the deadline; past it the geo fields stay null
+    fill_geo_data(checked, deadline)
+
+    for future in not_done:
+        results[futures[future]] = bulk_timed_out_result()
+
+    for original, copies in duplicates.items():
+        for index in copies:
+            results[index] = copy.deepcopy(results[original])
+
+    return results
+
+def iter_bulk_checks(proxies_data, user_plan):
+    """
+    Like run_bulk_checks, but yields (index, result) pairs as soon as each
+    check finishes instead of waiting for all of them. Checks finishing
+    together share one batched geo lookup. Results are not kept once
+    yielded.
+    """
+    deadline = Deadline(BULK_DEADLINE_SECONDS * 1000)
+    executor = bulk_executor(proxies_data)
+    try:
+        invalid, futures, duplicates = start_bulk_checks(executor, proxies_data, user_plan)
+
+        def with_duplicates(index, result):
+            yield index, result
+            for duplicate in duplicates.pop(index, ()):
+                yield duplicate, copy.deepcopy(result)
+
+        for index, result in invalid.items():
+            yield from with_duplicates(index, result)
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=deadline.budget(BULK_DEADLINE_SECONDS), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            checked = [(futures.pop(future), filter_for_plan(future.result(), user_plan)) for future in done]
+            fill_geo_data(((proxies_data[index]['proxy'], result) for index, result in checked), deadline)
+            for index, result in checked:
+                yield from with_duplicates(index, result)
+            # Drop this batch before waiting for the next, so results are only held until yielded
+            del done, checked
+
+        for future in pending:
+            yield from with_duplicates(futures[future], bulk_timed_out_result())
+    finally:
+        # Also runs when the client disconnects mid-stream
+        executor.shutdown(wait=False, cancel_futures=True)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok"}), 200
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({"geo_cache": geo_cache_stats(), "sessions": session_stats(), "webhooks": delivery_stats(),
+                    "result_cache": result_cache_stats(), "rate_limits": rate_limit_stats()}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
 @app.route('/check', methods=['POST'])
 def check():
     if not request.is_json:
@@ -36,6 +245,9 @@ def check():
         return jsonify({"error": "Missing 'proxy' or 'type' in request body"}), 400
 
     user_plan = request.headers.get('X-RapidAPI-Subscription', 'BASIC').upper()
+    compact = compact_output()
+    if compact is None:
+        return invalid_output_response()
 
     # SOCKS proxy support gating
     if user_plan == 'BASIC' and proxy_type in ['socks4', 'socks5']:
@@ -45,20 +257,22 @@ def check():
     if user_plan == 'BASIC' and (username or password):
         return jsonify({"error": "Proxy authentication requires a PRO plan or higher."}), 403
 
-    result = check_proxy(proxy, proxy_type, username, password, target_url, user_plan)
+    try:
+        data = with_query_checks(data, query_checks())
+        options = parse_check_options(data)
+        max_age = parse_max_age(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Filter DNS leak and SSL verification if user_plan is BASIC or PRO
-    if user_plan in ['BASIC', 'PRO']:
-        result.pop("dns_leak_detected", None)
-        result.pop("ssl_verified", None)
+    # Auto-detection on BASIC only looks for the proxy types the plan allows
+    if user_plan == 'BASIC' and proxy_type == 'auto':
+        options['auto_types'] = ('http',)
 
-    # Filter reputation and blacklist data if user_plan is BASIC, PRO, or ULTRA
-    if user_plan in ['BASIC', 'PRO', 'ULTRA']:
-        result.pop("reputation_score", None)
-        result.pop("blacklisted", None)
-        result.pop("threat_type", None)
+    key = cache_key(proxy, proxy_type, username, password, target_url, user_plan, **options)
+    result = cached_check(key, partial(check_proxy, proxy, proxy_type, username, password, target_url, user_plan,
+                                       **options), max_age)
 
-    return jsonify(result)
+    return jsonify(render_result(filter_for_plan(result, user_plan), compact))
 
 @app.route('/check/bulk', methods=['POST'])
 def check_bulk():
@@ -81,33 +295,30 @@ def check_bulk():
     if len(data) > 100:
         return jsonify({"error": "Maximum 100 proxies allowed per bulk request."}), 400
 
-    results = []
-    for proxy_data in data:
-        proxy = proxy_data.get('proxy')
-        proxy_type = proxy_data.get('type')
-        username = proxy_data.get('username')
-        password = proxy_data.get('password')
-        target_url = proxy_data.get('target_url')
-
-        if not proxy or not proxy_type:
-            results.append({"error": "Missing 'proxy' or 'type' in one of the proxy objects."})
-            continue
+    compact = compact_output()
+    if compact is None:
+        return invalid_output_response()
 
-        result = check_proxy(proxy, proxy_type, username, password, target_url, user_plan)
+    try:
+        selection = query_checks()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    data = [with_query_checks(proxy_data, selection) for proxy_data in data]
 
-        # Apply filtering based on user_plan for bulk results as well
-        if user_plan in ['BASIC', 'PRO']:
-            result.pop("dns_leak_detected", None)
-            result.pop("ssl_verified", None)
+    # Accept: application/x-ndjson streams one result per line, in completion order, tagged with its input index
+    if request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson':
+        def stream():
+            for index, result in iter_bulk_checks(data, user_plan):
+                yield json.dumps({"index": index, **render_result(result, compact)}) + "\n"
 
-        if user_plan in ['BASIC', 'PRO', 'ULTRA']:
-            result.pop("reputation_score", None)
-            result.pop("blacklisted", None)
-            result.pop("threat_type", None)
+        response = Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+        # Ask reverse proxies not to buffer the stream
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
 
-        results.append(result)
+    results = run_bulk_checks(data, user_plan)
 
-    return jsonify(results)
+    return jsonify([render_result(result, compact) for result in results])
 
 @app.route('/check/async', methods=['POST'])
 def check_async():
@@ -116,6 +327,9 @@ def check_async():
     if user_plan in ['BASIC', 'PRO', 'ULTRA']:
         return jsonify({"error": "Asynchronous checking requires an ENTERPRISE plan or higher."}), 403
 
+    if request.mimetype in STREAM_FORMATS:
+        return check_async_stream(user_plan)
+
     if not request.is_json:
         return jsonify({"error": "Content-Type must be application/json"}), 400
 
@@ -133,81 +347,186 @@ def check_async():
     if len(proxies_to_check) > 1000:
         return jsonify({"error": "Maximum 1000 proxies allowed per asynchronous request."}), 400
 
+    batch_size = data.get('callback_batch_size')
+    batch_seconds = data.get('callback_batch_seconds')
+    error = callback_batch_error(callback_url, batch_size, batch_seconds)
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        selection = query_checks()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    proxies_to_check = [with_query_checks(proxy_data, selection) for proxy_data in proxies_to_check]
+
     job_id = str(uuid.uuid4())
 
     # Pass user_plan to the Celery task so filtering can be applied within the worker
     for proxy_data in proxies_to_check:
         proxy_data['user_plan'] = user_plan
 
-    process_proxies_task.delay(proxies_to_check, job_id, callback_url)
+    # Chunks are checked in parallel across the plan's workers, interleaved fairly with other
+    # tenants' jobs, then aggregated in order under job_id
+    tenant = request.headers.get('X-RapidAPI-User', 'anonymous')
+    dispatch_job(proxies_to_check, job_id, callback_url, callback_batch_size=batch_size,
+                 callback_batch_seconds=batch_seconds, tenant=tenant, queue=queue_for_plan(user_plan))
 
     return jsonify({"job_id": job_id, "status": "submitted"}), 202
 
+def callback_batch_error(callback_url, batch_size, batch_seconds):
+    """
+    Returns the client-facing error for invalid batch callback settings, or None.
+    """
+    if batch_size is not None and (isinstance(batch_size, bool) or not isinstance(batch_size, int) or batch_size < 1):
+        return "'callback_batch_size' must be a whole number of at least 1."
+    if batch_seconds is not None and (isinstance(batch_seconds, bool) or not isinstance(batch_seconds, (int, float))
+                                      or batch_seconds <= 0):
+        return "'callback_batch_seconds' must be a positive number of seconds."
+    if (batch_size or batch_seconds) and not callback_url:
+        return "Batch callbacks require a 'callback_url'."
+    return None
+
+def query_number(name):
+    """
+    Reads a numeric query parameter: an int or float, the raw string if it
+    isn't a number (so validation rejects it), or None if it is missing.
+    """
+    value = request.args.get(name)
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+def check_async_stream(user_plan):
+    """
+    POST /check/async with a streamed NDJSON or plain-text body. Proxies are
+    parsed line by line and queued in chunks while the upload is still
+    arriving; job settings come from the query string.
+    """
+    callback_url = request.args.get('callback_url')
+    batch_size = query_number('callback_batch_size')
+    batch_seconds = query_number('callback_batch_seconds')
+    error = callback_batch_error(callback_url, batch_size, batch_seconds)
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        selection = query_checks()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    entries = iter_entries(request.stream, STREAM_FORMATS[request.mimetype], request.args.get('type'),
+                           compressed=request.content_encoding == 'gzip',
+                           limit=ASYNC_STREAM_PLAN_LIMITS.get(user_plan, ASYNC_STREAM_MAX_PROXIES))
+
+    def prepared():
+        for proxy_data in entries:
+            proxy_data = with_query_checks(proxy_data, selection)
+            proxy_data['user_plan'] = user_plan
+            yield proxy_data
+
+    job_id = str(uuid.uuid4())
+    tenant = request.headers.get('X-RapidAPI-User', 'anonymous')
+    try:
+        accepted = dispatch_stream(prepared(), job_id, callback_url, callback_batch_size=batch_size,
+                                   callback_batch_seconds=batch_seconds, tenant=tenant,
+                                   queue=queue_for_plan(user_plan))
+    except ValueError as e:
+        # Chunks queued before the bad line are skipped; the job is marked failed
+        return jsonify({"error": str(e), "job_id": job_id}), 400
+
+    return jsonify({"job_id": job_id, "status": "submitted", "accepted": accepted}), 202
+
+def job_status(job_id, offset=0, limit=RESULTS_PAGE_LIMIT, statuses=None):
+    """
+    Reads a job from the job store: its status, progress counts with an ETA,
+    and one page of its finished results (tagged with their input index).
+    Returns None for an unknown job.
+    """
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return None
+
+    done, total = job['done'], job['total']
+    elapsed = time.time() - job['created_at']
+    eta_seconds = round(elapsed / done * (total - done), 1) if done and job['status'] == 'progress' else None
+
+    response = {
+        'job_id': job_id,
+        'status': job['status'],
+        'progress': {'done': done, 'total': total, 'alive': job['alive'], 'dead': job['dead'],
+                     'eta_seconds': eta_seconds}
+    }
+    if job['status'] == 'failed':
+        response['error'] = job['error']
+    if job['callback']:
+        response['callback'] = job['callback']
+
+    matching, page = store.results(job_id, offset, limit, statuses)
+    response['results'] = [dict(result, index=index) for index, result in page]
+    response['page'] = {'offset': offset, 'limit': limit, 'matching': matching}
+    return response
+
 @app.route('/check/async/<job_id>', methods=['GET'])
 def get_async_results(job_id):
-    task = process_proxies_task.AsyncResult(job_id)
-    if task.state == 'PENDING':
-        response = {
-            'job_id': job_id,
-            'status': 'pending'
-        }
-    elif task.state == 'PROGRESS':
-        response = {
-            'job_id': job_id,
-            'status': 'progress',
-            'info': task.info
-        }
-    elif task.state == 'SUCCESS':
-        response = {
-            'job_id': job_id,
-            'status': 'completed',
-            'results': task.result
-        }
-    elif task.state == 'FAILURE':
-        response = {
-            'job_id': job_id,
-            'status': 'failed',
-            'error': str(task.info)
-        }
-    else:
-        response = {
-            'job_id': job_id,
-            'status': task.state
-        }
+    wait_seconds = request.args.get('wait', 0, type=float)
+    if not 0 <= wait_seconds <= LONG_POLL_MAX_SECONDS:
+        return jsonify({"error": f"'wait' must be a number of seconds between 0 and {LONG_POLL_MAX_SECONDS:g}."}), 400
+    since = request.args.get('since', type=int)
+
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', RESULTS_PAGE_LIMIT, type=int)
+    if offset < 0 or not 0 <= limit <= RESULTS_PAGE_MAX:
+        return jsonify({"error": f"'offset' must be 0 or more and 'limit' between 0 and {RESULTS_PAGE_MAX}."}), 400
+    statuses = [status for status in request.args.get('status', '').split(',') if status] or None
+    if statuses and not set(statuses) <= set(RESULT_STATUSES):
+        return jsonify({"error": f"'status' must be a comma-separated list of: {', '.join(RESULT_STATUSES)}."}), 400
+    compact = compact_output()
+    if compact is None:
+        return invalid_output_response()
+
+    response = job_status(job_id, offset, limit, statuses)
+    if response is None:
+        return jsonify({"error": "Job not found."}), 404
+    # Long-poll: hold the request until the job moves on from what the client
+    # has seen (since=<done count>, or the state at the first read)
+    seen = (response['status'], response['progress']['done'] if since is None else since)
+    deadline = time.monotonic() + wait_seconds
+    while response['status'] in ('pending', 'progress') and (response['status'], response['progress']['done']) == seen:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(LONG_POLL_INTERVAL, remaining))
+        response = job_status(job_id, offset, limit, statuses)
+
+    if compact:
+        response['results'] = [dict(render_result(result, compact), index=result['index'])
+                               for result in response['results']]
     return jsonify(response)
 
-@app.route('/check/async/<job_id>/csv', methods=['GET'])
-def get_async_results_csv(job_id):
-    task = process_proxies_task.AsyncResult(job_id)
-    if task.state != 'SUCCESS':
+@app.route('/check/async/<job_id>/<export_format>', methods=['GET'])
+def get_async_results_export(job_id, export_format):
+    # csv, ndjson, csv.gz or ndjson.gz
+    base_format, _, compression = export_format.partition('.')
+    if base_format not in EXPORT_FORMATS or compression not in ('', 'gz'):
+        return jsonify({"error": "Export format must be one of csv, ndjson, csv.gz or ndjson.gz."}), 404
+
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None or job['status'] != 'completed':
         return jsonify({"error": "Job not completed or no results available."}), 404
 
-    results = task.result
-    if not results:
+    if not job['done']:
         return "", 204 # No content
 
-    # Generate CSV
-    import io
-    import csv
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Write header
-    # Assuming all result dictionaries have the same keys
-    header = results[0].keys()
-    writer.writerow(header)
-
-    # Write data rows
-    for row in results:
-        writer.writerow([row.get(key, '') for key in header])
-
-    csv_output = output.getvalue()
-    output.close()
-
-    response = app.make_response(csv_output)
-    response.headers["Content-Disposition"] = f"attachment; filename={job_id}.csv"
-    response.headers["Content-type"] = "text/csv"
+    # Rows are read from the job store and encoded page by page, sent with chunked transfer
+    stream = export_stream(store, job_id, base_format, compress=bool(compression))
+    response = Response(stream_with_context(stream))
+    response.headers["Content-Disposition"] = f"attachment; filename={job_id}.{export_format}"
+    response.headers["Content-type"] = "application/gzip" if compression else EXPORT_FORMATS[base_format]
     return response
 
 if __name__ == '__main__':
@@ -1,17 +1,99 @@
-from celery import Celery
-from proxy_checker.checker import check_proxy
+from celery import Celery, chord
+from celery.signals import worker_init
+from prometheus_client import start_http_server
+from proxy_checker.checker import check_proxy, fill_geo_data, filter_for_plan
+from proxy_checker.job_store import get_job_store
+from proxy_checker.metrics import JOBS, QueueDepthCollector, metrics_registry, register_collector
+from proxy_checker.options import parse_check_options, parse_max_age
+from proxy_checker.result_cache import cache_key, cached_check
+from proxy_checker import webhooks
 import json
 import os
+import time
 
 # Configure Celery
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
 
+# Proxies per subtask of an async job. Chunks run in parallel on any worker.
+ASYNC_CHUNK_SIZE = int(os.getenv('ASYNC_CHUNK_SIZE', '50'))
+# Minimum seconds between writes of new results to the job store by one chunk.
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', '1'))
+
+# Callbacks are delivered from their own queue, so slow receivers never hold up checking workers.
+WEBHOOK_QUEUE = os.getenv('WEBHOOK_QUEUE', 'webhooks')
+
+# Async jobs go to a queue per plan (PLAN_QUEUES="ENTERPRISE=checks-enterprise,..."), or CHECK_QUEUE
+# for plans without one, so each queue can get its own pool of workers.
+CHECK_QUEUE = os.getenv('CHECK_QUEUE', 'celery')
+PLAN_QUEUES = dict(item.split('=', 1) for item in os.getenv('PLAN_QUEUES', '').split(',') if '=' in item)
+
+# Port of the worker's Prometheus exporter; unset to not export.
+WORKER_METRICS_PORT = os.getenv('WORKER_METRICS_PORT')
+
+# Chunks are prioritised by their position in their tenant's backlog: a tenant's next
+# chunk goes ahead of chunks further back in anyone's backlog, which interleaves
+# tenants round-robin. Brokers support a limited number of priority levels.
+PRIORITY_LEVELS = 10
+# Aggregation, failure and webhook tasks are short and finish jobs clients are
+# waiting on: they go behind every tenant's next chunk and ahead of the rest.
+FINISH_PRIORITY = 1
+
 celery_app = Celery('proxy_checker', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+celery_app.conf.task_routes = {'celery_worker.deliver_webhook_task': {'queue': WEBHOOK_QUEUE}}
+# Priorities only help if workers don't reserve a backlog of their own: fetch one task
+# at a time, and acknowledge it when done so a lost worker's chunk is redelivered.
+celery_app.conf.worker_prefetch_multiplier = 1
+celery_app.conf.task_acks_late = True
+celery_app.conf.broker_transport_options = {'priority_steps': list(range(PRIORITY_LEVELS)),
+                                            'queue_order_strategy': 'priority'}
 
-@celery_app.task
-def process_proxies_task(proxies_data, job_id, callback_url=None):
+def queue_for_plan(user_plan):
+    return PLAN_QUEUES.get(user_plan, CHECK_QUEUE)
+
+def queue_depths():
+    """
+    Returns the number of messages waiting in each check and webhook queue,
+    as reported by the broker. Queues the broker doesn't know yet are empty.
+    """
+    queues = sorted({CHECK_QUEUE, WEBHOOK_QUEUE, *PLAN_QUEUES.values()})
+    depths = {}
+    with celery_app.connection_for_read() as connection:
+        connection.ensure_connection(max_retries=1)
+        for queue in queues:
+            try:
+                depths[queue] = connection.default_channel.queue_declare(queue, passive=True).message_count
+            except connection.channel_errors:
+                depths[queue] = 0
+    return depths
+
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    """
+    Serves the worker's metrics on WORKER_METRICS_PORT, if set.
+    """
+    if not WORKER_METRICS_PORT:
+        return
+    register_collector(QueueDepthCollector(queue_depths))
+    start_http_server(int(WORKER_METRICS_PORT), registry=metrics_registry())
+
+def chunk_priority(rank):
+    """
+    Broker priority of a tenant's chunk at position rank in their backlog (0 is served first).
+    Only the first PRIORITY_LEVELS chunks of a backlog get levels of their own, so
+    fairness between tenants covers those; chunks further back share the lowest
+    level and run in submission order, whoever they belong to.
+    """
+    return min(rank, PRIORITY_LEVELS - 1)
+
+def check_entries(proxies_data, on_result=None):
+    """
+    Checks a list of proxy objects in order and returns their plan-filtered
+    results, reusing recent results from the result cache. on_result, if
+    given, is called with the results so far after each entry.
+    """
     results = []
+    checked = []
     for proxy_data in proxies_data:
         proxy = proxy_data.get('proxy')
         proxy_type = proxy_data.get('type')
@@ -22,31 +104,287 @@ def process_proxies_task(proxies_data, job_id, callback_url=None):
 
         if not proxy or not proxy_type:
             results.append({"error": "Missing 'proxy' or 'type' in one of the proxy objects."})
-            continue
+        else:
+            try:
+                options = parse_check_options(proxy_data)
+                max_age = parse_max_age(proxy_data)
+            except ValueError as e:
+                results.append({"error": str(e)})
+            else:
+                key = cache_key(proxy, proxy_type, username, password, target_url, user_plan, geo_lookup=False,
+                                **options)
+                result = cached_check(key, lambda: check_proxy(proxy, proxy_type, username, password, target_url,
+                                                               user_plan, geo_lookup=False, **options), max_age)
 
-        result = check_proxy(proxy, proxy_type, username, password, target_url, user_plan)
+                # Apply filtering based on user_plan for async results as well
+                results.append(filter_for_plan(result, user_plan))
+                checked.append((proxy, result))
 
-        # Apply filtering based on user_plan for async results as well
-        if user_plan in ['BASIC', 'PRO']:
-            result.pop("dns_leak_detected", None)
-            result.pop("ssl_verified", None)
+        if on_result:
+            on_result(results)
 
-        if user_plan in ['BASIC', 'PRO', 'ULTRA']:
-            result.pop("reputation_score", None)
-            result.pop("blacklisted", None)
-            result.pop("threat_type", None)
-
-        results.append(result)
+    # One batched, deduplicated geo lookup for every live proxy in the list
+    fill_geo_data(checked)
+    return results
 
-    # In a real application, you would store results in a database
-    # For this example, we'll just print them and simulate a callback
-    print(f"Job {job_id} completed. Results: {results}")
+def finish_job(job_id, callback_url=None):
+    """
+    Marks a job completed in the job store and queues its callback.
+    """
+    store = get_job_store()
+    store.finish(job_id)
+    JOBS.labels("completed").inc()
+    job = store.get(job_id)
+    print(f"Job {job_id} completed: {job['done']} checked, {job['alive']} alive.")
 
     if callback_url:
-        try:
-            import requests
-            requests.post(callback_url, json={"job_id": job_id, "status": "completed", "results": results})
-        except Exception as e:
-            print(f"Error sending callback for job {job_id}: {e}")
+        _send_batch(store, job_id, callback_url)  # Results still short of a full batch
+        store.set_callback(job_id, {"status": "queued", "attempts": 0})
+        deliver_webhook_task.delay(callback_url, job_id)
 
-    return results
+    return job
+
+@celery_app.task(bind=True, max_retries=webhooks.WEBHOOK_MAX_RETRIES, priority=FINISH_PRIORITY)
+def deliver_webhook_task(self, url, job_id, payload=None):
+    """
+    Delivers a callback, retrying with exponential backoff. Without a
+    payload this is the job's final callback, built from the job store,
+    and its delivery state is recorded on the job.
+    """
+    store = get_job_store()
+    final = payload is None
+    if final:
+        _, page = store.results(job_id)
+        payload = {"job_id": job_id, "status": "completed", "results": [result for _, result in page]}
+
+    attempts = self.request.retries + 1
+    try:
+        webhooks.deliver(url, payload)
+    except webhooks.DeliveryError as e:
+        if e.retryable and self.request.retries < self.max_retries:
+            webhooks.record_retry()
+            if final:
+                store.set_callback(job_id, {"status": "retrying", "attempts": attempts, "last_error": str(e)})
+            raise self.retry(exc=e, countdown=webhooks.backoff_delay(self.request.retries))
+        webhooks.record_failure()
+        print(f"Giving up on callback for job {job_id} after {attempts} attempts: {e}")
+        if final:
+            store.set_callback(job_id, {"status": "failed", "attempts": attempts, "last_error": str(e)})
+        return False
+
+    if final:
+        store.set_callback(job_id, {"status": "delivered", "attempts": attempts})
+    return True
+
+def _chunk_task_id(job_id, index):
+    return f"{job_id}:chunk:{index}"
+
+@celery_app.task
+def check_chunk_task(proxies_data, job_id, offset, callback=None, indexes=None, tenant=None):
+    """
+    Checks one chunk of a job, writing results to the job store as they
+    come. Entry i fills input index offset + i, or every index in
+    indexes[i] when given (a deduplicated entry fills each index it
+    appeared at). callback ({"url", "batch_size", "batch_seconds"}) turns
+    on incremental callbacks with the job's new results every batch_size
+    results or batch_seconds seconds, whichever comes first, counted
+    across all of its chunks. tenant's backlog shrinks by one chunk when
+    it finishes.
+    """
+    store = get_job_store()
+    try:
+        return _check_chunk(store, proxies_data, job_id, offset, callback, indexes)
+    finally:
+        if tenant is not None:
+            store.adjust_backlog(tenant, -1)
+
+def _send_batch(store, job_id, url):
+    batch = [dict(result, index=index) for index, result in store.take_batch(job_id)]
+    if batch:
+        deliver_webhook_task.delay(url, job_id, {"job_id": job_id, "status": "partial", "results": batch})
+
+def _check_chunk(store, proxies_data, job_id, offset, callback, indexes):
+    indexes = indexes or [[offset + i] for i in range(len(proxies_data))]
+    written = 0
+    last_write = 0
+    batched = 0
+
+    def indexed(results, start):
+        return [(index, result) for position, result in enumerate(results[start:], start)
+                for index in indexes[position]]
+
+    def on_result(results):
+        # Throttled, so a fast chunk doesn't write to the store after every proxy
+        nonlocal written, last_write, batched
+        now = time.monotonic()
+        if now - last_write >= PROGRESS_INTERVAL and len(results) < len(proxies_data):
+            store.put_indexed_results(job_id, indexed(results, written))
+            written = len(results)
+            last_write = now
+        if callback:
+            # Batches are per job: every chunk adds to the job's buffer, and whichever finds it due sends it
+            pending, since_last = store.add_batch(job_id, indexed(results, batched))
+            batched = len(results)
+            due_by_size = callback.get("batch_size") and pending >= callback["batch_size"]
+            due_by_time = callback.get("batch_seconds") and since_last >= callback["batch_seconds"]
+            if due_by_size or due_by_time:
+                _send_batch(store, job_id, callback["url"])
+
+    results = check_entries(proxies_data, on_result)
+    # Rewrite the whole chunk: the live results have their geo fields now
+    store.put_indexed_results(job_id, indexed(results, 0))
+    return len(results)
+
+@celery_app.task(priority=FINISH_PRIORITY)
+def aggregate_results_task(chunk_counts, job_id, callback_url=None):
+    # Every chunk has written its results by now, so the store holds the whole job in input order
+    return finish_job(job_id, callback_url)
+
+@celery_app.task(priority=FINISH_PRIORITY)
+def fail_job_task(request, exc, traceback, job_id):
+    get_job_store().finish(job_id, error=f"{type(exc).__name__}: {exc}")
+    JOBS.labels("failed").inc()
+
+def _dedupe(proxies_data, offset=0):
+    """
+    Identical entries are checked once; their result is written to every
+    index they appear at. Returns the distinct entries and, for each, the
+    input indexes it fills (counting from offset).
+    """
+    unique, indexes, positions = [], [], {}
+    for index, proxy_data in enumerate(proxies_data, offset):
+        key = json.dumps(proxy_data, sort_keys=True, default=str)
+        if key in positions:
+            indexes[positions[key]].append(index)
+        else:
+            positions[key] = len(unique)
+            unique.append(proxy_data)
+            indexes.append([index])
+    return unique, indexes
+
+def _batch_callback(callback_url, callback_batch_size, callback_batch_seconds):
+    if callback_url and (callback_batch_size or callback_batch_seconds):
+        return {"url": callback_url, "batch_size": callback_batch_size, "batch_seconds": callback_batch_seconds}
+    return None
+
+def dispatch_job(proxies_data, job_id, callback_url=None, chunk_size=None, callback_batch_size=None,
+                 callback_batch_seconds=None, tenant=None, queue=None):
+    """
+    Registers the job in the job store, then checks its distinct entries in
+    chunks in parallel as a chord. Chunks write their results to the store as they go (and send
+    batch callbacks if callback_batch_size or callback_batch_seconds is
+    set); the aggregation step, run under task id job_id, marks the job
+    completed and queues the final callback with the ordered results.
+
+    All tasks go to queue (CHECK_QUEUE by default). Chunks are prioritised
+    by their place in the tenant's backlog, so a tenant's large job doesn't
+    hold up other tenants' jobs queued behind it.
+    """
+    queue = queue or CHECK_QUEUE
+    tenant = tenant or "anonymous"
+    chunk_size = chunk_size or ASYNC_CHUNK_SIZE
+    get_job_store().create(job_id, len(proxies_data))
+
+    unique, indexes = _dedupe(proxies_data)
+    callback = _batch_callback(callback_url, callback_batch_size, callback_batch_seconds)
+    starts = range(0, len(unique), chunk_size)
+    backlog = get_job_store().adjust_backlog(tenant, len(starts)) - len(starts)
+    header = [check_chunk_task.s(unique[start:start + chunk_size], job_id, start, callback,
+                                 indexes[start:start + chunk_size], tenant)
+              .set(task_id=_chunk_task_id(job_id, number), queue=queue, priority=chunk_priority(backlog + number))
+              for number, start in enumerate(starts)]
+    body = aggregate_results_task.s(job_id, callback_url).set(task_id=job_id, queue=queue)
+    body.on_error(fail_job_task.s(job_id).set(queue=queue))
+    return chord(header)(body)
+
+def dispatch_stream(entries, job_id, callback_url=None, chunk_size=None, callback_batch_size=None,
+                    callback_batch_seconds=None, tenant=None, queue=None):
+    """
+    Like dispatch_job, for input that is still arriving: entries is an
+    iterable that is read one chunk at a time, and each chunk is queued as
+    soon as it is full, so the input is never held as a whole. Entries are
+    only deduplicated within their chunk.
+
+    The number of chunks isn't known up front, so there is no chord: the job
+    store counts unfinished chunks, plus one held until entries runs out,
+    and whichever finishes last completes the job. If entries raises, the
+    job is marked failed (chunks already queued are skipped) and the error
+    is re-raised. Returns the number of entries queued.
+    """
+    queue = queue or CHECK_QUEUE
+    tenant = tenant or "anonymous"
+    chunk_size = chunk_size or ASYNC_CHUNK_SIZE
+    callback = _batch_callback(callback_url, callback_batch_size, callback_batch_seconds)
+    store = get_job_store()
+    store.create(job_id, 0)
+    store.add_pending(job_id, 1)
+
+    queued = 0
+    number = 0
+    chunk = []
+
+    def send():
+        nonlocal queued, number, chunk
+        unique, indexes = _dedupe(chunk, queued)
+        store.add_pending(job_id, 1, entries=len(chunk))
+        rank = store.adjust_backlog(tenant, 1) - 1
+        check_stream_chunk_task.s(unique, job_id, queued, callback, indexes, tenant, callback_url).set(
+            task_id=_chunk_task_id(job_id, number), queue=queue, priority=chunk_priority(rank)).apply_async()
+        queued += len(chunk)
+        number += 1
+        chunk = []
+
+    try:
+        for proxy_data in entries:
+            chunk.append(proxy_data)
+            if len(chunk) >= chunk_size:
+                send()
+        if chunk:
+            send()
+        if not queued:
+            raise ValueError("The request body contains no proxies.")
+    except Exception as e:
+        store.finish(job_id, error=f"{type(e).__name__}: {e}")
+        JOBS.labels("failed").inc()
+        raise
+    finally:
+        if store.release_pending(job_id) == 0:
+            _complete_stream(job_id, callback_url)
+    return queued
+
+def _complete_stream(job_id, callback_url):
+    job = get_job_store().get(job_id)
+    if job is not None and job['status'] != 'failed':
+        finish_job(job_id, callback_url)
+
+@celery_app.task
+def check_stream_chunk_task(proxies_data, job_id, offset, callback=None, indexes=None, tenant=None,
+                            callback_url=None):
+    """
+    Checks one chunk of a job queued by dispatch_stream (see
+    check_chunk_task), unless the job has already failed. The last chunk to
+    finish completes the job and queues its callback.
+    """
+    store = get_job_store()
+    try:
+        job = store.get(job_id)
+        if job is None or job['status'] == 'failed':
+            if tenant is not None:
+                store.adjust_backlog(tenant, -1)
+            return 0
+        return check_chunk_task(proxies_data, job_id, offset, callback, indexes, tenant)
+    except Exception as e:
+        store.finish(job_id, error=f"{type(e).__name__}: {e}")
+        JOBS.labels("failed").inc()
+        raise
+    finally:
+        if store.release_pending(job_id) == 0:
+            _complete_stream(job_id, callback_url)
+
+@celery_app.task
+def process_proxies_task(proxies_data, job_id, callback_url=None):
+    # Single-task path, kept so jobs queued before an upgrade still run
+    store = get_job_store()
+    store.create(job_id, len(proxies_data))
+    store.put_results(job_id, 0, check_entries(proxies_data))
+    return finish_job(job_id, callback_url)
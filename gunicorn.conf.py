@@ -0,0 +1,54 @@
+"""
+Gunicorn settings for serving api.app.
+
+Proxy checks spend nearly all their time waiting on sockets, so the API is
+served by gevent workers: each worker process runs every request in its own
+greenlet, and a check stuck on a dead proxy only parks its greenlet instead
+of a whole worker. One worker per CPU with GUNICORN_WORKER_CONNECTIONS
+requests each keeps thousands of checks in flight per container while
+/health is still answered straight away.
+
+Set GUNICORN_WORKER_CLASS=sync (or gthread) to fall back to blocking workers.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.getenv('GUNICORN_WORKERS', str(multiprocessing.cpu_count())))
+# Concurrent requests per gevent worker
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '2000'))
+# Threads per worker for the gthread worker class
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+
+# gevent workers heartbeat from their own greenlet, so this only trips when a
+# worker's event loop is stuck, not on slow checks. Leave room for the
+# /check/bulk deadline either way.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '40'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+backlog = int(os.getenv('GUNICORN_BACKLOG', '2048'))
+
+# Recycle workers now and then to bound memory growth of long-lived processes
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '20000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '2000'))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+# The app must not be imported before gevent patches the standard library in
+# each worker, or its sessions and thread pools would use blocking sockets and
+# real threads.
+preload_app = False
+
+if worker_class == 'gevent':
+    # Under gevent the enrichment pool's threads are greenlets, so size it for
+    # every request a worker can hold instead of the thread-based default.
+    os.environ.setdefault('ENRICHMENT_WORKERS', str(worker_connections))
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of a dead worker from the shared metrics directory
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,700 @@
+import asyncio
+import json
+import socket
+import ssl
+import time
+from urllib.parse import urlsplit
+
+from proxy_checker import probe, protocols
+from proxy_checker.checker import (DEFAULT_TARGET_URL, ENRICHMENT_TIMEOUT, GEO_LOOKUP_TIMEOUT, Deadline, cache_geo_data,
+                                   cached_geo_data, dead_result, get_reputation_data, live_result,
+                                   rate_limited_result, select_checks)
+from proxy_checker.metrics import instrument_check_async
+from proxy_checker.options import parse_check_options
+from proxy_checker.probe import AUTO_DETECT_TYPES, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from proxy_checker.rate_limit import acquire_async
+
+DEFAULT_TIMEOUT = 5
+DEFAULT_CONCURRENCY = 500
+
+USER_AGENT = "proxy-checker"
+
+# Longest response line or CONNECT response accepted
+MAX_LINE_LENGTH = 65536
+
+
+class _Response:
+    def __init__(self, status: int, reason: str, url: str, body: bytes):
+        self.status = status
+        self.reason = reason
+        self.url = url
+        self.body = body
+        # Monotonic times the status line and the whole body arrived
+        self.first_byte_at = None
+        self.completed_at = None
+        # Whether the connection can carry another request
+        self.reusable = False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            kind = "Client" if self.status < 500 else "Server"
+            raise _HTTPError(f"{self.status} {kind} Error: {self.reason} for url: {self.url}")
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class _HTTPError(Exception):
+    pass
+
+
+def _timeouts(timeout) -> tuple:
+    # A (connect, read) tuple or one number for both, as with requests
+    return timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+
+def _as_timeout(error: Exception) -> Exception:
+    # asyncio.TimeoutError only became TimeoutError in Python 3.11
+    return TimeoutError() if isinstance(error, asyncio.TimeoutError) else error
+
+
+def _proxy_ssl_context() -> ssl.SSLContext:
+    # https proxies are verified like requests verifies them
+    return ssl.create_default_context()
+
+
+class _SocketStream:
+    """
+    A connected non-blocking socket, read and written on the event loop.
+    """
+
+    def __init__(self, loop, sock: socket.socket):
+        self.loop = loop
+        self.sock = sock
+
+    async def sendall(self, data: bytes):
+        await self.loop.sock_sendall(self.sock, data)
+
+    async def recv(self, size: int) -> bytes:
+        return await self.loop.sock_recv(self.sock, size)
+
+    def close(self):
+        self.sock.close()
+
+
+class _TLSStream:
+    """
+    Asyncio counterpart of probe's TLS layer: TLS over another stream through
+    memory BIOs, so a tunnel through an https proxy can carry TLS to the
+    target inside the proxy's TLS.
+    """
+
+    def __init__(self, inner, context: ssl.SSLContext, server_hostname: str):
+        self.inner = inner
+        self._incoming, self._outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+        self._tls = context.wrap_bio(self._incoming, self._outgoing, server_hostname=server_hostname)
+
+    async def _run(self, operation, *args):
+        while True:
+            try:
+                result = operation(*args)
+            except ssl.SSLWantReadError:
+                await self._flush()
+                data = await self.inner.recv(65536)
+                if data:
+                    self._incoming.write(data)
+                else:
+                    self._incoming.write_eof()
+                continue
+            await self._flush()
+            return result
+
+    async def _flush(self):
+        data = self._outgoing.read()
+        if data:
+            await self.inner.sendall(data)
+
+    async def handshake(self):
+        await self._run(self._tls.do_handshake)
+
+    async def sendall(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            view = view[await self._run(self._tls.write, view):]
+
+    async def recv(self, size: int) -> bytes:
+        try:
+            return await self._run(self._tls.read, size)
+        except (ssl.SSLZeroReturnError, ssl.SSLEOFError):
+            return b""
+
+    def close(self):
+        self.inner.close()
+
+
+class _Reader:
+    """
+    Buffered reads of HTTP responses from a stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b""
+
+    async def _fill(self) -> bool:
+        data = await self.stream.recv(65536)
+        self.buffer += data
+        return bool(data)
+
+    async def readline(self) -> bytes:
+        while b"\n" not in self.buffer:
+            if len(self.buffer) > MAX_LINE_LENGTH:
+                raise protocols.ProxyProtocolError("Response line too long")
+            if not await self._fill():
+                line, self.buffer = self.buffer, b""
+                return line
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line + b"\n"
+
+    async def readexactly(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            if not await self._fill():
+                raise asyncio.IncompleteReadError(self.buffer, size)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    async def read(self) -> bytes:
+        while await self._fill():
+            pass
+        data, self.buffer = self.buffer, b""
+        return data
+
+
+async def _recv_exactly(stream, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = await stream.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Proxy closed the connection during the handshake")
+        data += chunk
+    return data
+
+
+async def _recv_http_head(stream) -> bytes:
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = await stream.recv(1024)
+        if not chunk:
+            raise ConnectionError("Proxy closed the connection during the handshake")
+        data += chunk
+        if len(data) > MAX_LINE_LENGTH:
+            raise protocols.ProxyProtocolError("Proxy sent an oversized CONNECT response")
+    return data
+
+
+async def _handshake(stream, proxy_type: str, host: str, port: int, username: str = None,
+                     password: str = None) -> int:
+    """
+    Asyncio counterpart of probe.handshake.
+    """
+    if proxy_type == 'socks5':
+        with_auth = bool(username and password)
+        await stream.sendall(protocols.socks5_greeting(with_auth))
+        method = protocols.parse_socks5_method(await _recv_exactly(stream, 2))
+        if method == protocols.SOCKS5_USER_PASS:
+            await stream.sendall(protocols.socks5_auth_request(username, password))
+            protocols.check_socks5_auth_reply(await _recv_exactly(stream, 2))
+    elif proxy_type == 'socks4':
+        await stream.sendall(protocols.socks4_connect_request(host, port, username))
+        protocols.check_socks4_reply(await _recv_exactly(stream, 8))
+    else:
+        await stream.sendall(protocols.http_connect_request(host, port, username, password))
+        head = await _recv_http_head(stream)
+        return protocols.parse_http_status_line(head.split(b"\r\n", 1)[0])
+
+
+async def _tunnel(stream, proxy_type: str, host: str, port: int, username: str = None, password: str = None) -> None:
+    """
+    Performs the proxy handshake on an already connected stream so that
+    afterwards the stream talks directly to host:port.
+    """
+    status = await _handshake(stream, proxy_type, host, port, username, password)
+    if proxy_type == 'socks5':
+        await stream.sendall(protocols.socks5_connect_request(host, port))
+        header = await _recv_exactly(stream, 5)
+        await _recv_exactly(stream, protocols.socks5_reply_remaining(header))
+    elif proxy_type != 'socks4' and status != 200:
+        raise protocols.ProxyProtocolError(f"HTTP CONNECT to {host}:{port} failed with status {status}")
+
+
+async def _http_fingerprint(stream, target_host: str, target_port: int, username: str = None,
+                            password: str = None) -> str:
+    """
+    Asyncio counterpart of the HTTP CONNECT fingerprint in probe.
+    """
+    await stream.sendall(protocols.http_connect_request(target_host, target_port, username, password))
+    reply = b""
+    while len(reply) < len(probe.HTTP_REPLY_PREFIX) and probe.HTTP_REPLY_PREFIX.startswith(reply):
+        chunk = await stream.recv(1024)
+        if not chunk:
+            raise ConnectionError("Proxy closed the connection during the handshake")
+        reply += chunk
+    return 'http' if reply.startswith(probe.HTTP_REPLY_PREFIX) else None
+
+
+async def _fingerprint(stream, username: str = None, password: str = None) -> str:
+    """
+    Asyncio counterpart of the SOCKS5-greeting fingerprint in probe.
+    """
+    await stream.sendall(protocols.socks5_greeting(bool(username and password)))
+    reply = await stream.recv(16)
+    detected = probe.classify_greeting_reply(reply)
+    if detected == 'socks5' and protocols.parse_socks5_method(reply) == protocols.SOCKS5_USER_PASS:
+        await stream.sendall(protocols.socks5_auth_request(username, password))
+        protocols.check_socks5_auth_reply(await _recv_exactly(stream, 2))
+    return detected
+
+
+async def _open_socket(loop, host: str, port: int, timeout: float) -> socket.socket:
+    end = time.monotonic() + timeout
+    infos = await asyncio.wait_for(loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout)
+    family, _, _, _, address = infos[0]
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, address), max(0.0, end - time.monotonic()))
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+async def _connect(loop, proxy: str, connect_timeout: float) -> tuple:
+    """
+    Returns (stream, connect_ms) or raises probe.ProbeFailed.
+    """
+    proxy_host, proxy_port = probe.proxy_address(proxy)
+    start = time.monotonic()
+    try:
+        sock = await _open_socket(loop, proxy_host, proxy_port, connect_timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        raise probe.ProbeFailed(probe.connect_failure(_as_timeout(e), connect_timeout))
+    return _SocketStream(loop, sock), (time.monotonic() - start) * 1000
+
+
+class _Connection:
+    """
+    An open stream to the host of url, possibly through a proxy, that GETs url.
+    """
+
+    def __init__(self, stream, url: str, target: str, extra_headers: list):
+        self.stream = stream
+        self.reader = _Reader(stream)
+        self.url = url
+        self.target = target
+        self.extra_headers = extra_headers
+
+    async def get(self, read_timeout: float, keep_alive: bool = False) -> _Response:
+        lines = [f"GET {self.target} HTTP/1.1", f"Host: {urlsplit(self.url).netloc}", f"User-Agent: {USER_AGENT}",
+                 "Accept: */*", f"Connection: {'keep-alive' if keep_alive else 'close'}"] + self.extra_headers
+
+        async def read_response():
+            await self.stream.sendall(("\r\n".join(lines) + "\r\n\r\n").encode())
+            status_line = await self.reader.readline()
+            if not status_line:
+                raise ConnectionError("Connection closed before the response")
+            first_byte_at = time.monotonic()
+            status = protocols.parse_http_status_line(status_line)
+            reason = status_line.decode('latin-1').strip().split(' ', 2)[-1]
+            headers = {}
+            while True:
+                line = await self.reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            response = _Response(status, reason, self.url, await _read_body(self.reader, headers))
+            response.first_byte_at = first_byte_at
+            response.completed_at = time.monotonic()
+            response.reusable = (keep_alive and headers.get("connection", "").lower() != "close"
+                                 and ("content-length" in headers or "transfer-encoding" in headers))
+            return response
+
+        return await asyncio.wait_for(read_response(), read_timeout)
+
+    def close(self):
+        self.stream.close()
+
+
+async def _open(url: str, proxy: str = None, proxy_type: str = None, username: str = None, password: str = None,
+                connect_timeout: float = DEFAULT_TIMEOUT, verify: bool = True, timings: dict = None,
+                deadline: Deadline = None) -> _Connection:
+    """
+    Opens a connection to the host of url, optionally through a proxy.
+    Connecting, the proxy handshake and TLS each get connect_timeout, or
+    what is left of the deadline if that is less.
+    Failures to connect to or handshake with the proxy raise probe.ProbeFailed.
+    If given, timings receives the connect, handshake and tls times in ms.
+
+    https proxies are HTTP proxies spoken to over TLS, as requests does for
+    https:// proxy URLs.
+    """
+    timings = {} if timings is None else timings
+    deadline = deadline or Deadline()
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    host = parts.hostname
+    port = parts.port or (443 if secure else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+
+    loop = asyncio.get_running_loop()
+    extra_headers = []
+    if proxy is None:
+        stream = _SocketStream(loop, await _open_socket(loop, host, port, deadline.budget(connect_timeout)))
+    else:
+        stream, connect_ms = await _connect(loop, proxy, deadline.budget(connect_timeout))
+        timings["connect"] = connect_ms
+    try:
+        if proxy is not None:
+            start = time.monotonic()
+            try:
+                if proxy_type == 'https':
+                    stream = _TLSStream(stream, _proxy_ssl_context(), probe.proxy_address(proxy)[0])
+                    await asyncio.wait_for(stream.handshake(), deadline.budget(connect_timeout))
+                if proxy_type in ('socks4', 'socks5') or secure:
+                    await asyncio.wait_for(_tunnel(stream, proxy_type, host, port, username, password),
+                                           deadline.budget(connect_timeout))
+            except (OSError, asyncio.TimeoutError, protocols.ProxyProtocolError) as e:
+                raise probe.ProbeFailed(probe.handshake_failure(_as_timeout(e), proxy_type, connect_timeout,
+                                                                connect_ms))
+            if proxy_type in ('https', 'socks4', 'socks5') or secure:
+                timings["handshake"] = (time.monotonic() - start) * 1000
+            if proxy_type not in ('socks4', 'socks5') and not secure:
+                # Plain HTTP through an HTTP proxy: send the absolute URI to the proxy itself.
+                path = url
+                if username and password:
+                    extra_headers.append(f"Proxy-Authorization: {protocols.basic_auth(username, password)}")
+        if secure:
+            ssl_context = ssl.create_default_context()
+            if not verify:
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+            start = time.monotonic()
+            stream = _TLSStream(stream, ssl_context, host)
+            await asyncio.wait_for(stream.handshake(), deadline.budget(connect_timeout))
+            timings["tls"] = (time.monotonic() - start) * 1000
+    except BaseException:
+        stream.close()
+        raise
+    return _Connection(stream, url, path, extra_headers)
+
+
+async def _read_body(reader: _Reader, headers: dict) -> bytes:
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = b""
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                await reader.readline()
+                return body
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+    if "content-length" in headers:
+        return await reader.readexactly(int(headers["content-length"]))
+    return await reader.read()
+
+
+async def fetch(url: str, proxy: str = None, proxy_type: str = None, username: str = None, password: str = None,
+                timeout=DEFAULT_TIMEOUT, verify: bool = True) -> _Response:
+    """
+    Performs a single GET request on the event loop, optionally through
+    an HTTP, HTTPS, SOCKS4 or SOCKS5 proxy. timeout is in seconds, or a
+    (connect, read) tuple as with requests.
+    """
+    connect_timeout, read_timeout = _timeouts(timeout)
+    connection = await _open(url, proxy, proxy_type, username, password, connect_timeout, verify)
+    try:
+        return await connection.get(read_timeout)
+    finally:
+        connection.close()
+
+
+async def detect_proxy_type_async(proxy: str, target_host: str, target_port: int, username: str = None,
+                                  password: str = None, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                                  candidates=AUTO_DETECT_TYPES, deadline: Deadline = None) -> dict:
+    """
+    Asyncio counterpart of probe.detect_proxy_type.
+    """
+    deadline = deadline or Deadline()
+    candidates = [proxy_type for proxy_type in AUTO_DETECT_TYPES if proxy_type in candidates]
+    loop = asyncio.get_running_loop()
+    connect_ms = None
+    errors = []
+
+    for proxy_type in candidates:
+        try:
+            stream, connect_ms = await _connect(loop, proxy, deadline.budget(connect_timeout))
+        except probe.ProbeFailed as e:
+            return e.result
+
+        try:
+            start = time.monotonic()
+            if proxy_type == 'http':
+                detected = await asyncio.wait_for(
+                    _http_fingerprint(stream, target_host, target_port, username, password),
+                    deadline.budget(connect_timeout))
+            elif proxy_type == 'socks5':
+                detected = await asyncio.wait_for(_fingerprint(stream, username, password),
+                                                  deadline.budget(connect_timeout))
+            else:
+                await asyncio.wait_for(_handshake(stream, proxy_type, target_host, target_port, username, password),
+                                       deadline.budget(connect_timeout))
+                detected = proxy_type
+            handshake_ms = (time.monotonic() - start) * 1000
+        except protocols.AuthenticationRequired as e:
+            return probe.handshake_failure(e, proxy_type, connect_timeout, connect_ms)
+        except (OSError, asyncio.TimeoutError, protocols.ProxyProtocolError) as e:
+            errors.append(f"{proxy_type.upper()}: {e or type(e).__name__}")
+            continue
+        finally:
+            stream.close()
+
+        if detected in candidates:
+            return {"alive": True, "proxy_type": detected, "connect_ms": round(connect_ms),
+                    "handshake_ms": round(handshake_ms)}
+        errors.append(f"{proxy_type.upper()}: unrecognised reply")
+
+    return probe.detection_failure(errors, connect_ms)
+
+
+async def get_geo_data_async(ip: str) -> dict:
+    """
+    Asyncio counterpart of checker.get_geo_data, sharing its local
+    database and geo cache.
+    """
+    geo_data = cached_geo_data(ip)
+    if geo_data is not None:
+        return geo_data
+    if not await acquire_async('ip-api.com'):
+        return {}
+    try:
+        response = await fetch(f"http://ip-api.com/json/{ip}?fields=country,isp,as", timeout=GEO_LOOKUP_TIMEOUT)
+        response.raise_for_status()
+        geo_data = response.json()
+    except Exception:
+        geo_data = {}
+    return cache_geo_data(ip, geo_data)
+
+
+async def dns_leak_test_async(proxy: str, proxy_type: str, username: str = None, password: str = None,
+                              timeout=DEFAULT_TIMEOUT) -> bool:
+    """
+    Asyncio counterpart of checker.dns_leak_test.
+    Returns True if a DNS leak is detected (or the test could not be performed),
+    and None if ipleak.net is rate limited.
+    """
+    if not await acquire_async('ipleak.net'):
+        return None
+    try:
+        response = await fetch("https://ipleak.net/json/", proxy, proxy_type, username, password, timeout)
+        response.raise_for_status()
+        data = response.json()
+        return "ip" in data and data["ip"] != protocols.split_host_port(proxy)[0]
+    except Exception:
+        return True
+
+
+async def ssl_verification_async(proxy: str, proxy_type: str, username: str = None, password: str = None,
+                                 timeout=DEFAULT_TIMEOUT) -> bool:
+    """
+    Asyncio counterpart of checker.ssl_verification.
+    """
+    if not await acquire_async('www.google.com'):
+        return None
+    try:
+        await fetch("https://www.google.com", proxy, proxy_type, username, password, timeout, verify=True)
+        return True
+    except Exception:
+        return False
+
+
+async def _reputation_async(ip: str) -> dict:
+    return get_reputation_data(ip)
+
+
+async def _timed(coro):
+    start = time.monotonic()
+    value = await coro
+    return value, (time.monotonic() - start) * 1000
+
+
+async def run_stages_async(stages: dict, timeout: float, unfinished=None) -> tuple:
+    """
+    Asyncio counterpart of checker.run_stages, for stages given as {name: coroutine}.
+    """
+    if timeout <= 0 or not stages:
+        for coro in stages.values():
+            coro.close()
+        return {name: unfinished for name in stages}, {name: None for name in stages}
+    tasks = {name: asyncio.ensure_future(_timed(coro)) for name, coro in stages.items()}
+    await asyncio.wait(tasks.values(), timeout=timeout)
+
+    values, latencies = {}, {}
+    for name, task in tasks.items():
+        if task.done() and task.exception() is None:
+            value, latency_ms = task.result()
+            values[name], latencies[name] = value, round(latency_ms)
+        else:
+            values[name] = None if task.done() else unfinished
+            latencies[name] = None
+            task.cancel()
+    return values, latencies
+
+
+def _ms(value: float) -> int:
+    return round(value) if value is not None else None
+
+
+@instrument_check_async
+async def check_proxy_async(proxy: str, proxy_type: str, username: str = None, password: str = None,
+                            target_url: str = DEFAULT_TARGET_URL, user_plan: str = "BASIC", checks: tuple = None,
+                            connect_timeout: float = None, read_timeout: float = None,
+                            auto_types: tuple = AUTO_DETECT_TYPES, samples: int = 1, deadline_ms: float = None) -> dict:
+    """
+    Checks the status of a proxy without blocking a thread.
+    Takes the options of checker.check_proxy and returns the same result
+    dicts and error shapes. The connect and handshake of the check's own
+    connection act as its pre-probe, and their timings fill latency_breakdown_ms.
+
+    As with check_proxy, https proxies are HTTP proxies spoken to over TLS.
+    """
+    proxy_type = proxy_type.lower()
+    target_url = target_url or DEFAULT_TARGET_URL
+    checks = select_checks(user_plan, checks)
+    connect_timeout = connect_timeout or DEFAULT_CONNECT_TIMEOUT
+    read_timeout = read_timeout or DEFAULT_READ_TIMEOUT
+    deadline = Deadline(deadline_ms)
+
+    target = urlsplit(target_url)
+    target_port = target.port or (443 if target.scheme == 'https' else 80)
+    detection = {}
+    if proxy_type == 'auto':
+        detection = await detect_proxy_type_async(proxy, target.hostname, target_port, username, password,
+                                                  connect_timeout, auto_types, deadline)
+        if not detection["alive"]:
+            return deadline.result() if deadline.expired() else dead_result(detection)
+        proxy_type = detection["proxy_type"]
+
+    if not await acquire_async(target.hostname, deadline.slot_wait()):
+        return deadline.result() if deadline.expired() else rate_limited_result(target.hostname)
+    if deadline.expired():
+        return deadline.result()
+
+    timings = {}
+    connection = None
+    try:
+        try:
+            start = time.monotonic()
+            connection = await _open(target_url, proxy, proxy_type, username, password, connect_timeout,
+                                     timings=timings, deadline=deadline)
+            response = await connection.get(deadline.budget(read_timeout), keep_alive=samples > 1)
+            response.raise_for_status()
+
+            data = response.json()
+            origin_ip = data.get("origin")
+        except probe.ProbeFailed as e:
+            return deadline.result() if deadline.expired() else dead_result(e.result)
+        except asyncio.TimeoutError:
+            if deadline.expired():
+                return deadline.result()
+            return {"status": "dead", "error": f"Timeout: no response from {proxy} within {read_timeout:g}s"}
+        except _HTTPError as e:
+            return {"status": "dead", "error": f"HTTPError: {str(e)}"}
+        except (OSError, EOFError, protocols.ProxyProtocolError) as e:
+            return {"status": "dead", "error": f"ConnectionError: {str(e) or type(e).__name__}"}
+        except ValueError as e:
+            return {"status": "dead", "error": f"RequestException: {str(e)}"}
+
+        ttfb_ms = (response.first_byte_at - start) * 1000
+        total_ms = (response.completed_at - start) * 1000
+
+        # The proxy has answered, so a failing extra sample only ends sampling early
+        samples_ms = [ttfb_ms]
+        for _ in range(samples - 1):
+            if deadline.expired() or not await acquire_async(target.hostname, deadline.slot_wait()):
+                break  # Out of time or rate limited: report the samples taken so far
+            try:
+                sample_start = time.monotonic()
+                reusable, response = response.reusable, None
+                if reusable:
+                    try:
+                        response = await connection.get(deadline.budget(read_timeout), keep_alive=True)
+                    except ConnectionError:
+                        pass  # The proxy dropped the idle connection; open a new one, as requests does
+                if response is None:
+                    connection.close()
+                    connection = await _open(target_url, proxy, proxy_type, username, password, connect_timeout,
+                                             deadline=deadline)
+                    response = await connection.get(deadline.budget(read_timeout), keep_alive=True)
+                response.raise_for_status()
+                samples_ms.append((response.first_byte_at - sample_start) * 1000)
+            except (probe.ProbeFailed, asyncio.TimeoutError, _HTTPError, OSError, EOFError,
+                    protocols.ProxyProtocolError, ValueError):
+                break
+        probe_ms = (time.monotonic() - start) * 1000
+    finally:
+        if connection is not None:
+            connection.close()
+
+    proxy_ip = protocols.split_host_port(proxy)[0]
+
+    stages = {}
+    timeout = (deadline.budget(connect_timeout), deadline.budget(read_timeout))
+    if "geo" in checks:
+        stages["geo"] = get_geo_data_async(proxy_ip)
+    if "dns_leak" in checks:
+        stages["dns_leak"] = dns_leak_test_async(proxy, proxy_type, username, password, timeout)
+    if "ssl" in checks:
+        stages["ssl"] = ssl_verification_async(proxy, proxy_type, username, password, timeout)
+    if "reputation" in checks:
+        stages["reputation"] = _reputation_async(proxy_ip)
+
+    values, stage_latency_ms = await run_stages_async(stages, deadline.budget(ENRICHMENT_TIMEOUT),
+                                                      deadline.unfinished)
+
+    latency_breakdown_ms = {
+        "connect": _ms(timings.get("connect")),
+        "handshake": _ms(timings.get("handshake", detection.get("handshake_ms"))),
+        "tls": _ms(timings.get("tls")),
+        "ttfb": round(ttfb_ms),
+        "total": round(total_ms),
+    }
+    return live_result(proxy_type, samples_ms, origin_ip != proxy_ip, values, user_plan, checks,
+                       latency_breakdown_ms, {"probe": round(probe_ms), **stage_latency_ms}, samples)
+
+
+async def check_many_async(proxies: list, concurrency: int = DEFAULT_CONCURRENCY, user_plan: str = "BASIC") -> list:
+    """
+    Checks a list of proxy objects ({"proxy", "type", "username", "password",
+    "target_url", "user_plan"} plus the check options the API accepts) with
+    at most `concurrency` checks in flight. Results are returned in input order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(proxy_data):
+        proxy = proxy_data.get('proxy')
+        proxy_type = proxy_data.get('type')
+        if not proxy or not proxy_type:
+            return {"error": "Missing 'proxy' or 'type' in one of the proxy objects."}
+        try:
+            options = parse_check_options(proxy_data)
+        except ValueError as e:
+            return {"error": str(e)}
+        async with semaphore:
+            return await check_proxy_async(proxy, proxy_type, proxy_data.get('username'), proxy_data.get('password'),
+                                           proxy_data.get('target_url'), proxy_data.get('user_plan', user_plan),
+                                           **options)
+
+    return await asyncio.gather(*(run(proxy_data) for proxy_data in proxies))
@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from proxy_checker.metrics import CACHE_EVENTS
+
+
+def redis_client(url: str):
+    """
+    Creates a Redis client for a shared cache tier. Short socket timeouts keep
+    a slow or unreachable Redis from stalling checks; it just counts as a miss.
+    """
+    import redis
+    return redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+
+
+class TTLCache:
+    """
+    Bounded, thread-safe LRU cache whose entries expire after a per-entry TTL.
+
+    An optional shared tier (a Redis client, or anything with the same
+    get/set(ex=) interface) is consulted on local misses and written through
+    on every set, so processes can share lookups. Values must be JSON
+    serialisable when a shared tier is configured.
+
+    Caches with a name also count their events in the Prometheus cache
+    counters, labelled with it.
+    """
+
+    def __init__(self, maxsize: int = 10000, shared=None, namespace: str = "", clock=time.monotonic,
+                 name: str = None):
+        self.maxsize = maxsize
+        self.name = name
+        self.shared = shared
+        self.namespace = namespace
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_errors = 0
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is missing or expired.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._count("hits")
+                    return value
+                del self._entries[key]
+                self._count("expirations")
+
+        if self.shared is not None:
+            value, ttl = self._shared_get(key)
+            if value is not None:
+                self._store(key, value, ttl)
+                with self._lock:
+                    self._count("shared_hits")
+                return value
+
+        with self._lock:
+            self._count("misses")
+        return None
+
+    def set(self, key, value, ttl: float) -> None:
+        self._store(key, value, ttl)
+        if self.shared is not None:
+            try:
+                payload = json.dumps({"value": value, "expires_at": time.time() + ttl})
+                self.shared.set(self.namespace + str(key), payload, ex=max(1, int(ttl)))
+            except Exception:
+                with self._lock:
+                    self._count("shared_errors")
+
+    def _count(self, event: str) -> None:
+        # Called with the lock held
+        setattr(self, event, getattr(self, event) + 1)
+        if self.name:
+            CACHE_EVENTS[event].labels(self.name).inc()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+            self.evictions = self.expirations = self.shared_errors = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "shared_errors": self.shared_errors,
+                "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+    def _store(self, key, value, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._count("evictions")
+
+    def _shared_get(self, key):
+        try:
+            payload = self.shared.get(self.namespace + str(key))
+            if payload is None:
+                return None, 0
+            entry = json.loads(payload)
+            ttl = entry["expires_at"] - time.time()
+            if ttl <= 0:
+                return None, 0
+            return entry["value"], ttl
+        except Exception:
+            with self._lock:
+                self._count("shared_errors")
+            return None, 0
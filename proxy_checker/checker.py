@@ -1,26 +1,187 @@
+import os
 import requests
 import ssl
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
 
-def get_geo_data(ip: str) -> dict:
-    """
-    Gets the geo-location data for an IP address, including ISP and ASN.
-    """
+from proxy_checker.cache import TTLCache, redis_client
+from proxy_checker.geo_db import GeoDatabase
+from proxy_checker.metrics import instrument_check, observe_stage
+from proxy_checker.probe import (AUTO_DETECT_TYPES, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, PREPROBE_TYPES,
+                                 detect_proxy_type, preprobe)
+from proxy_checker.rate_limit import RATE_LIMIT_MAX_WAIT, acquire
+from proxy_checker.sessions import ProxySession, get_session
+
+DEFAULT_TARGET_URL = "http://httpbin.org/ip"
+
+# Geo lookups are cached per IP. Failed lookups are cached briefly too, so a
+# rate-limited or unreachable ip-api isn't retried on every check.
+GEO_LOOKUP_TIMEOUT = float(os.getenv('GEO_LOOKUP_TIMEOUT', '3'))
+GEO_CACHE_SIZE = int(os.getenv('GEO_CACHE_SIZE', '10000'))
+GEO_CACHE_TTL = int(os.getenv('GEO_CACHE_TTL', '21600'))
+GEO_CACHE_NEGATIVE_TTL = int(os.getenv('GEO_CACHE_NEGATIVE_TTL', '60'))
+# Optional shared tier, usually the Redis that Celery already uses.
+GEO_CACHE_REDIS_URL = os.getenv('GEO_CACHE_REDIS_URL')
+# ip-api's batch endpoint accepts at most 100 IPs per request.
+GEO_BATCH_SIZE = 100
+
+# Enrichment stages (geo, DNS leak, SSL, reputation) run concurrently on a shared
+# pool and together get ENRICHMENT_TIMEOUT seconds; stages that miss it are
+# reported as None rather than holding up the result.
+ENRICHMENT_TIMEOUT = float(os.getenv('ENRICHMENT_TIMEOUT', '8'))
+ENRICHMENT_WORKERS = int(os.getenv('ENRICHMENT_WORKERS', '32'))
+# With a deadline_ms, fields of stages the deadline cut off are reported as UNKNOWN instead.
+UNKNOWN = "unknown"
+
+_enrichment_executor = ThreadPoolExecutor(max_workers=ENRICHMENT_WORKERS, thread_name_prefix='enrichment')
+
+# Optional offline geo/ASN database: a CSV of IP ranges, or the binary file built
+# from one with `python -m proxy_checker.geo_db build`. When set, lookups are
+# answered locally and ip-api.com is never called.
+GEO_DB_PATH = os.getenv('GEO_DB_PATH')
+
+_geo_db = None
+_geo_db_lock = threading.Lock()
+
+_geo_cache = TTLCache(
+    GEO_CACHE_SIZE,
+    shared=redis_client(GEO_CACHE_REDIS_URL) if GEO_CACHE_REDIS_URL else None,
+    namespace="proxy_checker:geo:",
+    name="geo",
+)
+
+def _fetch_geo_data(ip: str) -> dict:
     try:
-        response = requests.get(f"http://ip-api.com/json/{ip}?fields=country,isp,as")
+        response = get_session('geo').get(f"http://ip-api.com/json/{ip}?fields=country,isp,as", timeout=GEO_LOOKUP_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException:
         return {}
 
-def dns_leak_test(proxies: dict) -> bool:
+def _fetch_geo_data_batch(ips: list, timeout: float = GEO_LOOKUP_TIMEOUT) -> dict:
+    try:
+        response = get_session('geo').post("http://ip-api.com/batch?fields=country,isp,as", json=ips, timeout=timeout)
+        response.raise_for_status()
+        # Responses come back in request order
+        return dict(zip(ips, response.json()))
+    except (requests.exceptions.RequestException, ValueError):
+        return {}
+
+def _local_geo_db() -> GeoDatabase:
+    global _geo_db
+    if _geo_db is None:
+        with _geo_db_lock:
+            if _geo_db is None:
+                _geo_db = GeoDatabase.open(GEO_DB_PATH)
+    return _geo_db
+
+def cached_geo_data(ip: str) -> dict:
+    """
+    The geo data for an IP address that needs no ip-api.com request: from
+    the local database when GEO_DB_PATH is set, otherwise from the geo
+    cache. None if it has to be fetched. Shared by every geo lookup.
+    """
+    if GEO_DB_PATH:
+        return _local_geo_db().lookup(ip)
+    geo_data = _geo_cache.get(ip)
+    return None if geo_data is None else dict(geo_data)
+
+def cache_geo_data(ip: str, geo_data: dict) -> dict:
+    """
+    Caches geo data fetched from ip-api.com, empty answers only briefly.
+    """
+    _geo_cache.set(ip, geo_data, GEO_CACHE_TTL if geo_data else GEO_CACHE_NEGATIVE_TTL)
+    return dict(geo_data)
+
+def get_geo_data(ip: str) -> dict:
+    """
+    Gets the geo-location data for an IP address, including ISP and ASN.
+    Uses the local database when GEO_DB_PATH is set, otherwise ip-api.com
+    through the geo cache. Returns no data (uncached) while ip-api.com is
+    rate limited.
+    """
+    geo_data = cached_geo_data(ip)
+    if geo_data is not None:
+        return geo_data
+    if not acquire('ip-api.com'):
+        return {}
+    return cache_geo_data(ip, _fetch_geo_data(ip))
+
+def get_geo_data_batch(ips, deadline=None) -> dict:
+    """
+    Gets geo-location data for many IP addresses at once, returning {ip: geo_data}.
+    Duplicates are looked up once, cached IPs come from the geo cache and the
+    rest go to ip-api's batch endpoint, 100 per request. With a Deadline the
+    lookups only get the time left, and IPs it leaves no time for get no data.
+    """
+    deadline = deadline or Deadline()
+    geo_by_ip = {}
+    missing = []
+    for ip in dict.fromkeys(ips):
+        geo_data = cached_geo_data(ip)
+        if geo_data is None:
+            missing.append(ip)
+        else:
+            geo_by_ip[ip] = geo_data
+
+    for start in range(0, len(missing), GEO_BATCH_SIZE):
+        batch = missing[start:start + GEO_BATCH_SIZE]
+        if deadline.expired() or not acquire('ip-api.com/batch', deadline.slot_wait()):
+            # Out of time or rate limited: these IPs get no geo data this time, and nothing is cached for them
+            geo_by_ip.update((ip, {}) for ip in batch)
+            continue
+        fetched = _fetch_geo_data_batch(batch, deadline.budget(GEO_LOOKUP_TIMEOUT))
+        for ip in batch:
+            geo_by_ip[ip] = cache_geo_data(ip, fetched.get(ip) or {})
+
+    return geo_by_ip
+
+def fill_geo_data(checked, deadline=None) -> None:
+    """
+    Fills in the geo fields of live results from check_proxy(..., geo_lookup=False)
+    with one batched lookup. `checked` is an iterable of (proxy, result) pairs.
+    ISP and ASN are only filled where the result has them, i.e. where the plan includes them.
+    Fields the Deadline leaves no time for stay None.
+    """
+    # Results without a country key were checked without the geo stage
+    pending = [(proxy.split(':')[0], result) for proxy, result in checked
+               if result.get("status") == "alive" and "country" in result and result["country"] is None]
+    if not pending:
+        return
+
+    start = time.monotonic()
+    geo_by_ip = get_geo_data_batch((ip for ip, _ in pending), deadline)
+    # The results were checked without their geo stage, so the batch is timed as one
+    observe_stage("geo", time.monotonic() - start)
+    for ip, result in pending:
+        geo_data = geo_by_ip.get(ip, {})
+        result["country"] = geo_data.get("country")
+        if "isp" in result:
+            result["isp"] = geo_data.get("isp")
+        if "asn" in result:
+            result["asn"] = geo_data.get("as")
+
+def geo_cache_stats() -> dict:
+    """
+    Returns hit, miss and eviction counters for the geo cache.
+    """
+    return _geo_cache.stats()
+
+def dns_leak_test(proxies: dict, session: requests.Session = None, timeout=5) -> bool:
     """
     Performs a DNS leak test through the proxy.
-    Returns True if a DNS leak is detected, False otherwise.
+    Returns True if a DNS leak is detected, False otherwise, and None if
+    ipleak.net is rate limited.
+    Pass the check's session to reuse its connection to the proxy.
     """
+    session = session or get_session('probe')
+    if not acquire('ipleak.net'):
+        return None
     try:
         # Use a known DNS leak test service that returns JSON
-        response = requests.get("https://ipleak.net/json/", proxies=proxies, timeout=5)
+        response = session.get("https://ipleak.net/json/", proxies=proxies, timeout=timeout)
         response.raise_for_status()
         data = response.json()
         # Check if the reported IP is different from the proxy's IP
@@ -31,15 +192,19 @@ def dns_leak_test(proxies: dict) -> bool:
     except requests.exceptions.RequestException:
         return True  # Assume leak or failure if test cannot be performed
 
-def ssl_verification(proxy_url: str) -> bool:
+def ssl_verification(proxy_url: str, session: requests.Session = None, timeout=5) -> bool:
     """
     Performs a basic SSL certificate verification for HTTPS proxies.
-    Returns True if SSL certificate is valid, False otherwise.
+    Returns True if SSL certificate is valid, False otherwise, and None if
+    the verification host is rate limited.
     """
+    session = session or get_session('probe')
+    if not acquire('www.google.com'):
+        return None
     try:
         # Attempt to connect to a well-known HTTPS site through the proxy
         # and verify SSL certificate
-        requests.get("https://www.google.com", proxies={"https": proxy_url}, timeout=5, verify=True)
+        session.get("https://www.google.com", proxies={"https": proxy_url}, timeout=timeout, verify=True)
         return True
     except requests.exceptions.SSLError:
         return False
@@ -59,10 +224,232 @@ def get_reputation_data(ip: str) -> dict:
         "threat_type": "none"    # Dummy threat type
     }
 
-def check_proxy(proxy: str, proxy_type: str, username: str = None, password: str = None, target_url: str = "http://httpbin.org/ip", user_plan: str = "BASIC") -> dict:
+def build_result(proxy_type: str, latency_ms: float, anonymous: bool, geo_data: dict, user_plan: str,
+                 dns_leak_detected: bool = None, ssl_verified: bool = None, reputation_data: dict = None,
+                 checks=None) -> dict:
+    """
+    Assembles the result dict for a live proxy, including only the fields the user's plan pays for
+    and, if checks is given, only those of the selected stages.
+    Shared by the blocking and asyncio checkers so both return the same shape.
+    """
+    checks = select_checks(user_plan, checks)
+    result = {
+        "status": "alive",
+        "latency_ms": round(latency_ms),
+        "proxy_type": proxy_type.upper(),
+    }
+    if "geo" in checks:
+        result["country"] = geo_data.get("country")
+    result["anonymous"] = anonymous
+
+    # Add ISP and ASN if user_plan is not BASIC
+    if "geo" in checks and user_plan != 'BASIC':
+        result["isp"] = geo_data.get("isp")
+        result["asn"] = geo_data.get("as")
+
+    # Add DNS leak and SSL verification if user_plan is not BASIC or PRO
+    if "dns_leak" in checks:
+        result["dns_leak_detected"] = dns_leak_detected
+    if "ssl" in checks:
+        result["ssl_verified"] = ssl_verified
+
+    # Add reputation and blacklist check if user_plan is not BASIC, PRO, or ULTRA
+    if "reputation" in checks:
+        reputation_data = reputation_data or {}
+        result["reputation_score"] = reputation_data.get("reputation_score")
+        result["blacklisted"] = reputation_data.get("blacklisted")
+        result["threat_type"] = reputation_data.get("threat_type")
+
+    return result
+
+def includes_security_checks(user_plan: str) -> bool:
+    return user_plan not in ['BASIC', 'PRO']
+
+def includes_reputation(user_plan: str) -> bool:
+    return user_plan not in ['BASIC', 'PRO', 'ULTRA']
+
+def plan_checks(user_plan: str) -> frozenset:
+    """
+    The optional check stages the user's plan includes.
+    """
+    checks = {"geo"}
+    if includes_security_checks(user_plan):
+        checks.update(("dns_leak", "ssl"))
+    if includes_reputation(user_plan):
+        checks.add("reputation")
+    return frozenset(checks)
+
+def select_checks(user_plan: str, checks=None) -> frozenset:
+    """
+    The stages to run: the requested checks (names from options.CHECKS)
+    that the plan includes, or everything the plan includes if checks is None.
+    """
+    allowed = plan_checks(user_plan)
+    return allowed if checks is None else allowed.intersection(checks)
+
+def filter_for_plan(result: dict, user_plan: str) -> dict:
+    """
+    Drops fields the user's plan doesn't include from a check result.
+    """
+    # Filter DNS leak and SSL verification if user_plan is BASIC or PRO
+    if not includes_security_checks(user_plan):
+        result.pop("dns_leak_detected", None)
+        result.pop("ssl_verified", None)
+
+    # Filter reputation and blacklist data if user_plan is BASIC, PRO, or ULTRA
+    if not includes_reputation(user_plan):
+        result.pop("reputation_score", None)
+        result.pop("blacklisted", None)
+        result.pop("threat_type", None)
+
+    return result
+
+def _timed(func, *args):
+    start = time.monotonic()
+    value = func(*args)
+    return value, (time.monotonic() - start) * 1000
+
+def run_stages(stages: dict, timeout: float, unfinished=None) -> tuple:
+    """
+    Runs independent stages ({name: (func, *args)}) concurrently with one
+    overall timeout. Returns ({name: value}, {name: latency_ms}); stages that
+    raised get None for both, and stages that didn't finish in time get
+    unfinished as their value.
+    """
+    if timeout <= 0:
+        return {name: unfinished for name in stages}, {name: None for name in stages}
+    futures = {name: _enrichment_executor.submit(_timed, *stage) for name, stage in stages.items()}
+    wait(futures.values(), timeout=timeout)
+
+    values, latencies = {}, {}
+    for name, future in futures.items():
+        if future.done() and future.exception() is None:
+            value, latency_ms = future.result()
+            values[name], latencies[name] = value, round(latency_ms)
+        else:
+            values[name] = None if future.done() else unfinished
+            latencies[name] = None
+            future.cancel()
+    return values, latencies
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Linearly interpolated percentile of a non-empty list.
+    """
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+class Deadline:
+    """
+    The time left of a check's deadline_ms, on a monotonic clock. Without a
+    deadline_ms nothing is cut short and nothing expires.
+    """
+
+    def __init__(self, deadline_ms: float = None):
+        self.deadline_ms = deadline_ms
+        self._end = time.monotonic() + deadline_ms / 1000 if deadline_ms else None
+        # Value of the enrichment stages the deadline cuts off
+        self.unfinished = UNKNOWN if deadline_ms else None
+
+    def budget(self, seconds: float) -> float:
+        """
+        Cuts a timeout down to the time left before the deadline.
+        """
+        return seconds if self._end is None else max(0.0, min(seconds, self._end - time.monotonic()))
+
+    def expired(self) -> bool:
+        return self._end is not None and time.monotonic() >= self._end
+
+    def slot_wait(self) -> float:
+        """
+        The rate limiter wait: its default, or less if the deadline is closer.
+        """
+        return None if self._end is None else self.budget(RATE_LIMIT_MAX_WAIT)
+
+    def result(self) -> dict:
+        return {"status": "timed_out", "error": f"Check did not finish within its {self.deadline_ms:g}ms deadline."}
+
+def dead_result(probe: dict) -> dict:
+    """
+    The result of a check whose pre-probe or type detection found the proxy dead.
+    """
+    result = {"status": "dead", "error": probe["error"], "dead_reason": probe["reason"]}
+    if probe.get("proxy_type"):
+        result["proxy_type"] = probe["proxy_type"].upper()
+    return result
+
+def rate_limited_result(host: str) -> dict:
+    """
+    The result of a check that got no request slot for its target. The
+    target (the judge) throttles too, so this isn't a verdict on the proxy.
+    """
+    return {"status": "timed_out", "error": f"RateLimited: No request slot for {host} within {RATE_LIMIT_MAX_WAIT:g}s"}
+
+def live_result(proxy_type: str, samples_ms: list, anonymous: bool, values: dict, user_plan: str, checks,
+                latency_breakdown_ms: dict, stage_latency_ms: dict, samples: int = 1) -> dict:
+    """
+    Builds the result of a proxy that answered from its time-to-first-byte
+    samples, the values of its enrichment stages and its timings.
+    Shared by the blocking and asyncio checkers.
+    """
+    geo_data = values.get("geo") or {}
+    if geo_data == UNKNOWN:
+        geo_data = {"country": UNKNOWN, "isp": UNKNOWN, "as": UNKNOWN}
+    reputation_data = values.get("reputation")
+    if reputation_data == UNKNOWN:
+        reputation_data = {"reputation_score": UNKNOWN, "blacklisted": UNKNOWN, "threat_type": UNKNOWN}
+
+    latency_ms = percentile(samples_ms, 50)
+    result = build_result(proxy_type, latency_ms, anonymous, geo_data, user_plan,
+                          values.get("dns_leak"), values.get("ssl"), reputation_data, checks)
+    result["latency_breakdown_ms"] = latency_breakdown_ms
+    if samples > 1:
+        result["latency_samples_ms"] = {
+            "count": len(samples_ms),
+            "min": round(min(samples_ms)),
+            "p50": round(latency_ms),
+            "p95": round(percentile(samples_ms, 95)),
+        }
+    result["stage_latency_ms"] = stage_latency_ms
+    return result
+
+@instrument_check
+def check_proxy(proxy: str, proxy_type: str, username: str = None, password: str = None, target_url: str = DEFAULT_TARGET_URL, user_plan: str = "BASIC",
+                geo_lookup: bool = True, connect_timeout: float = None, read_timeout: float = None,
+                preprobe_proxy: bool = True, auto_types: tuple = AUTO_DETECT_TYPES, samples: int = 1,
+                checks: tuple = None, deadline_ms: float = None) -> dict:
     """
     Checks the status of a proxy with enhanced features.
+    Pass geo_lookup=False when checking many proxies and resolve the geo
+    fields afterwards in one go with fill_geo_data. preprobe_proxy=False
+    skips the pre-probe, and auto_types limits what type "auto" detects.
+    The remaining options are the per-proxy settings documented in the
+    README and parsed by options.parse_check_options.
     """
+    target_url = target_url or DEFAULT_TARGET_URL
+    checks = select_checks(user_plan, checks)
+    connect_timeout = connect_timeout or DEFAULT_CONNECT_TIMEOUT
+    read_timeout = read_timeout or DEFAULT_READ_TIMEOUT
+    deadline = Deadline(deadline_ms)
+
+    target = urlsplit(target_url)
+    target_port = target.port or (443 if target.scheme == 'https' else 80)
+    probe = {}
+    if proxy_type == 'auto':
+        probe = detect_proxy_type(proxy, target.hostname, target_port, username, password, connect_timeout,
+                                  auto_types, deadline)
+        if not probe["alive"]:
+            return deadline.result() if deadline.expired() else dead_result(probe)
+        proxy_type = probe["proxy_type"]
+    elif preprobe_proxy and proxy_type in PREPROBE_TYPES:
+        probe = preprobe(proxy, proxy_type, target.hostname, target_port, username, password, connect_timeout,
+                         tls=target.scheme == 'https', deadline=deadline)
+        if not probe["alive"]:
+            return deadline.result() if deadline.expired() else dead_result(probe)
+
     proxies = {
         "http": f'{proxy_type}://{proxy}',
         "https": f'{proxy_type}://{proxy}'
@@ -70,53 +457,73 @@ def check_proxy(proxy: str, proxy_type: str, username: str = None, password: str
 
     auth = (username, password) if username and password else None
 
-    start_time = datetime.now()
+    if not acquire(target.hostname, deadline.slot_wait()):
+        return deadline.result() if deadline.expired() else rate_limited_result(target.hostname)
+    if deadline.expired():
+        return deadline.result()
+    timeout = (deadline.budget(connect_timeout), deadline.budget(read_timeout))
 
-    try:
-        response = requests.get(target_url, proxies=proxies, auth=auth, timeout=5)
-        response.raise_for_status()
+    # One session per check: the main, DNS-leak and SSL probes share its
+    # connections to the proxy wherever the protocol allows.
+    with ProxySession(proxies) as session:
+        try:
+            start = time.monotonic()
+            response = session.get(target_url, proxies=proxies, auth=auth, timeout=timeout, stream=True)
+            ttfb_ms = (time.monotonic() - start) * 1000
+            response.raise_for_status()
 
-        end_time = datetime.now()
-        latency_ms = (end_time - start_time).total_seconds() * 1000
+            data = response.json()
+            total_ms = (time.monotonic() - start) * 1000
+            origin_ip = data.get("origin")
 
-        data = response.json()
-        origin_ip = data.get("origin")
+        except requests.exceptions.Timeout as e:
+            if deadline.expired():
+                return deadline.result()
+            return {"status": "dead", "error": f"Timeout: {str(e)}"}
+        except requests.exceptions.ConnectionError as e:
+            return {"status": "dead", "error": f"ConnectionError: {str(e)} (Note: SOCKS proxies require PySocks library)"}
+        except requests.exceptions.HTTPError as e:
+            return {"status": "dead", "error": f"HTTPError: {str(e)}"}
+        except requests.exceptions.RequestException as e:
+            return {"status": "dead", "error": f"RequestException: {str(e)}"}
+
+        # The proxy has answered, so a failing extra sample only ends sampling early
+        samples_ms = [ttfb_ms]
+        for _ in range(samples - 1):
+            if deadline.expired() or not acquire(target.hostname, deadline.slot_wait()):
+                break  # Out of time or rate limited: report the samples taken so far
+            timeout = (deadline.budget(connect_timeout), deadline.budget(read_timeout))
+            try:
+                sample_start = time.monotonic()
+                sample = session.get(target_url, proxies=proxies, auth=auth, timeout=timeout, stream=True)
+                sample.raise_for_status()
+                samples_ms.append((time.monotonic() - sample_start) * 1000)
+                sample.content  # Reading the body hands the connection back for the next sample
+            except requests.exceptions.RequestException:
+                break
+        probe_ms = (time.monotonic() - start) * 1000
 
         proxy_ip = proxy.split(':')[0]
-        geo_data = get_geo_data(proxy_ip)
-
-        result = {
-            "status": "alive",
-            "latency_ms": round(latency_ms),
-            "proxy_type": proxy_type.upper(),
-            "country": geo_data.get("country"),
-            "anonymous": origin_ip != proxy_ip,
-        }
 
-        # Add ISP and ASN if user_plan is not BASIC
-        if user_plan != 'BASIC':
-            result["isp"] = geo_data.get("isp")
-            result["asn"] = geo_data.get("as")
+        stages = {}
+        if geo_lookup and "geo" in checks:
+            stages["geo"] = (get_geo_data, proxy_ip)
+        timeout = (deadline.budget(connect_timeout), deadline.budget(read_timeout))
+        if "dns_leak" in checks:
+            stages["dns_leak"] = (dns_leak_test, proxies, session, timeout)
+        if "ssl" in checks:
+            stages["ssl"] = (ssl_verification, proxies["https"], session, timeout)
+        if "reputation" in checks:
+            stages["reputation"] = (get_reputation_data, proxy_ip)
+
+        values, stage_latency_ms = run_stages(stages, deadline.budget(ENRICHMENT_TIMEOUT), deadline.unfinished)
 
-        # Add DNS leak and SSL verification if user_plan is not BASIC or PRO
-        if user_plan not in ['BASIC', 'PRO']:
-            result["dns_leak_detected"] = dns_leak_test(proxies)
-            result["ssl_verified"] = ssl_verification(proxies["https"])
-
-        # Add reputation and blacklist check if user_plan is not BASIC, PRO, or ULTRA
-        if user_plan not in ['BASIC', 'PRO', 'ULTRA']:
-            reputation_data = get_reputation_data(proxy_ip)
-            result["reputation_score"] = reputation_data.get("reputation_score")
-            result["blacklisted"] = reputation_data.get("blacklisted")
-            result["threat_type"] = reputation_data.get("threat_type")
-
-        return result
-
-    except requests.exceptions.Timeout as e:
-        return {"status": "dead", "error": f"Timeout: {str(e)}"}
-    except requests.exceptions.ConnectionError as e:
-        return {"status": "dead", "error": f"ConnectionError: {str(e)} (Note: SOCKS proxies require PySocks library)"}
-    except requests.exceptions.HTTPError as e:
-        return {"status": "dead", "error": f"HTTPError: {str(e)}"}
-    except requests.exceptions.RequestException as e:
-        return {"status": "dead", "error": f"RequestException: {str(e)}"}
+    latency_breakdown_ms = {
+        "connect": probe.get("connect_ms"),
+        "handshake": probe.get("handshake_ms"),
+        "tls": probe.get("tls_ms"),
+        "ttfb": round(ttfb_ms),
+        "total": round(total_ms),
+    }
+    return live_result(proxy_type, samples_ms, origin_ip != proxy_ip, values, user_plan, checks,
+                       latency_breakdown_ms, {"probe": round(probe_ms), **stage_latency_ms}, samples)
@@ -0,0 +1,207 @@
+"""
+Offline IP-range to country/ISP/ASN lookups.
+
+Ranges are kept in sorted, array-backed interval tables and found with a
+binary search, so a lookup takes microseconds and never touches the network.
+The compact binary format is memory-mapped, which lets every gunicorn and
+Celery process on a host share the same pages.
+
+Build the binary file from a CSV of `start_ip,end_ip,country,isp,asn` rows:
+
+    python -m proxy_checker.geo_db build ranges.csv geo.bin
+
+Binary layout (all integers little-endian uint32):
+
+    header          magic "PCGEO1", range count, record count, string count, reserved
+    starts          one per range, sorted ascending
+    ends            one per range
+    record_ids      one per range, index into records
+    records         three string ids (country, isp, asn) per record
+    string_offsets  string count + 1 offsets into the string data
+    string_data     UTF-8 bytes
+"""
+import argparse
+import array
+import bisect
+import csv
+import ipaddress
+import mmap
+import struct
+import sys
+
+MAGIC = b"PCGEO1\x00\x00"
+HEADER = struct.Struct("<8sIIII")
+UINT32 = 4
+
+
+def _ip_to_int(value: str) -> int:
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    return int(ipaddress.IPv4Address(value))
+
+
+def _read_csv(path: str) -> list:
+    rows = []
+    with open(path, newline='', encoding='utf-8') as csv_file:
+        for line_number, row in enumerate(csv.reader(csv_file), start=1):
+            if not row or row[0].startswith('#'):
+                continue
+            try:
+                start, end = _ip_to_int(row[0]), _ip_to_int(row[1])
+            except (ValueError, IndexError):
+                if line_number == 1:
+                    continue  # Header row
+                raise ValueError(f"{path}:{line_number}: invalid IP range {row[:2]}")
+            if end < start:
+                raise ValueError(f"{path}:{line_number}: range end is before its start")
+            country, isp, asn = (row[2:5] + ['', '', ''])[:3]
+            rows.append((start, end, country.strip(), isp.strip(), asn.strip()))
+    return rows
+
+
+def encode(rows: list) -> bytes:
+    """
+    Encodes (start, end, country, isp, asn) rows into the binary format.
+    Ranges must not overlap.
+    """
+    rows = sorted(rows)
+    strings = {"": 0}
+    records = {}
+    starts, ends, record_ids = array.array('I'), array.array('I'), array.array('I')
+    record_table = array.array('I')
+
+    previous_end = -1
+    for start, end, country, isp, asn in rows:
+        if start <= previous_end:
+            raise ValueError(f"Overlapping IP ranges at {ipaddress.IPv4Address(start)}")
+        previous_end = end
+        string_ids = tuple(strings.setdefault(value, len(strings)) for value in (country, isp, asn))
+        if string_ids not in records:
+            records[string_ids] = len(records)
+            record_table.extend(string_ids)
+        starts.append(start)
+        ends.append(end)
+        record_ids.append(records[string_ids])
+
+    string_offsets = array.array('I', [0])
+    string_data = bytearray()
+    for value in strings:  # dicts keep insertion order, which matches the ids
+        string_data += value.encode('utf-8')
+        string_offsets.append(len(string_data))
+
+    sections = [starts, ends, record_ids, record_table, string_offsets]
+    if sys.byteorder != 'little':
+        for section in sections:
+            section.byteswap()
+    header = HEADER.pack(MAGIC, len(starts), len(records), len(strings), 0)
+    return header + b"".join(section.tobytes() for section in sections) + bytes(string_data)
+
+
+class GeoDatabase:
+    """
+    Read-only interval table over a buffer in the binary format.
+    """
+
+    def __init__(self, buffer, source=None):
+        self._source = source
+        self._buffer = memoryview(buffer)
+        magic, n_ranges, n_records, n_strings, _ = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC:
+            raise ValueError("Not a proxy_checker geo database")
+
+        offset = HEADER.size
+
+        def table(count):
+            nonlocal offset
+            view = self._buffer[offset:offset + count * UINT32]
+            offset += count * UINT32
+            if sys.byteorder != 'little':
+                swapped = array.array('I', view.tobytes())
+                swapped.byteswap()
+                return swapped
+            return view.cast('I')
+
+        self._starts = table(n_ranges)
+        self._ends = table(n_ranges)
+        self._record_ids = table(n_ranges)
+        self._records = table(n_records * 3)
+        self._string_offsets = table(n_strings + 1)
+        self._string_data = self._buffer[offset:]
+
+    @classmethod
+    def open(cls, path: str) -> "GeoDatabase":
+        """
+        Opens a binary database (memory-mapped) or a CSV file (loaded into memory).
+        """
+        with open(path, 'rb') as db_file:
+            is_binary = db_file.read(len(MAGIC)) == MAGIC
+            if is_binary:
+                mapped = mmap.mmap(db_file.fileno(), 0, access=mmap.ACCESS_READ)
+                return cls(mapped, source=mapped)
+        return cls(encode(_read_csv(path)))
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def _string(self, string_id: int) -> str:
+        start, end = self._string_offsets[string_id], self._string_offsets[string_id + 1]
+        return bytes(self._string_data[start:end]).decode('utf-8') or None
+
+    def lookup(self, ip: str) -> dict:
+        """
+        Returns {"country", "isp", "as"} for ip in the same shape as ip-api.com,
+        or {} if the address isn't covered.
+        """
+        try:
+            address = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return {}
+        index = bisect.bisect_right(self._starts, address) - 1
+        if index < 0 or address > self._ends[index]:
+            return {}
+        record = self._record_ids[index] * 3
+        country, isp, asn = (self._string(self._records[record + i]) for i in range(3))
+        return {"country": country, "isp": isp, "as": asn}
+
+    def close(self) -> None:
+        for view in (self._starts, self._ends, self._record_ids, self._records,
+                     self._string_offsets, self._string_data, self._buffer):
+            if isinstance(view, memoryview):
+                view.release()
+        if self._source is not None:
+            self._source.close()
+
+
+def build(csv_path: str, output_path: str) -> int:
+    """
+    Converts a CSV of IP ranges into the binary format. Returns the range count.
+    """
+    rows = _read_csv(csv_path)
+    with open(output_path, 'wb') as output:
+        output.write(encode(rows))
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m proxy_checker.geo_db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="convert a CSV of IP ranges to the binary format")
+    build_parser.add_argument("csv_path")
+    build_parser.add_argument("output_path")
+    lookup_parser = commands.add_parser("lookup", help="look up IPs in a CSV or binary database")
+    lookup_parser.add_argument("db_path")
+    lookup_parser.add_argument("ips", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        count = build(args.csv_path, args.output_path)
+        print(f"Wrote {count} ranges to {args.output_path}")
+    else:
+        db = GeoDatabase.open(args.db_path)
+        for ip in args.ips:
+            print(f"{ip}\t{db.lookup(ip)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Incremental parsing of streamed async job input.
+
+Large jobs are uploaded as a body of one proxy per line: NDJSON (a proxy
+object per line) or plain text (`ip:port` per line, optionally
+`type://ip:port`), either of them optionally gzip-compressed. Lines are
+read from the request stream and parsed one at a time, so a job's input is
+never held in memory as a whole.
+"""
+import gzip
+import json
+import zlib
+
+# Longest line accepted, in bytes.
+MAX_LINE_BYTES = 4096
+
+# Content types of streamed input and the format each is parsed as.
+STREAM_FORMATS = {"application/x-ndjson": "ndjson", "text/plain": "text"}
+
+
+def _lines(stream):
+    number = 0
+    while True:
+        line = stream.readline(MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > MAX_LINE_BYTES:
+            raise ValueError(f"Line {number} is longer than {MAX_LINE_BYTES} bytes.")
+        yield number, line.strip()
+
+
+def parse_line(line: bytes, fmt: str, proxy_type: str = None, number: int = 1) -> dict:
+    """
+    Parses one non-blank line into a proxy object. proxy_type is the type of
+    plain-text proxies without a type:// prefix, and the default type of
+    NDJSON objects without one.
+    """
+    if fmt == "ndjson":
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {number} is not valid JSON.")
+        if not isinstance(entry, dict):
+            raise ValueError(f"Line {number} must be a JSON object.")
+        if proxy_type and not entry.get("type"):
+            entry["type"] = proxy_type
+        return entry
+
+    text = line.decode("utf-8", "replace")
+    scheme, separator, proxy = text.partition("://")
+    if separator:
+        return {"proxy": proxy, "type": scheme.lower()}
+    return {"proxy": text, "type": proxy_type}
+
+
+def iter_entries(stream, fmt: str, proxy_type: str = None, compressed: bool = False, limit: int = None):
+    """
+    Yields the proxy objects in a stream of lines in format fmt ("ndjson"
+    or "text"), as they are read. Blank lines, and lines starting with # in
+    plain text, are skipped. Raises ValueError with a client-facing message
+    for a malformed line, invalid gzip data, or more than limit proxies.
+    """
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    count = 0
+    try:
+        for number, line in _lines(stream):
+            if not line or (fmt == "text" and line.startswith(b"#")):
+                continue
+            count += 1
+            if limit is not None and count > limit:
+                raise ValueError(f"Maximum {limit} proxies allowed per asynchronous request.")
+            yield parse_line(line, fmt, proxy_type, number)
+    except (OSError, EOFError, zlib.error) as e:
+        if not compressed:
+            raise
+        raise ValueError(f"Request body is not valid gzip data: {e}")
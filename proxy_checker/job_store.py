@@ -0,0 +1,388 @@
+"""
+Storage for async jobs, keyed by job_id.
+
+Workers write each result under its input index as soon as it is checked,
+and readers page through results (optionally filtered by status) without
+loading a whole job. Two backends share one interface: Redis for
+deployments, where API and workers run on different hosts, and SQLite for
+local runs and tests. Results are stored in the compact encoding from
+proxy_checker.results and read back as verbose result dicts.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from proxy_checker.results import decode_result, encode_result
+
+JOB_STORE_URL = os.getenv('JOB_STORE_URL', 'redis://localhost:6379/1')
+# Seconds a job and its results are kept after its last write (Redis backend).
+JOB_TTL_SECONDS = int(os.getenv('JOB_TTL_SECONDS', '86400'))
+
+
+def _encode(result: dict) -> str:
+    return json.dumps(encode_result(result), separators=(",", ":"))
+
+
+def _decode(value) -> dict:
+    return decode_result(json.loads(value))
+
+
+def result_status(result: dict) -> str:
+    """
+    Status a result is filed under: its own status ("alive", "dead",
+    "timed_out"), or "error" for entries that were rejected before a check.
+    """
+    return result.get("status") or "error"
+
+
+def _job(total: int, status: str, created_at: float, error: str, counts: dict, callback: dict = None) -> dict:
+    done = sum(counts.values())
+    alive = counts.get("alive", 0)
+    return {"status": status, "total": total, "created_at": created_at, "error": error,
+            "done": done, "alive": alive, "dead": done - alive, "callback": callback}
+
+
+class SQLiteJobStore:
+    """
+    Job store in a SQLite file, or in memory for ":memory:".
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, total INTEGER, "
+                             "status TEXT, created_at REAL, error TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (job_id TEXT, idx INTEGER, status TEXT, "
+                             "result TEXT, PRIMARY KEY (job_id, idx))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_by_status ON results (job_id, status, idx)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS callbacks (job_id TEXT PRIMARY KEY, info TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS backlogs (tenant TEXT PRIMARY KEY, pending INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS pending_chunks (job_id TEXT PRIMARY KEY, pending INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS batch_results (job_id TEXT, idx INTEGER, result TEXT, "
+                             "PRIMARY KEY (job_id, idx))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS batches (job_id TEXT PRIMARY KEY, sent_at REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS webhook_stats (name TEXT PRIMARY KEY, count INTEGER)")
+
+    def create(self, job_id: str, total: int) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, 'pending', ?, NULL)",
+                             (job_id, total, time.time()))
+
+    def put_results(self, job_id: str, offset: int, results: list) -> None:
+        """
+        Stores results at input indexes offset, offset + 1, ... Writing an
+        index again replaces its result.
+        """
+        self.put_indexed_results(job_id, [(offset + i, result) for i, result in enumerate(results)])
+
+    def put_indexed_results(self, job_id: str, items: list) -> None:
+        """
+        Stores (index, result) pairs, for results fanned out to several indexes.
+        """
+        rows = [(job_id, index, result_status(result), _encode(result)) for index, result in items]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+            self._db.execute("UPDATE jobs SET status = 'progress' WHERE job_id = ? AND status = 'pending'", (job_id,))
+            self._db.execute("COMMIT")
+
+    def finish(self, job_id: str, error: str = None) -> None:
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = ?, error = ? WHERE job_id = ?",
+                             ('failed' if error else 'completed', error, job_id))
+
+    def set_callback(self, job_id: str, info: dict) -> None:
+        """
+        Records the delivery state of the job's callback.
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO callbacks VALUES (?, ?)", (job_id, json.dumps(info)))
+
+    def adjust_backlog(self, tenant: str, delta: int) -> int:
+        """
+        Adds delta to the tenant's count of queued chunks and returns the new
+        count (never below 0).
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("INSERT OR IGNORE INTO backlogs VALUES (?, 0)", (tenant,))
+            self._db.execute("UPDATE backlogs SET pending = MAX(pending + ?, 0) WHERE tenant = ?", (delta, tenant))
+            pending = self._db.execute("SELECT pending FROM backlogs WHERE tenant = ?", (tenant,)).fetchone()[0]
+            self._db.execute("COMMIT")
+        return pending
+
+    def add_pending(self, job_id: str, chunks: int, entries: int = 0) -> int:
+        """
+        For jobs dispatched while their input is still arriving: adds chunks
+        to the job's count of unfinished chunks and entries to its total.
+        Returns the new count of unfinished chunks.
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("UPDATE jobs SET total = total + ? WHERE job_id = ?", (entries, job_id))
+            self._db.execute("INSERT OR IGNORE INTO pending_chunks VALUES (?, 0)", (job_id,))
+            self._db.execute("UPDATE pending_chunks SET pending = pending + ? WHERE job_id = ?", (chunks, job_id))
+            pending = self._db.execute("SELECT pending FROM pending_chunks WHERE job_id = ?", (job_id,)).fetchone()[0]
+            self._db.execute("COMMIT")
+        return pending
+
+    def release_pending(self, job_id: str) -> int:
+        """
+        Marks one of the job's chunks finished and returns how many are left.
+        Exactly one caller sees 0.
+        """
+        return self.add_pending(job_id, -1)
+
+    def add_batch(self, job_id: str, items: list) -> tuple:
+        """
+        Buffers (index, result) pairs for the job's next partial callback,
+        whichever chunk they come from. Returns how many results are
+        buffered and the seconds since the job's last batch was taken (or
+        since it was created).
+        """
+        rows = [(job_id, index, _encode(result)) for index, result in items]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO batch_results VALUES (?, ?, ?)", rows)
+            pending = self._db.execute("SELECT COUNT(*) FROM batch_results WHERE job_id = ?", (job_id,)).fetchone()[0]
+            last = self._db.execute("SELECT COALESCE((SELECT sent_at FROM batches WHERE job_id = ?), "
+                                    "(SELECT created_at FROM jobs WHERE job_id = ?))", (job_id, job_id)).fetchone()[0]
+            self._db.execute("COMMIT")
+        return pending, time.time() - (last or time.time())
+
+    def take_batch(self, job_id: str) -> list:
+        """
+        Removes and returns the job's buffered [(index, result)] in input
+        order. Concurrent callers never get the same result twice.
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            rows = self._db.execute("SELECT idx, result FROM batch_results WHERE job_id = ? ORDER BY idx",
+                                    (job_id,)).fetchall()
+            self._db.execute("DELETE FROM batch_results WHERE job_id = ?", (job_id,))
+            self._db.execute("INSERT OR REPLACE INTO batches VALUES (?, ?)", (job_id, time.time()))
+            self._db.execute("COMMIT")
+        return [(index, _decode(result)) for index, result in rows]
+
+    def count_webhooks(self, name: str, amount: int = 1) -> None:
+        """
+        Adds amount to a webhook delivery counter shared by every process.
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("INSERT OR IGNORE INTO webhook_stats VALUES (?, 0)", (name,))
+            self._db.execute("UPDATE webhook_stats SET count = count + ? WHERE name = ?", (amount, name))
+            self._db.execute("COMMIT")
+
+    def webhook_stats(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute("SELECT name, count FROM webhook_stats").fetchall())
+
+    def get(self, job_id: str) -> dict:
+        """
+        Returns the job's status, total, created_at, error, done/alive/dead
+        counts and callback delivery state, or None for an unknown job.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT total, status, created_at, error FROM jobs WHERE job_id = ?",
+                                   (job_id,)).fetchone()
+            if row is None:
+                return None
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM results WHERE job_id = ? GROUP BY status",
+                                           (job_id,)).fetchall())
+            callback = self._db.execute("SELECT info FROM callbacks WHERE job_id = ?", (job_id,)).fetchone()
+        total, status, created_at, error = row
+        return _job(total, status, created_at, error, counts, json.loads(callback[0]) if callback else None)
+
+    def results(self, job_id: str, offset: int = 0, limit: int = None, statuses=None):
+        """
+        Returns (matching, page): how many stored results match statuses
+        (all if None), and [(index, result)] for the page of them starting
+        at offset, in input order.
+        """
+        where, params = "job_id = ?", [job_id]
+        if statuses:
+            where += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params += list(statuses)
+        with self._lock:
+            matching = self._db.execute(f"SELECT COUNT(*) FROM results WHERE {where}", params).fetchone()[0]
+            rows = self._db.execute(f"SELECT idx, result FROM results WHERE {where} ORDER BY idx LIMIT ? OFFSET ?",
+                                    params + [-1 if limit is None else limit, offset]).fetchall()
+        return matching, [(index, _decode(result)) for index, result in rows]
+
+
+class RedisJobStore:
+    """
+    Job store in Redis. A job is a hash of its fields plus a hash of
+    results by index, a sorted set of finished indexes and one sorted set of
+    indexes per result status, so pages and counts never read the whole job.
+    """
+
+    def __init__(self, client, namespace: str = "proxy_checker:job:", ttl: int = JOB_TTL_SECONDS):
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _key(self, job_id: str, *parts) -> str:
+        return ":".join((self.namespace + job_id,) + parts)
+
+    def create(self, job_id: str, total: int) -> None:
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(job_id), mapping={"total": total, "status": "pending", "created_at": time.time()})
+        pipe.expire(self._key(job_id), self.ttl)
+        pipe.execute()
+
+    def put_results(self, job_id: str, offset: int, results: list) -> None:
+        self.put_indexed_results(job_id, [(offset + i, result) for i, result in enumerate(results)])
+
+    def put_indexed_results(self, job_id: str, items: list) -> None:
+        keys = {self._key(job_id), self._key(job_id, "results"), self._key(job_id, "done"),
+                self._key(job_id, "statuses")}
+        # A rewritten index (a redelivered chunk) may have been filed under another status
+        statuses = {status.decode() for status in self.client.smembers(self._key(job_id, "statuses"))}
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(job_id, "results"), mapping={index: _encode(result) for index, result in items})
+        pipe.zadd(self._key(job_id, "done"), {index: index for index, _ in items})
+        for index, result in items:
+            status = result_status(result)
+            status_key = self._key(job_id, "status", status)
+            for other in statuses - {status}:
+                pipe.zrem(self._key(job_id, "status", other), index)
+            pipe.zadd(status_key, {index: index})
+            pipe.sadd(self._key(job_id, "statuses"), status)
+            keys.add(status_key)
+        for key in keys:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def finish(self, job_id: str, error: str = None) -> None:
+        fields = {"status": "failed" if error else "completed"}
+        if error:
+            fields["error"] = error
+        self.client.hset(self._key(job_id), mapping=fields)
+
+    def set_callback(self, job_id: str, info: dict) -> None:
+        self.client.hset(self._key(job_id), "callback", json.dumps(info))
+
+    def adjust_backlog(self, tenant: str, delta: int) -> int:
+        # Expires like a job, so a count left over by a lost worker doesn't deprioritise a tenant for good
+        key = self.namespace + "_backlogs"
+        pipe = self.client.pipeline()
+        pipe.hincrby(key, tenant, delta)
+        pipe.expire(key, self.ttl)
+        pending = int(pipe.execute()[0])
+        if pending < 0:
+            self.client.hset(key, tenant, 0)
+            pending = 0
+        return pending
+
+    def add_pending(self, job_id: str, chunks: int, entries: int = 0) -> int:
+        pipe = self.client.pipeline()
+        pipe.hincrby(self._key(job_id), "pending", chunks)
+        if entries:
+            pipe.hincrby(self._key(job_id), "total", entries)
+        pipe.expire(self._key(job_id), self.ttl)
+        return int(pipe.execute()[0])
+
+    def release_pending(self, job_id: str) -> int:
+        return self.add_pending(job_id, -1)
+
+    def add_batch(self, job_id: str, items: list) -> tuple:
+        batch_key = self._key(job_id, "batch")
+        pipe = self.client.pipeline()
+        if items:
+            pipe.hset(batch_key, mapping={index: _encode(result) for index, result in items})
+        pipe.expire(batch_key, self.ttl)
+        pipe.hlen(batch_key)
+        pipe.hmget(self._key(job_id), ["batch_sent", "created_at"])
+        *_, pending, (sent_at, created_at) = pipe.execute()
+        last = sent_at or created_at
+        return int(pending), time.time() - (float(last) if last else time.time())
+
+    def take_batch(self, job_id: str) -> list:
+        # A MULTI/EXEC pipeline: of two concurrent takers, one gets the batch and the other nothing
+        batch_key = self._key(job_id, "batch")
+        pipe = self.client.pipeline()
+        pipe.hgetall(batch_key)
+        pipe.delete(batch_key)
+        pipe.hset(self._key(job_id), "batch_sent", time.time())
+        buffered = pipe.execute()[0]
+        return sorted(((int(index), _decode(value)) for index, value in buffered.items()), key=lambda item: item[0])
+
+    def count_webhooks(self, name: str, amount: int = 1) -> None:
+        self.client.hincrby(self.namespace + "_webhooks", name, amount)
+
+    def webhook_stats(self) -> dict:
+        counts = self.client.hgetall(self.namespace + "_webhooks")
+        return {(name.decode() if isinstance(name, bytes) else name): int(count) for name, count in counts.items()}
+
+    def get(self, job_id: str) -> dict:
+        fields = self.client.hgetall(self._key(job_id))
+        if not fields:
+            return None
+        fields = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+                  for k, v in fields.items()}
+        statuses = [status.decode() if isinstance(status, bytes) else status
+                    for status in self.client.smembers(self._key(job_id, "statuses"))]
+        counts = {status: self.client.zcard(self._key(job_id, "status", status)) for status in statuses}
+        callback = json.loads(fields["callback"]) if fields.get("callback") else None
+        # A pending job is in progress once it has results. This isn't written with the results, or a
+        # late chunk would overwrite a job that has already completed or failed.
+        status = fields["status"]
+        if status == "pending" and any(counts.values()):
+            status = "progress"
+        return _job(int(fields["total"]), status, float(fields["created_at"]), fields.get("error"), counts, callback)
+
+    def results(self, job_id: str, offset: int = 0, limit: int = None, statuses=None):
+        if not statuses:
+            index_key = self._key(job_id, "done")
+        elif len(statuses) == 1:
+            index_key = self._key(job_id, "status", statuses[0])
+        else:
+            # Merge the per-status sets into a short-lived one to page through
+            index_key = self._key(job_id, "filter", ",".join(sorted(statuses)))
+            pipe = self.client.pipeline()
+            pipe.zunionstore(index_key, [self._key(job_id, "status", status) for status in statuses])
+            pipe.expire(index_key, 60)
+            pipe.execute()
+
+        matching = self.client.zcard(index_key)
+        end = -1 if limit is None else offset + limit - 1
+        indexes = [int(index) for index in self.client.zrange(index_key, offset, end)] if limit != 0 else []
+        if not indexes:
+            return matching, []
+        values = self.client.hmget(self._key(job_id, "results"), indexes)
+        return matching, [(index, _decode(value)) for index, value in zip(indexes, values) if value is not None]
+
+
+def open_job_store(url: str):
+    """
+    Opens the job store at url: redis://... or sqlite:///path/to/file
+    (sqlite:// alone for an in-memory store).
+    """
+    if url.startswith('sqlite://'):
+        path = url[len('sqlite://'):]
+        return SQLiteJobStore(path[1:] if path.startswith('/') else path or ":memory:")
+    import redis
+    return RedisJobStore(redis.Redis.from_url(url))
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """
+    Returns the process-wide job store configured by JOB_STORE_URL.
+    """
+    global _job_store
+    if _job_store is None:
+        with _job_store_lock:
+            if _job_store is None:
+                _job_store = open_job_store(JOB_STORE_URL)
+    return _job_store
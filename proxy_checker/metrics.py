@@ -0,0 +1,173 @@
+"""
+Prometheus metrics for the API and the Celery workers.
+
+Checks record their total time by status, a latency histogram per stage
+(pre-probe, probe, geo, DNS leak, SSL, reputation) where they got that
+far, their outcome and error code, and how many are running. The caches, the rate limiter and webhook deliveries count
+their events in the counters below as they happen, next to the
+per-process counters of /stats. The broker's queue depths are read when
+metrics are scraped.
+
+The API serves the metrics at /metrics; Celery workers export them on
+WORKER_METRICS_PORT. With several processes per host (gunicorn workers,
+prefork Celery children), set PROMETHEUS_MULTIPROC_DIR to a directory
+shared by them so all metrics are summed across processes.
+"""
+import functools
+import os
+import time
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+from proxy_checker.results import classify_error
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Stage latencies range from a cached geo lookup (~1ms) to a probe that hits its read timeout.
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram('proxy_checker_stage_seconds', 'Time spent in each stage of a proxy check.', ['stage'],
+                          buckets=STAGE_BUCKETS)
+# Stage timings only exist for proxies that answered; dead and timed-out checks are timed as a whole.
+CHECK_SECONDS = Histogram('proxy_checker_check_seconds', 'Time taken by whole proxy checks, by status.', ['status'],
+                          buckets=STAGE_BUCKETS)
+CHECKS = Counter('proxy_checker_checks', 'Proxy checks run, by status and error code.', ['status', 'error_code'])
+CHECKS_IN_FLIGHT = Gauge('proxy_checker_checks_in_flight', 'Proxy checks currently running.',
+                         multiprocess_mode='livesum')
+JOBS = Counter('proxy_checker_jobs', 'Async jobs finished, by final status.', ['status'])
+
+CACHE_EVENTS = {
+    event: Counter(f'proxy_checker_cache_{event}', f'Cache {event.replace("_", " ")}.', ['cache'])
+    for event in ("hits", "shared_hits", "misses", "evictions", "expirations", "shared_errors", "coalesced")
+}
+RATE_LIMIT_EVENTS = {
+    "acquired": Counter('proxy_checker_rate_limit_acquired', 'Outbound calls let through.', ['key']),
+    "waited": Counter('proxy_checker_rate_limit_waited', 'Outbound calls that waited for a slot.', ['key']),
+    "wait_ms": Counter('proxy_checker_rate_limit_wait_seconds', 'Total time spent waiting for slots.', ['key']),
+    "throttled": Counter('proxy_checker_rate_limit_throttled', 'Outbound calls skipped for want of a slot.',
+                         ['key']),
+    "shared_errors": Counter('proxy_checker_rate_limit_shared_errors', 'Errors reaching the shared buckets.',
+                             ['key']),
+}
+WEBHOOK_EVENTS = {
+    name: Counter(f'proxy_checker_webhook_{name}', f'Webhook deliveries: {name.replace("_", " ")}.')
+    for name in ("attempts", "delivered", "retried", "failed", "bytes_sent")
+}
+
+_collectors = []
+
+
+def observe_check(result: dict, seconds: float = None) -> None:
+    """
+    Records a finished check: how long it took (seconds, if timed), the
+    latency of each stage it ran, and its outcome.
+    """
+    if seconds is not None:
+        CHECK_SECONDS.labels(result.get("status") or "error").observe(seconds)
+    breakdown = result.get("latency_breakdown_ms") or {}
+    preprobe_ms = [breakdown.get(part) for part in ("connect", "handshake", "tls") if breakdown.get(part) is not None]
+    if preprobe_ms:
+        STAGE_SECONDS.labels("preprobe").observe(sum(preprobe_ms) / 1000)
+    for stage, latency_ms in (result.get("stage_latency_ms") or {}).items():
+        if latency_ms is not None:
+            STAGE_SECONDS.labels(stage).observe(latency_ms / 1000)
+
+    error = result.get("error")
+    error_code = "none"
+    if error is not None:
+        error_code = classify_error(error, result.get("status"), result.get("dead_reason")).name.lower()
+    CHECKS.labels(result.get("status") or "error", error_code).inc()
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """
+    Records a stage run outside any one check, such as the batched geo
+    lookup of bulk checks.
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def instrument_check(check):
+    """
+    Decorates a blocking checker so it counts as in flight while it runs
+    and its result is recorded with observe_check.
+    """
+    @functools.wraps(check)
+    def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        with CHECKS_IN_FLIGHT.track_inprogress():
+            result = check(*args, **kwargs)
+        observe_check(result, time.monotonic() - start)
+        return result
+    return wrapper
+
+
+def instrument_check_async(check):
+    """
+    instrument_check for coroutine checkers.
+    """
+    @functools.wraps(check)
+    async def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        with CHECKS_IN_FLIGHT.track_inprogress():
+            result = await check(*args, **kwargs)
+        observe_check(result, time.monotonic() - start)
+        return result
+    return wrapper
+
+
+class QueueDepthCollector:
+    """
+    Exposes the number of messages waiting in each Celery queue, read from
+    the broker by queue_depths() ({queue: count}) at scrape time.
+    """
+
+    def __init__(self, queue_depths):
+        self.queue_depths = queue_depths
+
+    def describe(self):
+        # Registering must not connect to the broker
+        return []
+
+    def collect(self):
+        depth = GaugeMetricFamily('proxy_checker_queue_depth', 'Messages waiting in a Celery queue.',
+                                  labels=['queue'])
+        try:
+            depths = self.queue_depths()
+        except Exception:
+            depths = {}  # Broker unreachable: report nothing rather than failing the scrape
+        for queue, count in depths.items():
+            depth.add_metric([queue], count)
+        yield depth
+
+
+def register_collector(collector) -> None:
+    """
+    Adds a collector that is read at scrape time.
+    """
+    _collectors.append(collector)
+    if not PROMETHEUS_MULTIPROC_DIR:
+        REGISTRY.register(collector)
+
+
+def metrics_registry():
+    """
+    The registry to expose: the default one, or with PROMETHEUS_MULTIPROC_DIR
+    set, one summing the metrics of all processes plus the collectors of
+    this one.
+    """
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _collectors:
+        registry.register(collector)
+    return registry
+
+
+def render_metrics() -> bytes:
+    """
+    Metrics in the Prometheus text format.
+    """
+    return generate_latest(metrics_registry())
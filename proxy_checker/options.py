@@ -0,0 +1,93 @@
+"""
+Parsing of the optional per-proxy check settings accepted by the API and workers.
+"""
+
+MAX_TIMEOUT_SECONDS = 30
+MAX_SAMPLES = 10
+MAX_DEADLINE_MS = 60000
+
+# Optional stages of a check, in the order they are listed.
+CHECKS = ("geo", "dns_leak", "ssl", "reputation")
+# Result fields and the stage that produces each; None for fields every check has.
+FIELD_CHECKS = {
+    "status": None, "proxy_type": None, "latency_ms": None, "anonymous": None, "latency_breakdown_ms": None,
+    "latency_samples_ms": None, "stage_latency_ms": None,
+    "error": None, "error_code": None, "detail": None, "dead_reason": None,
+    "country": "geo", "isp": "geo", "asn": "geo",
+    "dns_leak_detected": "dns_leak",
+    "ssl_verified": "ssl",
+    "reputation_score": "reputation", "blacklisted": "reputation", "threat_type": "reputation",
+}
+
+
+def _seconds(data: dict, name: str) -> float:
+    value = data[name]
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value <= MAX_TIMEOUT_SECONDS:
+        raise ValueError(f"'{name}' must be a number of seconds between 0 and {MAX_TIMEOUT_SECONDS}.")
+    return float(value)
+
+
+def _names(data: dict, name: str, allowed) -> list:
+    value = data[name]
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(',') if item.strip()]
+    if not isinstance(value, list) or not all(isinstance(item, str) and item in allowed for item in value):
+        raise ValueError(f"'{name}' must be a list (or comma-separated string) of: {', '.join(allowed)}.")
+    return value
+
+
+def parse_checks(data: dict) -> tuple:
+    """
+    Returns the stages selected by the checks and/or fields of a proxy
+    object, in CHECKS order, or None if neither is set (run every stage the
+    plan includes). Raises ValueError for unknown names.
+    """
+    if data.get('checks') is None and data.get('fields') is None:
+        return None
+    selected = set()
+    if data.get('checks') is not None:
+        selected.update(_names(data, 'checks', CHECKS))
+    if data.get('fields') is not None:
+        selected.update(FIELD_CHECKS[field] for field in _names(data, 'fields', tuple(FIELD_CHECKS)))
+    return tuple(check for check in CHECKS if check in selected)
+
+
+def parse_check_options(data: dict) -> dict:
+    """
+    Returns the check_proxy keyword arguments set in a proxy object.
+    Only options that are present are returned. Raises ValueError with a
+    client-facing message for the first invalid one.
+    """
+    options = {}
+    for name in ('connect_timeout', 'read_timeout'):
+        if data.get(name) is not None:
+            options[name] = _seconds(data, name)
+    if data.get('samples') is not None:
+        samples = data['samples']
+        if isinstance(samples, bool) or not isinstance(samples, int) or not 1 <= samples <= MAX_SAMPLES:
+            raise ValueError(f"'samples' must be a whole number between 1 and {MAX_SAMPLES}.")
+        options['samples'] = samples
+    if data.get('deadline_ms') is not None:
+        deadline_ms = data['deadline_ms']
+        if (isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float))
+                or not 0 < deadline_ms <= MAX_DEADLINE_MS):
+            raise ValueError(f"'deadline_ms' must be a number of milliseconds between 0 and {MAX_DEADLINE_MS}.")
+        options['deadline_ms'] = deadline_ms
+    checks = parse_checks(data)
+    if checks is not None:
+        options['checks'] = checks
+    return options
+
+
+def parse_max_age(data: dict) -> float:
+    """
+    Returns the max_age set in a proxy object (seconds a cached result may
+    be old, 0 to force a fresh check), or None if it isn't set. Raises
+    ValueError with a client-facing message if it is invalid.
+    """
+    max_age = data.get('max_age')
+    if max_age is None:
+        return None
+    if isinstance(max_age, bool) or not isinstance(max_age, (int, float)) or max_age < 0:
+        raise ValueError("'max_age' must be a number of seconds, 0 or more.")
+    return float(max_age)
@@ -0,0 +1,401 @@
+"""
+Fail-fast pre-probe run before the full HTTP check.
+
+A raw TCP connect plus the opening of the proxy handshake (SOCKS5 greeting,
+SOCKS4 connect request or HTTP CONNECT) under a short connect timeout. Most
+dead proxies fail here within that timeout instead of costing a full
+request timeout, and they fail with a specific reason. The same handshakes
+fingerprint proxies of unknown type for type="auto".
+"""
+import os
+import socket
+import ssl
+import time
+
+from proxy_checker import protocols
+
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', '3'))
+DEFAULT_READ_TIMEOUT = float(os.getenv('READ_TIMEOUT', '5'))
+
+PREPROBE_TYPES = ('http', 'https', 'socks4', 'socks5')
+# Order in which type="auto" fingerprints a proxy. HTTP CONNECT goes first:
+# SOCKS servers reject its leading 'C' as a protocol version and close at
+# once, whereas most HTTP proxies wait for a full request line and would let
+# a SOCKS request time out.
+AUTO_DETECT_TYPES = ('http', 'socks5', 'socks4')
+
+HTTP_REPLY_PREFIX = b'HTTP/'
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise protocols.ProxyProtocolError("Proxy closed the connection during the handshake")
+        data += chunk
+    return data
+
+
+def _recv_status_line(sock: socket.socket) -> bytes:
+    """
+    Reads a CONNECT response head and returns its status line.
+    """
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = sock.recv(1024)
+        if not chunk:
+            raise protocols.ProxyProtocolError("Proxy closed the connection during the handshake")
+        data += chunk
+        if len(data) > 8192:
+            break
+    return data.split(b"\r\n", 1)[0]
+
+
+def handshake(sock: socket.socket, proxy_type: str, target_host: str, target_port: int,
+              username: str = None, password: str = None) -> int:
+    """
+    Opens the proxy handshake on a connected socket, raising
+    ProxyProtocolError if the proxy doesn't speak proxy_type. Returns the
+    CONNECT status for HTTP proxies. SOCKS4 tunnels are open afterwards,
+    HTTP tunnels if the status is 200.
+    """
+    if proxy_type == 'socks5':
+        with_auth = bool(username and password)
+        sock.sendall(protocols.socks5_greeting(with_auth))
+        method = protocols.parse_socks5_method(_recv_exactly(sock, 2))
+        if method == protocols.SOCKS5_USER_PASS:
+            sock.sendall(protocols.socks5_auth_request(username, password))
+            protocols.check_socks5_auth_reply(_recv_exactly(sock, 2))
+    elif proxy_type == 'socks4':
+        sock.sendall(protocols.socks4_connect_request(target_host, target_port, username))
+        protocols.check_socks4_reply(_recv_exactly(sock, 8))
+    else:
+        # Any HTTP answer, even a refusal to tunnel to this port, shows the proxy is up
+        sock.sendall(protocols.http_connect_request(target_host, target_port, username, password))
+        return protocols.parse_http_status_line(_recv_status_line(sock))
+
+
+class _TLSSocket:
+    """
+    TLS over anything with sendall and recv, driven through memory BIOs so
+    that it also runs inside another TLS connection (a tunnel through an
+    https proxy). Certificates aren't verified.
+    """
+
+    def __init__(self, sock, server_hostname: str):
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        self._sock = sock
+        self._incoming, self._outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+        self._tls = context.wrap_bio(self._incoming, self._outgoing, server_hostname=server_hostname)
+
+    def _run(self, operation, *args):
+        while True:
+            try:
+                result = operation(*args)
+            except ssl.SSLWantReadError:
+                self._flush()
+                data = self._sock.recv(65536)
+                if data:
+                    self._incoming.write(data)
+                else:
+                    self._incoming.write_eof()
+                continue
+            self._flush()
+            return result
+
+    def _flush(self):
+        data = self._outgoing.read()
+        if data:
+            self._sock.sendall(data)
+
+    def do_handshake(self):
+        self._run(self._tls.do_handshake)
+
+    def sendall(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            view = view[self._run(self._tls.write, view):]
+
+    def recv(self, size: int) -> bytes:
+        try:
+            return self._run(self._tls.read, size)
+        except (ssl.SSLZeroReturnError, ssl.SSLEOFError):
+            return b""
+
+
+def _tls_handshake_ms(sock: socket.socket, proxy_type: str, target_host: str, target_port: int,
+                      connect_status: int = None) -> float:
+    """
+    Completes the tunnel opened by handshake() and times a TLS handshake
+    with target_host through it. Certificates aren't verified; that is the
+    SSL verification stage's job. Returns None if no tunnel could be opened.
+    """
+    if proxy_type == 'socks5':
+        sock.sendall(protocols.socks5_connect_request(target_host, target_port))
+        header = _recv_exactly(sock, 5)
+        _recv_exactly(sock, protocols.socks5_reply_remaining(header))
+    elif proxy_type != 'socks4' and connect_status != 200:
+        return None
+
+    start = time.monotonic()
+    _TLSSocket(sock, target_host).do_handshake()
+    return (time.monotonic() - start) * 1000
+
+
+class ProbeFailed(Exception):
+    """
+    Raised with the dead pre-probe result of a proxy that couldn't be
+    connected to or didn't complete its handshake.
+    """
+
+    def __init__(self, result: dict):
+        super().__init__(result["error"])
+        self.result = result
+
+
+def _dead(reason: str, error: str, **timings) -> dict:
+    return dict({"alive": False, "reason": reason, "error": error}, **timings)
+
+
+def proxy_address(proxy: str) -> tuple:
+    """
+    Splits a proxy's host:port, raising ProbeFailed (invalid_address) if it has no valid port.
+    """
+    try:
+        return protocols.split_host_port(proxy)
+    except ValueError:
+        raise ProbeFailed(_dead("invalid_address", f"ProxyError: Invalid proxy address '{proxy}', expected host:port"))
+
+
+def connect_failure(error: Exception, connect_timeout: float) -> dict:
+    """
+    The dead pre-probe result for an error connecting to the proxy.
+    Shared with the asyncio checker, which passes its timeouts as TimeoutError.
+    """
+    if isinstance(error, TimeoutError):
+        return _dead("connect_timeout", f"Timeout: TCP connect to proxy timed out after {connect_timeout:g}s")
+    if isinstance(error, ConnectionRefusedError):
+        return _dead("connection_refused", "ConnectionError: Connection refused by proxy")
+    return _dead("connect_failed", f"ConnectionError: {error}")
+
+
+def handshake_failure(error: Exception, proxy_type: str, connect_timeout: float, connect_ms: float) -> dict:
+    """
+    The dead pre-probe result for an error during the proxy handshake.
+    A SOCKS5 server that wants other credentials is reported as auth_required
+    with its proxy_type, since it has shown what it speaks.
+    """
+    if isinstance(error, protocols.AuthenticationRequired):
+        return _dead("auth_required", f"ProxyError: {error}", connect_ms=round(connect_ms), proxy_type='socks5')
+    if isinstance(error, TimeoutError):
+        return _dead("handshake_timeout",
+                     f"Timeout: No {proxy_type.upper()} handshake reply from proxy within {connect_timeout:g}s",
+                     connect_ms=round(connect_ms))
+    return _dead("handshake_failed", f"ProxyError: {error}", connect_ms=round(connect_ms))
+
+
+def _time_left(connect_timeout: float, deadline=None) -> float:
+    """
+    connect_timeout cut down to what is left of deadline (a
+    checker.Deadline), raising socket.timeout once nothing is.
+    """
+    if deadline is None:
+        return connect_timeout
+    seconds = deadline.budget(connect_timeout)
+    if seconds <= 0:
+        raise socket.timeout("timed out")
+    return seconds
+
+
+class _DeadlineSocket:
+    """
+    A connected socket whose every send and receive gets connect_timeout,
+    or less if the deadline is closer.
+    """
+
+    def __init__(self, sock: socket.socket, connect_timeout: float, deadline=None):
+        self._sock = sock
+        self._connect_timeout = connect_timeout
+        self._deadline = deadline
+
+    def sendall(self, data: bytes):
+        self._sock.settimeout(_time_left(self._connect_timeout, self._deadline))
+        self._sock.sendall(data)
+
+    def recv(self, size: int) -> bytes:
+        self._sock.settimeout(_time_left(self._connect_timeout, self._deadline))
+        return self._sock.recv(size)
+
+    def close(self):
+        self._sock.close()
+
+
+def _connect(proxy: str, connect_timeout: float, deadline=None):
+    """
+    Returns (socket, connect_ms) or raises ProbeFailed. The socket's
+    operations are cut short by deadline like the connect itself.
+    """
+    host, port = proxy_address(proxy)
+    start = time.monotonic()
+    try:
+        sock = socket.create_connection((host, port), timeout=_time_left(connect_timeout, deadline))
+    except OSError as e:
+        raise ProbeFailed(connect_failure(e, connect_timeout))
+    return _DeadlineSocket(sock, connect_timeout, deadline), (time.monotonic() - start) * 1000
+
+
+def preprobe(proxy: str, proxy_type: str, target_host: str, target_port: int, username: str = None,
+             password: str = None, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, tls: bool = False,
+             deadline=None) -> dict:
+    """
+    Connects to the proxy and opens its handshake, timed with a monotonic clock.
+    Returns {"alive": True, "connect_ms", "handshake_ms"} or
+    {"alive": False, "reason", "error", ...} where reason is one of
+    invalid_address, connect_timeout, connection_refused, connect_failed,
+    handshake_timeout, handshake_failed or auth_required.
+
+    An https proxy is an HTTP proxy spoken to over TLS, as requests does
+    for https:// proxy URLs; that TLS handshake counts towards
+    handshake_ms. Its certificate isn't verified here.
+
+    With tls=True (for https targets) the tunnel to the target is completed
+    and a TLS handshake through it adds "tls_ms". It is None if that
+    failed, which doesn't make the proxy dead by itself.
+
+    With a deadline (a checker.Deadline), the connect and each socket
+    operation get at most its time left.
+    """
+    try:
+        sock, connect_ms = _connect(proxy, connect_timeout, deadline)
+    except ProbeFailed as e:
+        return e.result
+
+    try:
+        channel = sock
+        try:
+            start = time.monotonic()
+            if proxy_type == 'https':
+                channel = _TLSSocket(sock, proxy_address(proxy)[0])
+                channel.do_handshake()
+            connect_status = handshake(channel, proxy_type, target_host, target_port, username, password)
+            handshake_ms = (time.monotonic() - start) * 1000
+        except (OSError, protocols.ProxyProtocolError) as e:
+            return handshake_failure(e, proxy_type, connect_timeout, connect_ms)
+
+        result = {"alive": True, "connect_ms": round(connect_ms), "handshake_ms": round(handshake_ms)}
+        if tls:
+            try:
+                tls_ms = _tls_handshake_ms(channel, proxy_type, target_host, target_port, connect_status)
+                result["tls_ms"] = round(tls_ms) if tls_ms is not None else None
+            except (OSError, protocols.ProxyProtocolError):
+                result["tls_ms"] = None
+    finally:
+        sock.close()
+    return result
+
+
+def _fingerprint(sock: socket.socket, username: str = None, password: str = None) -> str:
+    """
+    Sends a SOCKS5 greeting and classifies the reply: a SOCKS5 method
+    selection, an HTTP error page or a SOCKS4 rejection. Completes SOCKS5
+    authentication on the same connection when the proxy asks for it, and
+    raises AuthenticationRequired if it accepts none of the offered methods.
+    Returns the detected type, or None if the reply fits no protocol.
+    """
+    sock.sendall(protocols.socks5_greeting(bool(username and password)))
+    reply = sock.recv(16)
+    detected = classify_greeting_reply(reply)
+    if detected == 'socks5' and protocols.parse_socks5_method(reply) == protocols.SOCKS5_USER_PASS:
+        sock.sendall(protocols.socks5_auth_request(username, password))
+        protocols.check_socks5_auth_reply(_recv_exactly(sock, 2))
+    return detected
+
+
+def _http_fingerprint(sock: socket.socket, target_host: str, target_port: int, username: str = None,
+                      password: str = None) -> str:
+    """
+    Sends an HTTP CONNECT and returns 'http' if the reply starts like an
+    HTTP response, or None as soon as it can't.
+    """
+    sock.sendall(protocols.http_connect_request(target_host, target_port, username, password))
+    reply = b""
+    while len(reply) < len(HTTP_REPLY_PREFIX) and HTTP_REPLY_PREFIX.startswith(reply):
+        chunk = sock.recv(1024)
+        if not chunk:
+            raise protocols.ProxyProtocolError("Proxy closed the connection during the handshake")
+        reply += chunk
+    return 'http' if reply.startswith(HTTP_REPLY_PREFIX) else None
+
+
+def classify_greeting_reply(reply: bytes) -> str:
+    """
+    The protocol a reply to a SOCKS5 greeting comes from: a SOCKS5 method
+    selection, an HTTP error page or a SOCKS4 rejection. None if it fits none.
+    """
+    if len(reply) == 2 and reply[0] == protocols.SOCKS5_VERSION:
+        return 'socks5'
+    if reply.startswith(HTTP_REPLY_PREFIX):
+        return 'http'
+    if len(reply) >= 2 and reply[0] == 0x00 and reply[1] in protocols.SOCKS4_REPLY_MESSAGES:
+        # Some SOCKS4 servers answer an unknown version with a SOCKS4 rejection
+        return 'socks4'
+    return None
+
+
+def detect_proxy_type(proxy: str, target_host: str, target_port: int, username: str = None, password: str = None,
+                      connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, candidates=AUTO_DETECT_TYPES,
+                      deadline=None) -> dict:
+    """
+    Fingerprints a proxy of unknown type by trying the HTTP CONNECT, SOCKS5
+    and SOCKS4 handshakes among candidates, one connection each. Doubles as the pre-probe: returns {"alive": True, "proxy_type",
+    "connect_ms", "handshake_ms"} or a dead result like preprobe(), with
+    reason detection_failed if no candidate protocol matched, or
+    auth_required for a SOCKS5 server that wants other credentials.
+    A deadline is applied per candidate and socket operation as in preprobe().
+    """
+    candidates = [proxy_type for proxy_type in AUTO_DETECT_TYPES if proxy_type in candidates]
+    connect_ms = None
+    errors = []
+
+    for proxy_type in candidates:
+        try:
+            sock, connect_ms = _connect(proxy, connect_timeout, deadline)
+        except ProbeFailed as e:
+            return e.result
+
+        try:
+            start = time.monotonic()
+            if proxy_type == 'http':
+                detected = _http_fingerprint(sock, target_host, target_port, username, password)
+            elif proxy_type == 'socks5':
+                detected = _fingerprint(sock, username, password)
+            else:
+                handshake(sock, proxy_type, target_host, target_port, username, password)
+                detected = proxy_type
+            handshake_ms = (time.monotonic() - start) * 1000
+        except protocols.AuthenticationRequired as e:
+            return handshake_failure(e, proxy_type, connect_timeout, connect_ms)
+        except (OSError, protocols.ProxyProtocolError) as e:
+            errors.append(f"{proxy_type.upper()}: {e or type(e).__name__}")
+            continue
+        finally:
+            sock.close()
+
+        if detected in candidates:
+            return {"alive": True, "proxy_type": detected, "connect_ms": round(connect_ms),
+                    "handshake_ms": round(handshake_ms)}
+        errors.append(f"{proxy_type.upper()}: unrecognised reply")
+
+    return detection_failure(errors, connect_ms)
+
+
+def detection_failure(errors: list, connect_ms: float = None) -> dict:
+    """
+    The dead result of a detection in which no candidate protocol matched,
+    given one "TYPE: reason" entry per candidate tried.
+    """
+    return _dead("detection_failed", f"ProxyError: Could not detect the proxy protocol ({'; '.join(errors)})",
+                 connect_ms=round(connect_ms) if connect_ms is not None else None)
@@ -0,0 +1,175 @@
+import base64
+import ipaddress
+import struct
+
+SOCKS5_VERSION = 0x05
+SOCKS4_VERSION = 0x04
+
+SOCKS5_NO_AUTH = 0x00
+SOCKS5_USER_PASS = 0x02
+SOCKS5_NO_ACCEPTABLE = 0xFF
+
+SOCKS5_REPLY_MESSAGES = {
+    0x01: "general SOCKS server failure",
+    0x02: "connection not allowed by ruleset",
+    0x03: "network unreachable",
+    0x04: "host unreachable",
+    0x05: "connection refused",
+    0x06: "TTL expired",
+    0x07: "command not supported",
+    0x08: "address type not supported",
+}
+
+SOCKS4_REPLY_MESSAGES = {
+    0x5B: "request rejected or failed",
+    0x5C: "request rejected, identd unreachable",
+    0x5D: "request rejected, identd user mismatch",
+}
+
+
+class ProxyProtocolError(Exception):
+    """
+    Raised when a proxy answers a handshake with something we can't use.
+    """
+
+
+class AuthenticationRequired(ProxyProtocolError):
+    """
+    Raised when a SOCKS5 server accepts none of the offered auth methods.
+    The server does speak SOCKS5; it wants credentials we don't have.
+    """
+
+
+def split_host_port(address: str, default_port: int = None) -> tuple:
+    """
+    Splits "host:port" (or "[v6]:port") into a (host, port) tuple.
+    """
+    if address.startswith('['):
+        host, _, rest = address[1:].partition(']')
+        port = rest.lstrip(':')
+    else:
+        host, _, port = address.rpartition(':')
+        if not host:
+            host, port = port, ''
+    if not port:
+        if default_port is None:
+            raise ValueError(f"Missing port in address: {address}")
+        return host, default_port
+    return host, int(port)
+
+
+def basic_auth(username: str, password: str) -> str:
+    """
+    Builds the value of a Basic Authorization/Proxy-Authorization header.
+    """
+    token = base64.b64encode(f"{username}:{password}".encode()).decode()
+    return f"Basic {token}"
+
+
+def socks5_greeting(with_auth: bool = False) -> bytes:
+    """
+    Builds the SOCKS5 method-selection greeting.
+    """
+    methods = [SOCKS5_NO_AUTH, SOCKS5_USER_PASS] if with_auth else [SOCKS5_NO_AUTH]
+    return bytes([SOCKS5_VERSION, len(methods)] + methods)
+
+
+def parse_socks5_method(reply: bytes) -> int:
+    """
+    Parses the server's method-selection reply and returns the chosen method.
+    """
+    if len(reply) != 2 or reply[0] != SOCKS5_VERSION:
+        raise ProxyProtocolError(f"Not a SOCKS5 server (greeting reply {reply[:8]!r})")
+    if reply[1] == SOCKS5_NO_ACCEPTABLE:
+        raise AuthenticationRequired("SOCKS5 server accepted none of the offered auth methods")
+    return reply[1]
+
+
+def socks5_auth_request(username: str, password: str) -> bytes:
+    """
+    Builds an RFC 1929 username/password sub-negotiation request.
+    """
+    user = (username or "").encode()
+    pwd = (password or "").encode()
+    return bytes([0x01, len(user)]) + user + bytes([len(pwd)]) + pwd
+
+
+def check_socks5_auth_reply(reply: bytes) -> None:
+    if len(reply) != 2 or reply[1] != 0x00:
+        raise ProxyProtocolError("SOCKS5 authentication failed")
+
+
+def socks5_connect_request(host: str, port: int) -> bytes:
+    """
+    Builds a SOCKS5 CONNECT request, sending hostnames unresolved so the
+    proxy does the DNS lookup.
+    """
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        name = host.encode('idna')
+        address = bytes([0x03, len(name)]) + name
+    else:
+        address = (bytes([0x01]) if ip.version == 4 else bytes([0x04])) + ip.packed
+    return bytes([SOCKS5_VERSION, 0x01, 0x00]) + address + struct.pack('!H', port)
+
+
+def socks5_reply_remaining(header: bytes) -> int:
+    """
+    Given the first 5 bytes of a SOCKS5 CONNECT reply, returns how many
+    more bytes (bound address and port) still have to be read.
+    """
+    if len(header) != 5 or header[0] != SOCKS5_VERSION:
+        raise ProxyProtocolError(f"Malformed SOCKS5 reply {header!r}")
+    if header[1] != 0x00:
+        message = SOCKS5_REPLY_MESSAGES.get(header[1], f"unknown error {header[1]:#04x}")
+        raise ProxyProtocolError(f"SOCKS5 connect failed: {message}")
+    address_type = header[3]
+    if address_type == 0x01:
+        return 4 - 1 + 2
+    if address_type == 0x04:
+        return 16 - 1 + 2
+    if address_type == 0x03:
+        return header[4] + 2
+    raise ProxyProtocolError(f"SOCKS5 reply has unknown address type {address_type:#04x}")
+
+
+def socks4_connect_request(host: str, port: int, username: str = None) -> bytes:
+    """
+    Builds a SOCKS4 CONNECT request, falling back to SOCKS4a for hostnames.
+    """
+    user = (username or "").encode() + b"\x00"
+    try:
+        ip = ipaddress.IPv4Address(host)
+    except ValueError:
+        return (bytes([SOCKS4_VERSION, 0x01]) + struct.pack('!H', port)
+                + b"\x00\x00\x00\x01" + user + host.encode('idna') + b"\x00")
+    return bytes([SOCKS4_VERSION, 0x01]) + struct.pack('!H', port) + ip.packed + user
+
+
+def check_socks4_reply(reply: bytes) -> None:
+    if len(reply) != 8 or reply[0] != 0x00:
+        raise ProxyProtocolError(f"Not a SOCKS4 server (reply {reply[:8]!r})")
+    if reply[1] != 0x5A:
+        message = SOCKS4_REPLY_MESSAGES.get(reply[1], f"unknown error {reply[1]:#04x}")
+        raise ProxyProtocolError(f"SOCKS4 connect failed: {message}")
+
+
+def http_connect_request(host: str, port: int, username: str = None, password: str = None) -> bytes:
+    """
+    Builds an HTTP CONNECT request for tunnelling through an HTTP proxy.
+    """
+    lines = [f"CONNECT {host}:{port} HTTP/1.1", f"Host: {host}:{port}"]
+    if username and password:
+        lines.append(f"Proxy-Authorization: {basic_auth(username, password)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def parse_http_status_line(line: bytes) -> int:
+    """
+    Parses an HTTP status line and returns the status code.
+    """
+    parts = line.decode('latin-1').strip().split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+        raise ProxyProtocolError(f"Not an HTTP response (status line {line[:32]!r})")
+    return int(parts[1])
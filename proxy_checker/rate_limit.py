@@ -0,0 +1,227 @@
+"""
+Token-bucket rate limiting of outbound calls, per destination host.
+
+ip-api.com, ipleak.net and judge hosts such as httpbin.org throttle
+clients, and every API and Celery process calls them. Each limited host
+has a bucket of `count` tokens refilled over `seconds`. With
+RATE_LIMIT_REDIS_URL set the buckets live in Redis and are shared by all
+processes; otherwise, or while Redis is unreachable, each process keeps its
+own.
+
+A call waits up to RATE_LIMIT_MAX_WAIT seconds for a token. If none comes,
+acquire() returns False and the caller degrades instead of calling the host.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from proxy_checker.cache import redis_client
+from proxy_checker.metrics import RATE_LIMIT_EVENTS
+
+# Comma-separated key=count/seconds limits. A key is a host, or host/path for a
+# separately limited endpoint (ip-api's batch endpoint allows 15 requests a minute).
+RATE_LIMITS = os.getenv('RATE_LIMITS', 'ip-api.com=45/60,ip-api.com/batch=15/60,ipleak.net=30/60')
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '2'))
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')
+
+# Takes a token if there is one, otherwise returns the seconds until there
+# will be. Runs atomically in Redis on the server's clock.
+_TAKE_TOKEN = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+def parse_limits(spec: str) -> dict:
+    """
+    Parses "key=count/seconds,..." into {key: (count, seconds)}.
+    """
+    limits = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        key, _, limit = item.strip().partition('=')
+        count, _, seconds = limit.partition('/')
+        limits[key] = (float(count), float(seconds or 1))
+    return limits
+
+
+class TokenBucket:
+    """
+    In-process token bucket holding up to capacity tokens, refilled at rate
+    tokens per second.
+    """
+
+    def __init__(self, capacity: float, rate: float, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate = rate
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """
+        Takes a token and returns 0, or returns the seconds until one is due.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token buckets per key, optionally shared through Redis.
+    """
+
+    def __init__(self, limits: dict, shared=None, namespace: str = "proxy_checker:ratelimit:",
+                 max_wait: float = RATE_LIMIT_MAX_WAIT, clock=time.monotonic, sleep=time.sleep):
+        self.limits = limits
+        self.shared = shared
+        self.namespace = namespace
+        self.max_wait = max_wait
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = {}
+        self._script = shared.register_script(_TAKE_TOKEN) if shared is not None else None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _local_bucket(self, key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                count, seconds = self.limits[key]
+                bucket = self._buckets[key] = TokenBucket(count, count / seconds, self._clock)
+            return bucket
+
+    def _take(self, key: str) -> float:
+        if self._script is not None:
+            count, seconds = self.limits[key]
+            try:
+                return float(self._script(keys=[self.namespace + key], args=[count, count / seconds]))
+            except Exception:
+                self._count(key, "shared_errors")
+        return self._local_bucket(key).take()
+
+    def _count(self, key: str, name: str, amount: float = 1) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(key, {"acquired": 0, "waited": 0, "wait_ms": 0, "throttled": 0,
+                                                 "shared_errors": 0})
+            stats[name] += amount
+        RATE_LIMIT_EVENTS[name].labels(key).inc(amount / 1000 if name == "wait_ms" else amount)
+
+    def _attempts(self, key: str, max_wait: float):
+        """
+        Tries to take a token for key, yielding the seconds to wait before
+        each retry. Returns (as StopIteration.value) whether one was taken.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = self._clock()
+        waited = False
+        while True:
+            wait = self._take(key)
+            if wait <= 0:
+                self._count(key, "acquired")
+                if waited:
+                    self._count(key, "waited")
+                    self._count(key, "wait_ms", round((self._clock() - start) * 1000))
+                return True
+            if self._clock() - start + wait > max_wait:
+                self._count(key, "throttled")
+                return False
+            waited = True
+            yield wait
+
+    def acquire(self, key: str, max_wait: float = None) -> bool:
+        """
+        Takes a token for key, waiting up to max_wait seconds (default
+        max_wait of the limiter) for one. Returns False if none came in
+        time. Keys without a configured limit are never limited.
+        """
+        if not key or key not in self.limits:
+            return True
+        attempts = self._attempts(key, max_wait)
+        while True:
+            try:
+                self._sleep(next(attempts))
+            except StopIteration as done:
+                return done.value
+
+    async def acquire_async(self, key: str, max_wait: float = None) -> bool:
+        """
+        acquire() for coroutines: waits for a token on the event loop
+        instead of sleeping in a thread.
+        """
+        if not key or key not in self.limits:
+            return True
+        attempts = self._attempts(key, max_wait)
+        while True:
+            try:
+                wait = next(attempts)
+            except StopIteration as done:
+                return done.value
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._stats.clear()
+
+
+_limiter = RateLimiter(
+    parse_limits(RATE_LIMITS),
+    shared=redis_client(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else None,
+)
+
+
+def acquire(key: str, max_wait: float = None) -> bool:
+    """
+    Takes a token for key (a host, or host/path) from the process-wide limiter.
+    """
+    return _limiter.acquire(key, max_wait)
+
+
+async def acquire_async(key: str, max_wait: float = None) -> bool:
+    """
+    acquire() for the asyncio checker.
+    """
+    return await _limiter.acquire_async(key, max_wait)
+
+
+def rate_limit_stats() -> dict:
+    """
+    Returns per-key counters: calls let through, how many of them had to
+    wait (and for how long in total), calls throttled after waiting
+    RATE_LIMIT_MAX_WAIT, and errors reaching the shared Redis buckets.
+    """
+    return _limiter.stats()
+
+
+def reset_rate_limits() -> None:
+    _limiter.reset()
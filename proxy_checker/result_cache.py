@@ -0,0 +1,123 @@
+"""
+Short-lived cache of check results, with coalescing of in-flight checks.
+
+Clients often re-submit the same proxy within seconds. Results are cached
+per check key (proxy, type, target URL, auth identity, plan and check
+options) for a TTL that depends on the outcome. Concurrent checks for one
+key in a process share a single network check. A request can pass max_age
+to accept only results checked at most that many seconds ago; max_age=0
+always runs a fresh check.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from proxy_checker.cache import TTLCache, redis_client
+from proxy_checker.metrics import CACHE_EVENTS
+
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '10000'))
+# Seconds a result is reused, per status. 0 turns caching off for that status.
+RESULT_CACHE_ALIVE_TTL = float(os.getenv('RESULT_CACHE_ALIVE_TTL', '60'))
+RESULT_CACHE_DEAD_TTL = float(os.getenv('RESULT_CACHE_DEAD_TTL', '30'))
+# Optional shared tier so API and Celery processes reuse each other's results.
+RESULT_CACHE_REDIS_URL = os.getenv('RESULT_CACHE_REDIS_URL')
+
+_result_cache = TTLCache(
+    RESULT_CACHE_SIZE,
+    shared=redis_client(RESULT_CACHE_REDIS_URL) if RESULT_CACHE_REDIS_URL else None,
+    namespace="proxy_checker:result:",
+    name="result",
+)
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_coalesced = 0
+
+
+def cache_key(proxy: str, proxy_type: str, username: str = None, password: str = None, target_url: str = None,
+              user_plan: str = "BASIC", **options) -> str:
+    """
+    Key of a check: everything that can change its result. The password
+    only goes in as a digest.
+    """
+    password_digest = hashlib.sha256(password.encode()).hexdigest() if password else None
+    parts = [proxy, proxy_type, target_url, username, password_digest, user_plan, sorted(options.items())]
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def result_ttl(result: dict) -> float:
+    """
+    Seconds a result may be reused: alive and dead results for their
+    configured TTLs, anything else (timeouts of a whole request, invalid
+    entries, results with fields a deadline left "unknown") not at all.
+    """
+    if "unknown" in result.values():
+        return 0
+    return {"alive": RESULT_CACHE_ALIVE_TTL, "dead": RESULT_CACHE_DEAD_TTL}.get(result.get("status"), 0)
+
+
+def cached_check(key: str, check, max_age: float = None) -> dict:
+    """
+    Returns the result of check() for key. A cached result is used if it
+    is no older than max_age seconds (any unexpired one if max_age is None).
+    Otherwise the check runs, unless the same key is already being checked
+    in this process, in which case that check's result is shared. Every
+    caller gets its own copy of the result.
+    """
+    global _coalesced
+    if max_age != 0:
+        entry = _result_cache.get(key)
+        if entry is not None and (max_age is None or time.time() - entry["checked_at"] <= max_age):
+            return copy.deepcopy(entry["result"])
+
+    with _inflight_lock:
+        future = _inflight.get(key) if max_age != 0 else None
+        leader = future is None
+        if leader:
+            future = Future()
+            if max_age != 0:
+                _inflight[key] = future
+        else:
+            _coalesced += 1
+            CACHE_EVENTS["coalesced"].labels("result").inc()
+
+    if not leader:
+        return copy.deepcopy(future.result())
+
+    try:
+        result = check()
+        # Cached before the check stops being in flight, so no caller in between starts another
+        ttl = result_ttl(result)
+        if ttl > 0:
+            _result_cache.set(key, {"result": copy.deepcopy(result), "checked_at": time.time()}, ttl)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            if _inflight.get(key) is future:
+                del _inflight[key]
+
+    future.set_result(result)
+    return copy.deepcopy(result)
+
+
+def result_cache_stats() -> dict:
+    """
+    Returns the result cache's counters plus how many checks were served by
+    joining an identical check already in flight.
+    """
+    with _inflight_lock:
+        coalesced, inflight = _coalesced, len(_inflight)
+    return dict(_result_cache.stats(), coalesced=coalesced, inflight=inflight)
+
+
+def clear_result_cache() -> None:
+    global _coalesced
+    _result_cache.clear()
+    with _inflight_lock:
+        _coalesced = 0
@@ -0,0 +1,253 @@
+"""
+Compact encoding of check results.
+
+A dead result's error text can run to several hundred characters (a
+urllib3 exception chain plus notes), and every result dict repeats its key
+names. For storage, results are encoded as a CheckResult record and packed
+into a short positional list:
+
+    [mask, value, value, ...]
+
+Bit i of mask is set when FIELDS[i] is present, and only present values
+follow, in FIELDS order. Errors are kept as an ErrorCode plus a short
+detail string instead of the full exception text. Keys outside FIELDS go
+in a trailing dict.
+
+The API renders results verbose (the usual dict shape, with the full error
+text where it is still known) or compact (error code and detail only, no
+null fields).
+"""
+import re
+from enum import IntEnum
+
+# Longest detail string kept for an error.
+DETAIL_MAX_LENGTH = 120
+
+
+class ErrorCode(IntEnum):
+    """
+    Why a check failed. Rendered in results as the lower-case name.
+    """
+    NONE = 0
+    CONNECT_TIMEOUT = 1
+    CONNECTION_REFUSED = 2
+    CONNECT_FAILED = 3
+    HANDSHAKE_TIMEOUT = 4
+    HANDSHAKE_FAILED = 5
+    DETECTION_FAILED = 6
+    TIMEOUT = 7
+    CONNECTION_ERROR = 8
+    PROXY_ERROR = 9
+    HTTP_ERROR = 10
+    REQUEST_ERROR = 11
+    DEADLINE_EXCEEDED = 12
+    INVALID_INPUT = 13
+    RATE_LIMITED = 14
+    INVALID_ADDRESS = 15
+    AUTH_REQUIRED = 16
+
+
+# Error text prefixes used throughout the checkers, and the codes they map to.
+_PREFIX_CODES = (
+    ("Timeout: ", ErrorCode.TIMEOUT),
+    ("ConnectionError: ", ErrorCode.CONNECTION_ERROR),
+    ("ProxyError: ", ErrorCode.PROXY_ERROR),
+    ("HTTPError: ", ErrorCode.HTTP_ERROR),
+    ("RequestException: ", ErrorCode.REQUEST_ERROR),
+    ("RateLimited: ", ErrorCode.RATE_LIMITED),
+)
+_CODE_PREFIXES = {
+    ErrorCode.CONNECT_TIMEOUT: "Timeout: ",
+    ErrorCode.HANDSHAKE_TIMEOUT: "Timeout: ",
+    ErrorCode.TIMEOUT: "Timeout: ",
+    ErrorCode.CONNECTION_REFUSED: "ConnectionError: ",
+    ErrorCode.CONNECT_FAILED: "ConnectionError: ",
+    ErrorCode.CONNECTION_ERROR: "ConnectionError: ",
+    ErrorCode.HANDSHAKE_FAILED: "ProxyError: ",
+    ErrorCode.DETECTION_FAILED: "ProxyError: ",
+    ErrorCode.INVALID_ADDRESS: "ProxyError: ",
+    ErrorCode.AUTH_REQUIRED: "ProxyError: ",
+    ErrorCode.PROXY_ERROR: "ProxyError: ",
+    ErrorCode.HTTP_ERROR: "HTTPError: ",
+    ErrorCode.REQUEST_ERROR: "RequestException: ",
+    ErrorCode.RATE_LIMITED: "RateLimited: ",
+}
+
+_POOL_PREFIX = re.compile(r"^(?:SOCKS)?HTTPS?ConnectionPool\(host='[^']*', port=\d+\): ")
+_ERRNO_MESSAGE = re.compile(r"\[Errno -?\d+\] ([^'\"()\]]+)")
+_PYSOCKS_NOTE = " (Note: SOCKS proxies require PySocks library)"
+
+# Result fields in packing order. The mask has one bit per field.
+FIELDS = (
+    "status", "proxy_type", "latency_ms", "country", "anonymous", "isp", "asn", "dns_leak_detected",
+    "ssl_verified", "reputation_score", "blacklisted", "threat_type", "latency_breakdown_ms",
+    "latency_samples_ms", "stage_latency_ms", "dead_reason", "error_code", "detail",
+)
+# Nested dicts with a fixed set of keys are packed as lists in this order.
+NESTED_FIELDS = {
+    "latency_breakdown_ms": ("connect", "handshake", "tls", "ttfb", "total"),
+    "latency_samples_ms": ("count", "min", "p50", "p95"),
+}
+
+
+def classify_error(error: str, status: str = None, dead_reason: str = None) -> ErrorCode:
+    """
+    Maps a result's error text (and dead_reason, where the pre-probe set
+    one) to an ErrorCode.
+    """
+    if dead_reason:
+        try:
+            return ErrorCode[dead_reason.upper()]
+        except KeyError:
+            pass
+    if status is None:
+        return ErrorCode.INVALID_INPUT
+    for prefix, code in _PREFIX_CODES:
+        if error.startswith(prefix):
+            if code == ErrorCode.CONNECTION_ERROR and "Connection refused" in error:
+                return ErrorCode.CONNECTION_REFUSED
+            return code
+    if status == "timed_out":
+        return ErrorCode.DEADLINE_EXCEEDED
+    return ErrorCode.REQUEST_ERROR
+
+
+def short_detail(error: str) -> str:
+    """
+    Boils error text down to its root cause, e.g. "Connection refused"
+    instead of the whole urllib3 exception chain.
+    """
+    for prefix, _ in _PREFIX_CODES:
+        if error.startswith(prefix):
+            error = error[len(prefix):]
+            break
+    error = _POOL_PREFIX.sub("", error.replace(_PYSOCKS_NOTE, ""))
+    causes = _ERRNO_MESSAGE.findall(error)
+    if causes:
+        error = causes[-1].strip()
+    if len(error) > DETAIL_MAX_LENGTH:
+        error = error[:DETAIL_MAX_LENGTH - 3] + "..."
+    return error
+
+
+class CheckResult:
+    """
+    One check result as a fixed record. Unset slots are fields the result
+    doesn't have (for instance because the plan doesn't include them).
+    error holds the full error text while it is known; it is not packed.
+    """
+    __slots__ = FIELDS + ("error", "extra")
+
+    @classmethod
+    def from_dict(cls, result: dict) -> "CheckResult":
+        record = cls()
+        extra = {}
+        for name, value in result.items():
+            if name in FIELDS:
+                setattr(record, name, value)
+            elif name == "error":
+                record.error = value
+            elif name != "index":
+                extra[name] = value
+        if extra:
+            record.extra = extra
+
+        error = result.get("error")
+        if error is not None and "error_code" not in result:
+            record.error_code = classify_error(error, result.get("status"), result.get("dead_reason"))
+            record.detail = short_detail(error) if record.error_code != ErrorCode.INVALID_INPUT else error
+        elif "error_code" in result:
+            if not isinstance(record.error_code, ErrorCode):
+                record.error_code = ErrorCode[str(record.error_code).upper()]
+            if error is not None and "detail" not in result:
+                # A decoded stored result: its error was rebuilt from the detail
+                record.detail = short_detail(error) if record.error_code != ErrorCode.INVALID_INPUT else error
+        return record
+
+    def _get(self, name: str, default=None):
+        return getattr(self, name, default)
+
+    def pack(self) -> list:
+        mask = 0
+        values = []
+        for bit, name in enumerate(FIELDS):
+            if not hasattr(self, name):
+                continue
+            mask |= 1 << bit
+            value = getattr(self, name)
+            if name in NESTED_FIELDS and isinstance(value, dict) and set(value) <= set(NESTED_FIELDS[name]):
+                value = [value.get(key) for key in NESTED_FIELDS[name]]
+            elif name == "error_code":
+                value = int(value)
+            values.append(value)
+        packed = [mask] + values
+        if hasattr(self, "extra"):
+            packed.append(self.extra)
+        return packed
+
+    @classmethod
+    def unpack(cls, packed: list) -> "CheckResult":
+        record = cls()
+        mask, values = packed[0], iter(packed[1:])
+        for bit, name in enumerate(FIELDS):
+            if not mask & 1 << bit:
+                continue
+            value = next(values)
+            if name in NESTED_FIELDS and isinstance(value, list):
+                value = dict(zip(NESTED_FIELDS[name], value))
+            elif name == "error_code":
+                value = ErrorCode(value)
+            setattr(record, name, value)
+        extra = next(values, None)
+        if extra:
+            record.extra = extra
+        return record
+
+    def to_dict(self, compact: bool = False) -> dict:
+        """
+        Renders the result. Verbose output has the usual result shape plus
+        error_code; error is the full text if known, otherwise rebuilt from
+        the code and detail. Compact output has error_code and detail
+        instead of error, and leaves out null fields.
+        """
+        result = {}
+        for name in FIELDS:
+            if not hasattr(self, name) or name == "detail":
+                continue
+            value = getattr(self, name)
+            if compact and value is None:
+                continue
+            result[name] = value.name.lower() if name == "error_code" else value
+        result.update(self._get("extra", {}))
+
+        code = self._get("error_code")
+        if code is not None:
+            if compact:
+                result["detail"] = self._get("detail")
+            else:
+                error = self._get("error")
+                if error is None:
+                    error = _CODE_PREFIXES.get(code, "") + (self._get("detail") or "")
+                result["error"] = error
+        return result
+
+
+def encode_result(result: dict) -> list:
+    """
+    Packs a result dict into its compact storage form.
+    """
+    return CheckResult.from_dict(result).pack()
+
+
+def decode_result(packed: list) -> dict:
+    """
+    Unpacks a stored result into a verbose result dict.
+    """
+    return CheckResult.unpack(packed).to_dict()
+
+
+def render_result(result: dict, compact: bool = False) -> dict:
+    """
+    Renders a result dict for API output, compact or verbose.
+    """
+    return CheckResult.from_dict(result).to_dict(compact)
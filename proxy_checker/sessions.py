@@ -0,0 +1,128 @@
+"""
+Pooled, reusable HTTP sessions.
+
+External services (ip-api.com, callbacks, ...) each get one long-lived
+session per process so their keep-alive connections are reused across
+checks. Each proxy check gets its own short-lived session that the main
+probe, the DNS-leak probe and the SSL probe share, so the connection to the
+proxy is reused wherever the protocol allows: plain-HTTP requests through an
+HTTP proxy share one connection, while HTTPS targets need a CONNECT tunnel
+(and SOCKS a new circuit) per target host.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Distinct hosts kept pooled per session, and keep-alive connections kept per host.
+SESSION_POOL_CONNECTIONS = int(os.getenv('SESSION_POOL_CONNECTIONS', '10'))
+SESSION_POOL_MAXSIZE = int(os.getenv('SESSION_POOL_MAXSIZE', '32'))
+
+_sessions = {}
+_lock = threading.Lock()
+_retired_proxy_stats = {"sessions": 0, "requests": 0, "connections": 0}
+
+
+class PooledSession(requests.Session):
+    """
+    A requests.Session with explicit pool sizes that can report how many
+    requests it sent and how many connections it had to open for them.
+    """
+
+    def __init__(self, pool_connections: int = None, pool_maxsize: int = None):
+        super().__init__()
+        self.adapter = HTTPAdapter(pool_connections=pool_connections or SESSION_POOL_CONNECTIONS,
+                                   pool_maxsize=pool_maxsize or SESSION_POOL_MAXSIZE)
+        self.mount('http://', self.adapter)
+        self.mount('https://', self.adapter)
+
+    def _pools(self):
+        managers = [self.adapter.poolmanager] + list(self.adapter.proxy_manager.values())
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    yield pool
+
+    def connection_stats(self) -> dict:
+        requests_sent = connections = 0
+        for pool in self._pools():
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+        return {"requests": requests_sent, "connections": connections}
+
+
+def _summarize(requests_sent: int, connections: int) -> dict:
+    return {
+        "requests": requests_sent,
+        "connections": connections,
+        "reused": max(0, requests_sent - connections),
+        "reuse_ratio": round(max(0, requests_sent - connections) / requests_sent, 4) if requests_sent else 0.0,
+    }
+
+
+def get_session(service: str) -> PooledSession:
+    """
+    Returns the process-wide session for an external service, creating it on first use.
+    """
+    session = _sessions.get(service)
+    if session is None:
+        with _lock:
+            session = _sessions.get(service)
+            if session is None:
+                session = _sessions[service] = PooledSession()
+    return session
+
+
+class ProxySession(PooledSession):
+    """
+    Session for all probes of a single proxy check. Use it as a context
+    manager; on close its connection counters are folded into session_stats().
+    """
+
+    def __init__(self, proxies: dict):
+        super().__init__(pool_connections=4, pool_maxsize=4)
+        self.proxies.update(proxies)
+
+    def close(self):
+        stats = self.connection_stats()
+        with _lock:
+            _retired_proxy_stats["sessions"] += 1
+            _retired_proxy_stats["requests"] += stats["requests"]
+            _retired_proxy_stats["connections"] += stats["connections"]
+        super().close()
+
+
+def session_stats() -> dict:
+    """
+    Returns pool sizes plus request, connection and reuse counters per service,
+    with all per-proxy sessions aggregated under "proxy".
+    """
+    with _lock:
+        services = dict(_sessions)
+        retired = dict(_retired_proxy_stats)
+
+    service_stats = {}
+    for name, session in services.items():
+        counters = session.connection_stats()
+        service_stats[name] = _summarize(counters["requests"], counters["connections"])
+
+    return {
+        "pool_connections": SESSION_POOL_CONNECTIONS,
+        "pool_maxsize": SESSION_POOL_MAXSIZE,
+        "services": service_stats,
+        "proxy": dict(_summarize(retired["requests"], retired["connections"]), sessions=retired["sessions"]),
+    }
+
+
+def reset_sessions() -> None:
+    """
+    Closes all service sessions and clears the counters.
+    """
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        for key in _retired_proxy_stats:
+            _retired_proxy_stats[key] = 0
@@ -0,0 +1,112 @@
+"""
+Webhook delivery for async job callbacks.
+
+Deliveries run as their own Celery tasks on a separate queue, so a slow or
+failing customer endpoint never holds up a checking worker. Each attempt
+has a timeout, and failures are retried with exponential backoff. Large
+payloads are gzipped.
+"""
+import gzip
+import json
+import os
+import random
+
+import requests
+
+from proxy_checker.job_store import get_job_store
+from proxy_checker.metrics import WEBHOOK_EVENTS
+from proxy_checker.sessions import get_session
+
+WEBHOOK_CONNECT_TIMEOUT = float(os.getenv('WEBHOOK_CONNECT_TIMEOUT', '3'))
+WEBHOOK_READ_TIMEOUT = float(os.getenv('WEBHOOK_READ_TIMEOUT', '10'))
+WEBHOOK_MAX_RETRIES = int(os.getenv('WEBHOOK_MAX_RETRIES', '6'))
+# Retry n waits about WEBHOOK_BACKOFF_BASE * 2**n seconds, capped at WEBHOOK_BACKOFF_MAX.
+WEBHOOK_BACKOFF_BASE = float(os.getenv('WEBHOOK_BACKOFF_BASE', '5'))
+WEBHOOK_BACKOFF_MAX = float(os.getenv('WEBHOOK_BACKOFF_MAX', '600'))
+# Payloads at least this large (bytes of JSON) are sent gzip-compressed.
+WEBHOOK_GZIP_MIN_BYTES = int(os.getenv('WEBHOOK_GZIP_MIN_BYTES', '1024'))
+
+DELIVERY_COUNTERS = ("attempts", "delivered", "retried", "failed", "bytes_sent")
+
+
+class DeliveryError(Exception):
+    """
+    A failed delivery attempt. retryable is False for answers that won't
+    change on retry, such as a 404 from the receiver.
+    """
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def _count(name: str, amount: int = 1) -> None:
+    WEBHOOK_EVENTS[name].inc(amount)
+    # Deliveries run on the workers; the job store shares their counts with the API's /stats
+    try:
+        get_job_store().count_webhooks(name, amount)
+    except Exception:
+        pass  # Losing a count must not fail a delivery
+
+
+def encode_payload(payload: dict) -> tuple:
+    """
+    Returns (body, headers) for a JSON payload, gzipped if it is large.
+    """
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    headers = {"Content-Type": "application/json"}
+    if len(body) >= WEBHOOK_GZIP_MIN_BYTES:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+def deliver(url: str, payload: dict, timeout=None) -> None:
+    """
+    Makes one delivery attempt, raising DeliveryError unless the receiver
+    answers with a 2xx status.
+    """
+    body, headers = encode_payload(payload)
+    _count("attempts")
+    try:
+        response = get_session('callback').post(url, data=body, headers=headers,
+                                                timeout=timeout or (WEBHOOK_CONNECT_TIMEOUT, WEBHOOK_READ_TIMEOUT))
+    except requests.exceptions.Timeout as e:
+        raise DeliveryError(f"Timeout: {str(e)}")
+    except requests.exceptions.RequestException as e:
+        raise DeliveryError(f"ConnectionError: {str(e)}")
+
+    if not 200 <= response.status_code < 300:
+        # Client errors won't go away on retry, except for timeouts and rate limiting
+        retryable = response.status_code >= 500 or response.status_code in (408, 429)
+        raise DeliveryError(f"HTTPError: receiver answered {response.status_code}", retryable=retryable)
+
+    _count("delivered")
+    _count("bytes_sent", len(body))
+
+
+def backoff_delay(retries: int) -> float:
+    """
+    Seconds to wait before retry number retries + 1: exponential, capped,
+    with jitter so failed deliveries to one receiver don't retry in lockstep.
+    """
+    delay = min(WEBHOOK_BACKOFF_BASE * 2 ** retries, WEBHOOK_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def record_retry() -> None:
+    _count("retried")
+
+
+def record_failure() -> None:
+    _count("failed")
+
+
+def delivery_stats() -> dict:
+    """
+    Returns the delivery counters of all processes, from the job store:
+    attempts, delivered, retried, failed (given up after the last retry)
+    and bytes_sent.
+    """
+    counts = get_job_store().webhook_stats()
+    return {name: counts.get(name, 0) for name in DELIVERY_COUNTERS}
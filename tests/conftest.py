@@ -0,0 +1,44 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+from proxy_checker import checker, job_store, rate_limit, result_cache
+
+# Keep Celery in-process for tests: no Redis broker or result backend needed
+os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+os.environ.setdefault('CELERY_RESULT_BACKEND', 'cache+memory://')
+
+@pytest.fixture(autouse=True)
+def memory_job_store(mocker):
+    # A fresh in-memory SQLite job store per test instead of Redis
+    store = job_store.SQLiteJobStore()
+    mocker.patch('proxy_checker.job_store._job_store', store)
+    return store
+
+PREPROBE_OK = {"alive": True, "connect_ms": 1, "handshake_ms": 1}
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Each test mocks its own network responses, so nothing may leak between tests
+    checker._geo_cache.clear()
+    result_cache.clear_result_cache()
+    rate_limit.reset_rate_limits()
+    yield
+
+@pytest.fixture(autouse=True)
+def preprobe_passes(mocker):
+    # Checker tests mock the HTTP layer only; the raw-socket pre-probe has its own tests in test_probe.py
+    return mocker.patch('proxy_checker.checker.preprobe', return_value=dict(PREPROBE_OK))
+
+@pytest.fixture(scope="session")
+def tls_cert(tmp_path_factory):
+    # Self-signed (cert, key) for 127.0.0.1, for fake TLS proxies
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is not installed")
+    directory = tmp_path_factory.mktemp("tls")
+    cert, key = str(directory / "cert.pem"), str(directory / "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key, "-out", cert],
+                   check=True, capture_output=True)
+    return cert, key
@@ -1,5 +1,12 @@
+import gzip
+import json
+import threading
+import time
+
 import pytest
 from api.app import app
+from celery_worker import celery_app
+from proxy_checker import probe
 
 @pytest.fixture
 def client():
@@ -46,6 +53,78 @@ def test_check_endpoint_valid_payload(client, mocker):
         "threat_type": "none"
     }
 
+def test_check_endpoint_compact_output(client, mocker):
+    mocker.patch('api.app.check_proxy', return_value={
+        "status": "dead",
+        "error": "Timeout: HTTPConnectionPool(host='1.2.3.4', port=8080): Read timed out. (read timeout=5)",
+    })
+
+    verbose = client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'http'})
+    compact = client.post('/check?output=compact', json={'proxy': '1.2.3.4:8080', 'type': 'http'})
+
+    assert verbose.json == {
+        "status": "dead",
+        "error": "Timeout: HTTPConnectionPool(host='1.2.3.4', port=8080): Read timed out. (read timeout=5)",
+        "error_code": "timeout",
+    }
+    assert compact.json == {"status": "dead", "error_code": "timeout", "detail": "Read timed out. (read timeout=5)"}
+
+def test_check_endpoint_invalid_output(client):
+    response = client.post('/check?output=tiny', json={'proxy': '1.2.3.4:8080', 'type': 'http'})
+
+    assert response.status_code == 400
+    assert response.json == {"error": "'output' must be one of: verbose, compact."}
+
+def test_check_endpoint_reuses_recent_results(client, mocker):
+    mock_check_proxy = mocker.patch('api.app.check_proxy', return_value={"status": "alive", "latency_ms": 100})
+
+    client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'http'})
+    cached = client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'http'})
+    fresh = client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'http', 'max_age': 0})
+
+    assert cached.json == fresh.json == {"status": "alive", "latency_ms": 100}
+    assert mock_check_proxy.call_count == 2
+    assert client.get('/stats').json["result_cache"]["hits"] == 1
+
+def test_check_endpoint_invalid_max_age(client):
+    response = client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'http', 'max_age': -1})
+
+    assert response.status_code == 400
+    assert response.json == {"error": "'max_age' must be a number of seconds, 0 or more."}
+
+def test_stats_endpoint_reports_geo_cache(client):
+    response = client.get('/stats')
+
+    assert response.status_code == 200
+    assert set(response.json["geo_cache"]) >= {"hits", "misses", "evictions"}
+
+def test_stats_endpoint_reports_webhook_deliveries_of_all_processes(client, memory_job_store):
+    # Deliveries happen on the workers, which count them in the shared job store
+    memory_job_store.count_webhooks("delivered", 3)
+
+    assert client.get('/stats').json["webhooks"]["delivered"] == 3
+
+def test_metrics_endpoint(client):
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    assert "proxy_checker_checks_in_flight" in body
+    assert '# TYPE proxy_checker_cache_hits_total counter' in body
+    assert 'proxy_checker_webhook_delivered_total' in body
+    assert 'proxy_checker_queue_depth{queue="celery"}' in body
+
+@pytest.mark.parametrize("proxy", ["127.0.0.1", "localhost:notaport"])
+def test_check_endpoint_invalid_proxy_address(client, mocker, proxy):
+    mocker.patch('proxy_checker.checker.preprobe', probe.preprobe)
+    response = client.post('/check', json={'proxy': proxy, 'type': 'http'}, headers={'X-RapidAPI-Subscription': 'BASIC'})
+
+    assert response.status_code == 200
+    assert response.json["status"] == "dead"
+    assert response.json["dead_reason"] == "invalid_address"
+    assert response.json["error_code"] == "invalid_address"
+
 def test_check_endpoint_socks_gating_basic_plan(client):
     response = client.post(
         '/check',
@@ -126,6 +205,44 @@ def test_check_endpoint_target_url_passed(client, mocker):
     assert response.status_code == 200
     mock_check_proxy.assert_called_once_with('1.2.3.4:8080', 'http', None, None, 'https://example.com', 'PRO')
 
+def test_check_endpoint_timeouts_passed(client, mocker):
+    mock_check_proxy = mocker.patch('api.app.check_proxy', return_value={"status": "alive"})
+
+    response = client.post(
+        '/check',
+        json={'proxy': '1.2.3.4:8080', 'type': 'http', 'connect_timeout': 1.5, 'read_timeout': 10},
+        headers={'X-RapidAPI-Subscription': 'PRO'}
+    )
+
+    assert response.status_code == 200
+    mock_check_proxy.assert_called_once_with('1.2.3.4:8080', 'http', None, None, None, 'PRO',
+                                             connect_timeout=1.5, read_timeout=10.0)
+
+def test_check_endpoint_invalid_timeout(client):
+    response = client.post(
+        '/check',
+        json={'proxy': '1.2.3.4:8080', 'type': 'http', 'connect_timeout': 'fast'}
+    )
+
+    assert response.status_code == 400
+    assert response.json == {"error": "'connect_timeout' must be a number of seconds between 0 and 30."}
+
+def test_check_endpoint_invalid_samples(client):
+    response = client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'http', 'samples': 50})
+
+    assert response.status_code == 400
+    assert response.json == {"error": "'samples' must be a whole number between 1 and 10."}
+
+def test_check_endpoint_auto_type(client, mocker):
+    mock_check_proxy = mocker.patch('api.app.check_proxy', return_value={"status": "alive"})
+
+    client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'auto'}, headers={'X-RapidAPI-Subscription': 'PRO'})
+    mock_check_proxy.assert_called_with('1.2.3.4:8080', 'auto', None, None, None, 'PRO')
+
+    # BASIC may not check SOCKS proxies, so detection only looks for HTTP
+    client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'auto'})
+    mock_check_proxy.assert_called_with('1.2.3.4:8080', 'auto', None, None, None, 'BASIC', auto_types=('http',))
+
 def test_check_endpoint_isp_asn_filtered_basic_plan(client, mocker):
     mocker.patch('api.app.check_proxy', return_value={
         "status": "alive",
@@ -409,6 +526,50 @@ def test_check_endpoint_get_method(client):
     response = client.get('/check')
     assert response.status_code == 405 # Method Not Allowed
 
+def test_check_endpoint_rejects_invalid_deadline(client):
+    response = client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'http', 'deadline_ms': 0},
+                           headers={'X-RapidAPI-Subscription': 'PRO'})
+
+    assert response.status_code == 400
+    assert response.json == {"error": "'deadline_ms' must be a number of milliseconds between 0 and 60000."}
+
+def test_check_endpoint_fields_select_checks(client, mocker):
+    mock_check_proxy = mocker.patch('api.app.check_proxy', return_value={"status": "alive", "latency_ms": 100})
+
+    response = client.post('/check', json={'proxy': '1.2.3.4:8080', 'type': 'http',
+                                           'fields': ['status', 'latency_ms', 'ssl_verified']},
+                           headers={'X-RapidAPI-Subscription': 'ENTERPRISE'})
+
+    assert response.status_code == 200
+    assert mock_check_proxy.call_args.kwargs == {"checks": ("ssl",)}
+
+def test_check_endpoint_fields_accept_error_fields(client, mocker):
+    mock_check_proxy = mocker.patch('api.app.check_proxy', return_value={"status": "alive"})
+
+    response = client.post('/check?fields=status,error,error_code,detail,dead_reason',
+                           json={'proxy': '1.2.3.4:8080', 'type': 'http'},
+                           headers={'X-RapidAPI-Subscription': 'ENTERPRISE'})
+
+    assert response.status_code == 200
+    assert mock_check_proxy.call_args.kwargs == {"checks": ()}
+
+def test_check_endpoint_checks_query_parameter(client, mocker):
+    mock_check_proxy = mocker.patch('api.app.check_proxy', return_value={"status": "alive"})
+
+    response = client.post('/check?checks=reputation,geo', json={'proxy': '1.2.3.4:8080', 'type': 'http'},
+                           headers={'X-RapidAPI-Subscription': 'ENTERPRISE'})
+
+    assert response.status_code == 200
+    assert mock_check_proxy.call_args.kwargs == {"checks": ("geo", "reputation")}
+
+def test_check_endpoint_rejects_unknown_checks(client):
+    response = client.post('/check?checks=geo,traceroute', json={'proxy': '1.2.3.4:8080', 'type': 'http'},
+                           headers={'X-RapidAPI-Subscription': 'ENTERPRISE'})
+
+    assert response.status_code == 400
+    assert response.json == {"error": "'checks' must be a list (or comma-separated string) of: "
+                                      "geo, dns_leak, ssl, reputation."}
+
 # Tests for /check/bulk endpoint
 def test_check_bulk_endpoint_valid_payload(client, mocker):
     mocker.patch('api.app.check_proxy', return_value={
@@ -509,8 +670,149 @@ def test_check_bulk_endpoint_missing_proxy_data_in_list(client, mocker):
     assert isinstance(response.json, list)
     assert len(response.json) == 3
     assert response.json[0]["status"] == "alive"
-    assert response.json[1] == {"error": "Missing 'proxy' or 'type' in one of the proxy objects."}
-    assert response.json[2] == {"error": "Missing 'proxy' or 'type' in one of the proxy objects."}
+    assert response.json[1] == {"error": "Missing 'proxy' or 'type' in one of the proxy objects.",
+                                "error_code": "invalid_input"}
+    assert response.json[2] == response.json[1]
+
+def test_check_bulk_endpoint_results_in_input_order(client, mocker):
+    def fake_check(proxy, *args, **kwargs):
+        # Later proxies finish first, results must still follow the input order
+        time.sleep(0.05 if proxy.startswith('1.') else 0)
+        return {"status": "alive", "proxy_type": proxy}
+
+    mocker.patch('api.app.check_proxy', side_effect=fake_check)
+
+    proxies_to_check = [
+        {'proxy': '1.2.3.4:8080', 'type': 'http'},
+        {'proxy': '5.6.7.8:8080', 'type': 'http'},
+        {'proxy': '9.9.9.9:8080', 'type': 'http'}
+    ]
+
+    response = client.post(
+        '/check/bulk',
+        json=proxies_to_check,
+        headers={'X-RapidAPI-Subscription': 'ULTRA'}
+    )
+
+    assert response.status_code == 200
+    assert [r["proxy_type"] for r in response.json] == ['1.2.3.4:8080', '5.6.7.8:8080', '9.9.9.9:8080']
+
+def test_check_bulk_endpoint_checks_duplicates_once(client, mocker):
+    mock_check_proxy = mocker.patch('api.app.check_proxy', return_value={"status": "alive", "country": "Germany"})
+
+    response = client.post(
+        '/check/bulk',
+        json=[{'proxy': '1.2.3.4:8080', 'type': 'http'}, {'proxy': '5.6.7.8:8080', 'type': 'http'},
+              {'proxy': '1.2.3.4:8080', 'type': 'http'}],
+        headers={'X-RapidAPI-Subscription': 'ULTRA'}
+    )
+
+    assert response.status_code == 200
+    assert len(response.json) == 3
+    assert response.json[0] == response.json[2] == {"status": "alive", "country": "Germany"}
+    assert [call.args[0] for call in mock_check_proxy.call_args_list] == ['1.2.3.4:8080', '5.6.7.8:8080']
+
+def test_check_bulk_endpoint_deadline_marks_timed_out(client, mocker):
+    release = threading.Event()
+
+    def fake_check(proxy, *args, **kwargs):
+        if proxy.startswith('1.'):
+            release.wait(5)
+        return {"status": "alive", "country": "Germany"}
+
+    mocker.patch('api.app.check_proxy', side_effect=fake_check)
+    mocker.patch('api.app.BULK_DEADLINE_SECONDS', 0.2)
+
+    response = client.post(
+        '/check/bulk',
+        json=[{'proxy': '1.2.3.4:8080', 'type': 'http'}, {'proxy': '5.6.7.8:8080', 'type': 'http'}],
+        headers={'X-RapidAPI-Subscription': 'ULTRA'}
+    )
+    release.set()
+
+    assert response.status_code == 200
+    assert response.json[0]["status"] == "timed_out"
+    assert response.json[1] == {"status": "alive", "country": "Germany"}
+
+def test_check_bulk_endpoint_batches_geo_lookups(client, mocker):
+    mock_check_proxy = mocker.patch('api.app.check_proxy', side_effect=lambda *args, **kwargs: {
+        "status": "alive", "country": None, "isp": None, "asn": None
+    })
+    mock_batch = mocker.patch('proxy_checker.checker.get_geo_data_batch', return_value={
+        "1.2.3.4": {"country": "Germany", "isp": "ISP A", "as": "AS1"}
+    })
+
+    response = client.post(
+        '/check/bulk',
+        json=[{'proxy': '1.2.3.4:8080', 'type': 'http'}, {'proxy': '1.2.3.4:3128', 'type': 'http'}],
+        headers={'X-RapidAPI-Subscription': 'ULTRA'}
+    )
+
+    assert response.status_code == 200
+    assert mock_check_proxy.call_args.kwargs == {"geo_lookup": False}
+    mock_batch.assert_called_once()
+    assert [r["country"] for r in response.json] == ["Germany", "Germany"]
+    assert response.json[1]["asn"] == "AS1"
+
+def test_check_bulk_endpoint_streams_ndjson_as_results_finish(client, mocker):
+    release = threading.Event()
+
+    def fake_check(proxy, *args, **kwargs):
+        if proxy.startswith('1.'):
+            release.wait(5)
+            return {"status": "dead", "error": "Timeout: slow proxy"}
+        return {"status": "alive", "country": "Germany"}
+
+    mocker.patch('api.app.check_proxy', side_effect=fake_check)
+
+    response = client.post(
+        '/check/bulk?output=compact',
+        json=[{'proxy': '1.2.3.4:8080', 'type': 'http'}, {'type': 'http'}, {'proxy': '5.6.7.8:8080', 'type': 'http'},
+              {'proxy': '5.6.7.8:8080', 'type': 'http'}],
+        headers={'X-RapidAPI-Subscription': 'ULTRA', 'Accept': 'application/x-ndjson'},
+        buffered=False
+    )
+    lines = response.response
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    # The invalid entry and the fast proxy (and its duplicate) arrive before the slow one finishes
+    first = [json.loads(next(lines)) for _ in range(3)]
+    assert first[0] == {"index": 1, "error_code": "invalid_input",
+                        "detail": "Missing 'proxy' or 'type' in one of the proxy objects."}
+    assert first[1:] == [{"index": 2, "status": "alive", "country": "Germany"},
+                         {"index": 3, "status": "alive", "country": "Germany"}]
+    release.set()
+    assert json.loads(next(lines)) == {"index": 0, "status": "dead", "error_code": "timeout", "detail": "slow proxy"}
+    assert next(lines, None) is None
+
+def test_check_bulk_endpoint_stream_marks_unfinished_checks_timed_out(client, mocker):
+    release = threading.Event()
+    mocker.patch('api.app.check_proxy', side_effect=lambda *args, **kwargs: release.wait(5) and {"status": "alive"})
+    mocker.patch('api.app.BULK_DEADLINE_SECONDS', 0.2)
+
+    response = client.post(
+        '/check/bulk',
+        json=[{'proxy': '1.2.3.4:8080', 'type': 'http'}],
+        headers={'X-RapidAPI-Subscription': 'ULTRA', 'Accept': 'application/x-ndjson'}
+    )
+    release.set()
+
+    results = [json.loads(line) for line in response.data.splitlines()]
+    assert [(r["index"], r["status"]) for r in results] == [(0, "timed_out")]
+
+def test_check_bulk_endpoint_query_checks_apply_to_entries_without_their_own(client, mocker):
+    mock_check_proxy = mocker.patch('api.app.check_proxy', return_value={"status": "alive"})
+
+    response = client.post(
+        '/check/bulk?fields=status',
+        json=[{'proxy': '1.2.3.4:8080', 'type': 'http'}, {'proxy': '5.6.7.8:8080', 'type': 'http', 'checks': 'geo'}],
+        headers={'X-RapidAPI-Subscription': 'ULTRA'}
+    )
+
+    assert response.status_code == 200
+    checks = {call.args[0]: call.kwargs["checks"] for call in mock_check_proxy.call_args_list}
+    assert checks == {'1.2.3.4:8080': (), '5.6.7.8:8080': ('geo',)}
 
 # Tests for /check/async endpoint
 def test_check_async_endpoint_gating_basic_plan(client):
@@ -544,7 +846,7 @@ def test_check_async_endpoint_gating_ultra_plan(client):
     assert response.json == {"error": "Asynchronous checking requires an ENTERPRISE plan or higher."}
 
 def test_check_async_endpoint_valid_payload(client, mocker):
-    mock_delay = mocker.patch('api.app.process_proxies_task.delay')
+    mock_dispatch = mocker.patch('api.app.dispatch_job')
     
     proxies_to_check = [
         {'proxy': '1.2.3.4:8080', 'type': 'http'},
@@ -560,13 +862,27 @@ def test_check_async_endpoint_valid_payload(client, mocker):
     assert response.status_code == 202
     assert "job_id" in response.json
     assert response.json["status"] == "submitted"
-    mock_delay.assert_called_once()
-    args, kwargs = mock_delay.call_args
+    mock_dispatch.assert_called_once()
+    args, kwargs = mock_dispatch.call_args
     assert len(args[0]) == 2  # Two proxies
     assert args[1] == response.json["job_id"]
     assert args[2] == 'http://example.com/callback'
     assert args[0][0]['user_plan'] == 'ENTERPRISE'
 
+def test_check_async_endpoint_routes_by_plan_and_tenant(client, mocker):
+    mock_dispatch = mocker.patch('api.app.dispatch_job')
+    mocker.patch.dict('celery_worker.PLAN_QUEUES', {"ENTERPRISE": "checks-enterprise"})
+
+    response = client.post(
+        '/check/async',
+        json={'proxies': [{'proxy': '1.2.3.4:8080', 'type': 'http'}]},
+        headers={'X-RapidAPI-Subscription': 'ENTERPRISE', 'X-RapidAPI-User': 'tenant-a'}
+    )
+
+    assert response.status_code == 202
+    assert mock_dispatch.call_args.kwargs["tenant"] == "tenant-a"
+    assert mock_dispatch.call_args.kwargs["queue"] == "checks-enterprise"
+
 def test_check_async_endpoint_invalid_json_not_list(client):
     response = client.post(
         '/check/async',
@@ -577,6 +893,40 @@ def test_check_async_endpoint_invalid_json_not_list(client):
     assert response.status_code == 400
     assert response.json == {"error": "'proxies' must be a non-empty JSON array of proxy objects."}
 
+def test_check_async_endpoint_batch_callbacks(client, mocker):
+    mock_dispatch = mocker.patch('api.app.dispatch_job')
+
+    response = client.post(
+        '/check/async',
+        json={'proxies': [{'proxy': '1.2.3.4:8080', 'type': 'http'}], 'callback_url': 'http://example.com/callback',
+              'callback_batch_size': 25, 'callback_batch_seconds': 2.5},
+        headers={'X-RapidAPI-Subscription': 'ENTERPRISE'}
+    )
+
+    assert response.status_code == 202
+    assert mock_dispatch.call_args.kwargs == {"callback_batch_size": 25, "callback_batch_seconds": 2.5,
+                                              "tenant": "anonymous", "queue": "celery"}
+
+@pytest.mark.parametrize("options, error", [
+    ({'callback_batch_size': 0, 'callback_url': 'http://example.com/callback'},
+     "'callback_batch_size' must be a whole number of at least 1."),
+    ({'callback_batch_seconds': -1, 'callback_url': 'http://example.com/callback'},
+     "'callback_batch_seconds' must be a positive number of seconds."),
+    ({'callback_batch_size': 10}, "Batch callbacks require a 'callback_url'."),
+])
+def test_check_async_endpoint_invalid_batch_callbacks(client, mocker, options, error):
+    mock_dispatch = mocker.patch('api.app.dispatch_job')
+
+    response = client.post(
+        '/check/async',
+        json=dict(options, proxies=[{'proxy': '1.2.3.4:8080', 'type': 'http'}]),
+        headers={'X-RapidAPI-Subscription': 'ENTERPRISE'}
+    )
+
+    assert response.status_code == 400
+    assert response.json == {"error": error}
+    mock_dispatch.assert_not_called()
+
 def test_check_async_endpoint_too_many_proxies(client):
     proxies_to_check = [{'proxy': f'1.2.3.{i}:8080', 'type': 'http'} for i in range(1001)]
     response = client.post(
@@ -588,33 +938,184 @@ def test_check_async_endpoint_too_many_proxies(client):
     assert response.status_code == 400
     assert response.json == {"error": "Maximum 1000 proxies allowed per asynchronous request."}
 
-def test_get_async_results_pending(client, mocker):
-    mock_async_result = mocker.Mock()
-    mock_async_result.state = 'PENDING'
-    mocker.patch('api.app.process_proxies_task.AsyncResult', return_value=mock_async_result)
+def test_check_async_endpoint_streamed_text_upload(client, mocker, memory_job_store):
+    celery_app.conf.task_always_eager = True
+    mocker.patch('celery_worker.check_proxy', side_effect=lambda proxy, *args, **kwargs: {"status": "alive",
+                                                                                          "proxy_type": proxy})
+    mocker.patch('celery_worker.fill_geo_data')
+    body = gzip.compress(b"".join(f"10.0.{i // 256}.{i % 256}:8080\n".encode() for i in range(120)))
+
+    try:
+        response = client.post('/check/async?type=socks5&checks=geo', data=body,
+                                headers={'X-RapidAPI-Subscription': 'ENTERPRISE', 'Content-Type': 'text/plain',
+                                         'Content-Encoding': 'gzip'})
+    finally:
+        celery_app.conf.task_always_eager = False
+
+    assert response.status_code == 202
+    assert response.json["accepted"] == 120
+    job = memory_job_store.get(response.json["job_id"])
+    assert (job["status"], job["done"], job["total"]) == ("completed", 120, 120)
+    _, page = memory_job_store.results(response.json["job_id"], limit=1)
+    assert page == [(0, {"status": "alive", "proxy_type": "10.0.0.0:8080"})]
+
+def test_check_async_endpoint_streamed_ndjson_entries(client, mocker):
+    dispatched = []
+
+    def fake_dispatch_stream(entries, *args, **kwargs):
+        dispatched.extend(entries)
+        return len(dispatched)
+
+    mock_dispatch = mocker.patch('api.app.dispatch_stream', side_effect=fake_dispatch_stream)
+
+    response = client.post(
+        '/check/async?fields=status&callback_url=http://example.com/cb&callback_batch_size=50',
+        data=b'{"proxy": "1.2.3.4:8080", "type": "http"}\n{"proxy": "5.6.7.8:1080", "checks": ["ssl"]}\n',
+        headers={'X-RapidAPI-Subscription': 'ENTERPRISE', 'Content-Type': 'application/x-ndjson'}
+    )
+
+    assert response.status_code == 202
+    assert response.json["accepted"] == 2
+    assert dispatched == [
+        {"proxy": "1.2.3.4:8080", "type": "http", "fields": "status", "user_plan": "ENTERPRISE"},
+        {"proxy": "5.6.7.8:1080", "checks": ["ssl"], "user_plan": "ENTERPRISE"},
+    ]
+    args, kwargs = mock_dispatch.call_args
+    assert args[1:] == (response.json["job_id"], 'http://example.com/cb')
+    assert kwargs["callback_batch_size"] == 50
+
+def test_check_async_endpoint_streamed_upload_limit_per_plan(client, mocker, memory_job_store):
+    mocker.patch.dict('api.app.ASYNC_STREAM_PLAN_LIMITS', {"ENTERPRISE": 2})
+    mocker.patch('celery_worker.check_stream_chunk_task')
+
+    response = client.post('/check/async', data=b"1.1.1.1:80\n2.2.2.2:80\n3.3.3.3:80\n",
+                           headers={'X-RapidAPI-Subscription': 'ENTERPRISE', 'Content-Type': 'text/plain'})
+
+    assert response.status_code == 400
+    assert response.json["error"] == "Maximum 2 proxies allowed per asynchronous request."
+    assert memory_job_store.get(response.json["job_id"])["status"] == "failed"
+
+def test_get_async_results_pending(client, memory_job_store):
+    memory_job_store.create("some_job_id", 2)
 
     response = client.get('/check/async/some_job_id')
     assert response.status_code == 200
     assert response.json["job_id"] == "some_job_id"
     assert response.json["status"] == "pending"
+    assert response.json["progress"]["done"] == 0
+    assert response.json["results"] == []
 
-def test_get_async_results_completed(client, mocker):
-    mock_async_result = mocker.Mock()
-    mock_async_result.state = 'SUCCESS'
-    mock_async_result.result = [{"status": "alive"}]
-    mocker.patch('api.app.process_proxies_task.AsyncResult', return_value=mock_async_result)
+def test_get_async_results_unknown_job(client):
+    response = client.get('/check/async/no_such_job')
+
+    assert response.status_code == 404
+    assert response.json == {"error": "Job not found."}
+
+def test_get_async_results_progress(client, memory_job_store):
+    memory_job_store.create("some_job_id", 4)
+    memory_job_store.put_results("some_job_id", 2, [{"status": "alive"}])
+
+    response = client.get('/check/async/some_job_id')
+
+    assert response.json["status"] == "progress"
+    assert response.json["progress"]["done"] == 1
+    assert response.json["progress"]["alive"] == 1
+    assert response.json["progress"]["eta_seconds"] is not None
+    assert response.json["results"] == [{"status": "alive", "index": 2}]
+
+def test_get_async_results_paged_and_filtered(client, memory_job_store):
+    results = [{"status": "alive" if i % 3 == 0 else "dead"} for i in range(10)] + [{"error": "bad entry"}]
+    memory_job_store.create("some_job_id", len(results))
+    memory_job_store.put_results("some_job_id", 0, results)
+    memory_job_store.finish("some_job_id")
+
+    response = client.get('/check/async/some_job_id?offset=2&limit=3')
+    assert [result["index"] for result in response.json["results"]] == [2, 3, 4]
+    assert response.json["page"] == {"offset": 2, "limit": 3, "matching": 11}
+
+    response = client.get('/check/async/some_job_id?status=alive&offset=1&limit=2')
+    assert [result["index"] for result in response.json["results"]] == [3, 6]
+    assert response.json["page"]["matching"] == 4
+
+    response = client.get('/check/async/some_job_id?status=alive,error')
+    assert [result["index"] for result in response.json["results"]] == [0, 3, 6, 9, 10]
+
+def test_get_async_results_compact_keeps_index(client, memory_job_store):
+    results = [{"status": "dead", "error": "Timeout: read timed out"}, {"status": "alive", "latency_ms": 80},
+               {"status": "dead", "error": "ProxyError: refused"}]
+    memory_job_store.create("some_job_id", len(results))
+    memory_job_store.put_results("some_job_id", 0, results)
+    memory_job_store.finish("some_job_id")
+
+    response = client.get('/check/async/some_job_id?status=dead&output=compact')
+
+    assert response.json["results"] == [
+        {"status": "dead", "error_code": "timeout", "detail": "read timed out", "index": 0},
+        {"status": "dead", "error_code": "proxy_error", "detail": "refused", "index": 2},
+    ]
+
+def test_get_async_results_invalid_paging(client, memory_job_store):
+    memory_job_store.create("some_job_id", 1)
+
+    response = client.get('/check/async/some_job_id?limit=100000')
+    assert response.status_code == 400
+
+    response = client.get('/check/async/some_job_id?status=zombie')
+    assert response.status_code == 400
+    assert response.json == {"error": "'status' must be a comma-separated list of: alive, dead, timed_out, error."}
+
+def _progress(done):
+    return {"job_id": "some_job_id", "status": "progress", "progress": {"done": done, "total": 3}}
+
+def test_get_async_results_long_poll_returns_on_change(client, mocker):
+    mocker.patch('api.app.LONG_POLL_INTERVAL', 0.01)
+    mock_status = mocker.patch('api.app.job_status', side_effect=[_progress(1), _progress(1), _progress(1), _progress(2)])
+
+    response = client.get('/check/async/some_job_id?wait=5')
+
+    assert response.json["progress"]["done"] == 2
+    assert mock_status.call_count == 4
+
+def test_get_async_results_long_poll_since(client, mocker):
+    mocker.patch('api.app.LONG_POLL_INTERVAL', 0.01)
+    mock_status = mocker.patch('api.app.job_status', side_effect=[_progress(2)])
+
+    # The client has seen done=1 already, so done=2 is news and returns at once
+    response = client.get('/check/async/some_job_id?wait=5&since=1')
+
+    assert response.json["progress"]["done"] == 2
+    assert mock_status.call_count == 1
+
+def test_get_async_results_long_poll_times_out(client, mocker):
+    mocker.patch('api.app.LONG_POLL_INTERVAL', 0.01)
+    mocker.patch('api.app.job_status', return_value=_progress(1))
+
+    start = time.monotonic()
+    response = client.get('/check/async/some_job_id?wait=0.1')
+
+    assert 0.1 <= time.monotonic() - start < 1
+    assert response.json["progress"]["done"] == 1
+
+def test_get_async_results_invalid_wait(client):
+    response = client.get('/check/async/some_job_id?wait=600')
+
+    assert response.status_code == 400
+    assert response.json == {"error": "'wait' must be a number of seconds between 0 and 30."}
+
+def test_get_async_results_completed(client, memory_job_store):
+    memory_job_store.create("some_job_id", 1)
+    memory_job_store.put_results("some_job_id", 0, [{"status": "alive"}])
+    memory_job_store.finish("some_job_id")
 
     response = client.get('/check/async/some_job_id')
     assert response.status_code == 200
     assert response.json["job_id"] == "some_job_id"
     assert response.json["status"] == "completed"
-    assert response.json["results"] == [{"status": "alive"}]
+    assert response.json["results"] == [{"status": "alive", "index": 0}]
 
-def test_get_async_results_failed(client, mocker):
-    mock_async_result = mocker.Mock()
-    mock_async_result.state = 'FAILURE'
-    mock_async_result.info = Exception("Task failed")
-    mocker.patch('api.app.process_proxies_task.AsyncResult', return_value=mock_async_result)
+def test_get_async_results_failed(client, memory_job_store):
+    memory_job_store.create("some_job_id", 1)
+    memory_job_store.finish("some_job_id", error="Task failed")
 
     response = client.get('/check/async/some_job_id')
     assert response.status_code == 200
@@ -622,37 +1123,63 @@ def test_get_async_results_failed(client, mocker):
     assert response.json["status"] == "failed"
     assert response.json["error"] == "Task failed"
 
-def test_get_async_results_csv_success(client, mocker):
-    mock_async_result = mocker.Mock()
-    mock_async_result.state = 'SUCCESS'
-    mock_async_result.result = [
-        {"proxy": "1.1.1.1:8080", "status": "alive"},
-        {"proxy": "2.2.2.2:8080", "status": "dead"}
-    ]
-    mocker.patch('api.app.process_proxies_task.AsyncResult', return_value=mock_async_result)
+def _completed_job(store, results):
+    store.create("some_job_id", len(results))
+    store.put_results("some_job_id", 0, results)
+    store.finish("some_job_id")
+
+def test_get_async_results_csv_success(client, memory_job_store):
+    # A dead first row must not drop the columns of the alive rows after it
+    _completed_job(memory_job_store, [
+        {"status": "dead", "error": "Timeout: read timed out"},
+        {"status": "alive", "latency_ms": 321, "proxy_type": "HTTP", "country": "Germany", "anonymous": True}
+    ])
 
     response = client.get('/check/async/some_job_id/csv')
     assert response.status_code == 200
     assert response.headers["Content-type"] == "text/csv"
     assert response.headers["Content-Disposition"] == "attachment; filename=some_job_id.csv"
-    expected_csv = "proxy,status\r\n1.1.1.1:8080,alive\r\n2.2.2.2:8080,dead\r\n"
-    assert response.data.decode() == expected_csv
+    assert response.is_streamed
+    lines = response.data.decode().splitlines()
+    header = lines[0].split(",")
+    assert header[:6] == ["index", "status", "proxy_type", "latency_ms", "country", "anonymous"]
+    assert lines[1].split(",")[:2] == ["0", "dead"]
+    assert lines[1].split(",")[-1] == "Timeout: read timed out"
+    assert lines[2].split(",")[:6] == ["1", "alive", "HTTP", "321", "Germany", "True"]
+
+def test_get_async_results_ndjson_and_gzip(client, memory_job_store):
+    _completed_job(memory_job_store, [{"status": "alive", "latency_ms": 321}, {"status": "dead"}])
+
+    response = client.get('/check/async/some_job_id/ndjson')
+    assert response.headers["Content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.data.decode().splitlines()] == [
+        {"status": "alive", "latency_ms": 321, "index": 0}, {"status": "dead", "index": 1}]
 
-def test_get_async_results_csv_job_not_completed(client, mocker):
-    mock_async_result = mocker.Mock()
-    mock_async_result.state = 'PENDING'
-    mocker.patch('api.app.process_proxies_task.AsyncResult', return_value=mock_async_result)
+    response = client.get('/check/async/some_job_id/ndjson.gz')
+    assert response.headers["Content-type"] == "application/gzip"
+    assert response.headers["Content-Disposition"] == "attachment; filename=some_job_id.ndjson.gz"
+    assert len(gzip.decompress(response.data).decode().splitlines()) == 2
+
+    response = client.get('/check/async/some_job_id/csv.gz')
+    assert gzip.decompress(response.data).decode().startswith("index,status,")
+
+def test_get_async_results_unknown_export_format(client, memory_job_store):
+    _completed_job(memory_job_store, [{"status": "alive"}])
+
+    response = client.get('/check/async/some_job_id/xlsx')
+    assert response.status_code == 404
+    assert response.json == {"error": "Export format must be one of csv, ndjson, csv.gz or ndjson.gz."}
+
+def test_get_async_results_csv_job_not_completed(client, memory_job_store):
+    memory_job_store.create("some_job_id", 1)
 
     response = client.get('/check/async/some_job_id/csv')
     assert response.status_code == 404
     assert response.json == {"error": "Job not completed or no results available."}
 
-def test_get_async_results_csv_no_results(client, mocker):
-    mock_async_result = mocker.Mock()
-    mock_async_result.state = 'SUCCESS'
-    mock_async_result.result = []
-    mocker.patch('api.app.process_proxies_task.AsyncResult', return_value=mock_async_result)
+def test_get_async_results_csv_no_results(client, memory_job_store):
+    memory_job_store.create("some_job_id", 0)
+    memory_job_store.finish("some_job_id")
 
     response = client.get('/check/async/some_job_id/csv')
     assert response.status_code == 204
-
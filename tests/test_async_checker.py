@@ -0,0 +1,247 @@
+import asyncio
+import json
+import socket
+import ssl
+import time
+
+import pytest
+from proxy_checker import protocols
+from proxy_checker.async_checker import check_proxy_async, check_many_async, get_geo_data_async
+from proxy_checker.checker import get_geo_data
+
+MOCK_SUCCESS_GEO_RESPONSE = {"country": "United States", "isp": "Some ISP", "as": "AS12345 Some ASN"}
+
+def _http_response(payload: dict) -> bytes:
+    body = json.dumps(payload).encode()
+    return b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+
+async def _read_head(reader):
+    return await reader.readuntil(b"\r\n\r\n")
+
+async def _http_proxy_handler(reader, writer):
+    head = await _read_head(reader)
+    assert head.startswith(b"GET http://")
+    writer.write(_http_response({"origin": "9.9.9.9"}))
+    await writer.drain()
+    writer.close()
+
+async def _socks5_proxy_handler(reader, writer):
+    greeting = await reader.readexactly(3)
+    if greeting != protocols.socks5_greeting():
+        writer.close()  # Like SOCKS5 servers, reject other protocols by closing
+        return
+    writer.write(b"\x05\x00")
+    header = await reader.readexactly(5)
+    await reader.readexactly(protocols.socks5_reply_remaining(b"\x05\x00" + header[2:]))
+    writer.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+    await _read_head(reader)
+    writer.write(_http_response({"origin": "127.0.0.1"}))
+    await writer.drain()
+    writer.close()
+
+async def _run_against(handler, coro_factory):
+    server = await asyncio.start_server(handler, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        return await coro_factory(f"127.0.0.1:{port}")
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def mock_geo(mocker):
+    return mocker.patch('proxy_checker.async_checker.get_geo_data_async',
+                        new_callable=mocker.AsyncMock, return_value=MOCK_SUCCESS_GEO_RESPONSE)
+
+def test_check_proxy_async_http_proxy(mock_geo):
+    result = asyncio.run(_run_against(_http_proxy_handler,
+                                      lambda proxy: check_proxy_async(proxy, "http", user_plan="PRO")))
+
+    assert result["status"] == "alive"
+    assert isinstance(result["latency_ms"], int)
+    assert result["proxy_type"] == "HTTP"
+    assert result["country"] == "United States"
+    assert result["anonymous"] == True
+    assert result["isp"] == "Some ISP"
+    assert result["asn"] == "AS12345 Some ASN"
+    assert "dns_leak_detected" not in result
+
+def test_check_proxy_async_https_proxy_speaks_tls(mock_geo, mocker, tls_cert):
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(*tls_cert)
+    mocker.patch('proxy_checker.async_checker._proxy_ssl_context',
+                 return_value=ssl.create_default_context(cafile=tls_cert[0]))
+
+    async def run():
+        server = await asyncio.start_server(_http_proxy_handler, '127.0.0.1', 0, ssl=server_context)
+        async with server:
+            return await check_proxy_async(f"127.0.0.1:{server.sockets[0].getsockname()[1]}", "https",
+                                           user_plan="PRO")
+
+    result = asyncio.run(run())
+
+    assert result["status"] == "alive"
+    assert result["proxy_type"] == "HTTPS"
+    assert isinstance(result["latency_breakdown_ms"]["handshake"], int)
+
+def test_check_proxy_async_socks5_proxy(mock_geo):
+    result = asyncio.run(_run_against(_socks5_proxy_handler,
+                                      lambda proxy: check_proxy_async(proxy, "socks5")))
+
+    assert result["status"] == "alive"
+    assert result["proxy_type"] == "SOCKS5"
+    assert result["anonymous"] == False # origin 127.0.0.1 is the proxy itself
+    assert "isp" not in result
+
+def test_check_proxy_async_connection_refused(mock_geo):
+    result = asyncio.run(check_proxy_async(f"127.0.0.1:{_free_port()}", "http"))
+
+    assert result["status"] == "dead"
+    assert result["error"].startswith("ConnectionError")
+    mock_geo.assert_not_called()
+
+def test_check_proxy_async_dead_reason_matches_check_proxy(mock_geo):
+    result = asyncio.run(check_proxy_async(f"127.0.0.1:{_free_port()}", "socks5"))
+
+    assert result == {"status": "dead", "error": "ConnectionError: Connection refused by proxy",
+                      "dead_reason": "connection_refused"}
+
+@pytest.mark.parametrize("proxy", ["127.0.0.1", "localhost:notaport"])
+def test_check_proxy_async_invalid_address(mock_geo, proxy):
+    result = asyncio.run(check_proxy_async(proxy, "http"))
+
+    assert result["status"] == "dead"
+    assert result["dead_reason"] == "invalid_address"
+
+def test_check_proxy_async_timings(mock_geo):
+    result = asyncio.run(_run_against(_socks5_proxy_handler,
+                                      lambda proxy: check_proxy_async(proxy, "socks5", user_plan="PRO")))
+
+    breakdown = result["latency_breakdown_ms"]
+    assert set(breakdown) == {"connect", "handshake", "tls", "ttfb", "total"}
+    assert isinstance(breakdown["connect"], int) and isinstance(breakdown["handshake"], int)
+    assert breakdown["tls"] is None
+    assert breakdown["ttfb"] <= breakdown["total"]
+    assert set(result["stage_latency_ms"]) == {"probe", "geo"}
+
+def test_check_proxy_async_samples(mock_geo):
+    result = asyncio.run(_run_against(_http_proxy_handler,
+                                      lambda proxy: check_proxy_async(proxy, "http", samples=3)))
+
+    assert result["status"] == "alive"
+    assert result["latency_samples_ms"]["count"] == 3
+
+def test_check_proxy_async_samples_stop_at_failed_sample(mock_geo):
+    served = []
+
+    async def handler(reader, writer):
+        await _read_head(reader)
+        if not served:
+            served.append(True)
+            writer.write(_http_response({"origin": "9.9.9.9"}))
+        else:
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    result = asyncio.run(_run_against(handler, lambda proxy: check_proxy_async(proxy, "http", samples=3)))
+
+    assert result["status"] == "alive"
+    assert result["latency_samples_ms"]["count"] == 1
+
+def test_check_proxy_async_auto_detects_socks5(mock_geo):
+    async def handler(reader, writer):
+        try:
+            await _socks5_proxy_handler(reader, writer)
+        except asyncio.IncompleteReadError:
+            writer.close()  # The fingerprint connection ends after the greeting
+
+    result = asyncio.run(_run_against(handler, lambda proxy: check_proxy_async(proxy, "auto")))
+
+    assert result["status"] == "alive"
+    assert result["proxy_type"] == "SOCKS5"
+
+def test_check_proxy_async_deadline(mock_geo):
+    async def handler(reader, writer):
+        await _read_head(reader)
+        await asyncio.sleep(2)
+        writer.close()
+
+    result = asyncio.run(_run_against(handler, lambda proxy: check_proxy_async(proxy, "http", read_timeout=5,
+                                                                              deadline_ms=200)))
+
+    assert result == {"status": "timed_out", "error": "Check did not finish within its 200ms deadline."}
+
+def test_check_proxy_async_deadline_caps_type_detection(mock_geo):
+    async def handler(reader, writer):
+        await asyncio.sleep(2)  # Never answers any handshake
+        writer.close()
+
+    async def run(proxy):
+        start = time.monotonic()
+        result = await check_proxy_async(proxy, "auto", user_plan="PRO", deadline_ms=500)
+        return result, time.monotonic() - start
+
+    result, elapsed = asyncio.run(_run_against(handler, run))
+
+    assert elapsed <= 0.7
+    assert result == {"status": "timed_out", "error": "Check did not finish within its 500ms deadline."}
+
+def test_check_proxy_async_http_error(mock_geo):
+    async def handler(reader, writer):
+        await _read_head(reader)
+        writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    result = asyncio.run(_run_against(handler, lambda proxy: check_proxy_async(proxy, "http")))
+
+    assert result["status"] == "dead"
+    assert result["error"].startswith("HTTPError: 502 Server Error")
+
+def test_check_many_async_preserves_order(mock_geo):
+    async def run(proxy):
+        return await check_many_async([
+            {'proxy': proxy, 'type': 'http'},
+            {'type': 'http'},
+            {'proxy': f"127.0.0.1:{_free_port()}", 'type': 'http'},
+        ], concurrency=2)
+
+    results = asyncio.run(_run_against(_http_proxy_handler, run))
+
+    assert [r.get("status") for r in results] == ["alive", None, "dead"]
+    assert results[1] == {"error": "Missing 'proxy' or 'type' in one of the proxy objects."}
+
+def test_check_many_async_rejects_invalid_options(mock_geo):
+    results = asyncio.run(check_many_async([{'proxy': '127.0.0.1:1', 'type': 'http', 'samples': 0}]))
+
+    assert results == [{"error": "'samples' must be a whole number between 1 and 10."}]
+
+def test_get_geo_data_async_uses_geo_cache(mocker):
+    response = mocker.Mock(json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
+    mock_fetch = mocker.patch('proxy_checker.async_checker.fetch', new_callable=mocker.AsyncMock, return_value=response)
+
+    assert asyncio.run(get_geo_data_async("8.8.8.8")) == MOCK_SUCCESS_GEO_RESPONSE
+    assert asyncio.run(get_geo_data_async("8.8.8.8")) == MOCK_SUCCESS_GEO_RESPONSE
+    assert get_geo_data("8.8.8.8") == MOCK_SUCCESS_GEO_RESPONSE
+
+    assert mock_fetch.call_count == 1
+
+def test_get_geo_data_async_failure_is_negatively_cached(mocker):
+    mock_fetch = mocker.patch('proxy_checker.async_checker.fetch', new_callable=mocker.AsyncMock,
+                              side_effect=ConnectionError)
+
+    assert asyncio.run(get_geo_data_async("8.8.8.8")) == {}
+    assert asyncio.run(get_geo_data_async("8.8.8.8")) == {}
+
+    assert mock_fetch.call_count == 1
+
+def test_socks5_connect_request_uses_domain_name():
+    request = protocols.socks5_connect_request("httpbin.org", 80)
+    assert request == b"\x05\x01\x00\x03\x0bhttpbin.org\x00\x50"
+
+def test_socks4_reply_rejected():
+    with pytest.raises(protocols.ProxyProtocolError):
+        protocols.check_socks4_reply(b"\x00\x5b\x00\x00\x00\x00\x00\x00")
@@ -0,0 +1,80 @@
+import json
+
+from proxy_checker.cache import TTLCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+
+def test_ttl_cache_hit_and_miss():
+    cache = TTLCache(10)
+    assert cache.get("1.2.3.4") is None
+    cache.set("1.2.3.4", {"country": "United States"}, ttl=60)
+    assert cache.get("1.2.3.4") == {"country": "United States"}
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+def test_ttl_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(10, clock=clock)
+    cache.set("1.2.3.4", {}, ttl=60)
+    clock.now = 59
+    assert cache.get("1.2.3.4") == {}
+    clock.now = 61
+    assert cache.get("1.2.3.4") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a") # "b" is now the least recently used
+    cache.set("c", 3, ttl=60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_cache_shared_tier():
+    shared = FakeRedis()
+    writer = TTLCache(10, shared=shared, namespace="geo:")
+    reader = TTLCache(10, shared=shared, namespace="geo:")
+
+    writer.set("1.2.3.4", {"country": "Germany"}, ttl=60)
+    assert json.loads(shared.store["geo:1.2.3.4"])["value"] == {"country": "Germany"}
+
+    assert reader.get("1.2.3.4") == {"country": "Germany"}
+    assert reader.stats()["shared_hits"] == 1
+    # Now served from the local tier
+    assert reader.get("1.2.3.4") == {"country": "Germany"}
+    assert reader.stats()["hits"] == 1
+
+def test_ttl_cache_shared_tier_errors_count_as_misses():
+    class BrokenRedis:
+        def get(self, key):
+            raise ConnectionError("redis down")
+
+        def set(self, key, value, ex=None):
+            raise ConnectionError("redis down")
+
+    cache = TTLCache(10, shared=BrokenRedis())
+    cache.set("a", 1, ttl=60)
+    assert cache.get("b") is None
+    assert cache.stats()["shared_errors"] == 2
@@ -0,0 +1,223 @@
+import pytest
+from prometheus_client import REGISTRY
+from celery_worker import (FINISH_PRIORITY, WEBHOOK_QUEUE, aggregate_results_task, celery_app, check_chunk_task,
+                           check_entries, check_stream_chunk_task, chunk_priority, deliver_webhook_task, dispatch_job,
+                           dispatch_stream, fail_job_task, queue_depths)
+
+@pytest.fixture
+def eager():
+    celery_app.conf.task_always_eager = True
+    yield
+    celery_app.conf.task_always_eager = False
+
+def test_check_entries_keeps_order_and_reports_bad_entries(mocker):
+    mocker.patch('celery_worker.check_proxy', side_effect=lambda proxy, *args, **kwargs: {"status": "alive", "proxy": proxy})
+    mocker.patch('celery_worker.fill_geo_data')
+
+    results = check_entries([
+        {"proxy": "1.1.1.1:80", "type": "http"},
+        {"type": "http"},
+        {"proxy": "2.2.2.2:80", "type": "http", "samples": 0},
+        {"proxy": "3.3.3.3:80", "type": "http"},
+    ])
+
+    assert results == [
+        {"status": "alive", "proxy": "1.1.1.1:80"},
+        {"error": "Missing 'proxy' or 'type' in one of the proxy objects."},
+        {"error": "'samples' must be a whole number between 1 and 10."},
+        {"status": "alive", "proxy": "3.3.3.3:80"},
+    ]
+
+def test_dispatch_job_chunks_and_aggregates_in_order(mocker, eager, memory_job_store):
+    chunks = []
+
+    def fake_check_entries(proxies_data, on_result=None):
+        chunks.append([proxy_data["proxy"] for proxy_data in proxies_data])
+        return [{"status": "alive", "proxy": proxy_data["proxy"]} for proxy_data in proxies_data]
+
+    mocker.patch('celery_worker.check_entries', side_effect=fake_check_entries)
+    mock_deliver = mocker.patch('celery_worker.webhooks.deliver')
+
+    proxies = [{"proxy": f"10.0.0.{i}:80", "type": "http"} for i in range(7)]
+    result = dispatch_job(proxies, "job-1", "http://example.com/callback", chunk_size=3)
+
+    assert result.id == "job-1"
+    assert chunks == [["10.0.0.0:80", "10.0.0.1:80", "10.0.0.2:80"], ["10.0.0.3:80", "10.0.0.4:80", "10.0.0.5:80"],
+                      ["10.0.0.6:80"]]
+
+    job = memory_job_store.get("job-1")
+    assert (job["status"], job["done"], job["total"]) == ("completed", 7, 7)
+    _, page = memory_job_store.results("job-1")
+    assert [result["proxy"] for _, result in page] == [proxy["proxy"] for proxy in proxies]
+
+    # The callback fires once, for the whole job
+    mock_deliver.assert_called_once()
+    url, payload = mock_deliver.call_args.args
+    assert (url, payload["job_id"], payload["status"]) == ("http://example.com/callback", "job-1", "completed")
+    assert [result["proxy"] for result in payload["results"]] == [proxy["proxy"] for proxy in proxies]
+    assert memory_job_store.get("job-1")["callback"] == {"status": "delivered", "attempts": 1}
+
+def test_dispatch_job_checks_duplicates_once(mocker, eager, memory_job_store):
+    checked = []
+
+    def fake_check_proxy(proxy, *args, **kwargs):
+        checked.append(proxy)
+        return {"status": "alive", "proxy_type": proxy}
+
+    mocker.patch('celery_worker.check_proxy', side_effect=fake_check_proxy)
+    mocker.patch('celery_worker.fill_geo_data')
+
+    proxies = [{"proxy": f"10.0.0.{i % 3}:80", "type": "http", "user_plan": "ENTERPRISE"} for i in range(7)]
+    dispatch_job(proxies, "job-4", chunk_size=2)
+
+    assert sorted(checked) == ["10.0.0.0:80", "10.0.0.1:80", "10.0.0.2:80"]
+    job = memory_job_store.get("job-4")
+    assert (job["status"], job["done"], job["total"]) == ("completed", 7, 7)
+    _, page = memory_job_store.results("job-4")
+    assert [(index, result["proxy_type"]) for index, result in page] == \
+        [(i, f"10.0.0.{i % 3}:80") for i in range(7)]
+
+def test_dispatch_job_marks_failed_jobs(mocker, memory_job_store):
+    mock_chord = mocker.patch('celery_worker.chord')
+    dispatch_job([{"proxy": "1.1.1.1:80", "type": "http"}], "job-2")
+
+    body = mock_chord.return_value.call_args.args[0]
+    assert [errback.task for errback in body.options["link_error"]] == [fail_job_task.name]
+
+    fail_job_task(None, RuntimeError("worker lost"), None, "job-2")
+
+    job = memory_job_store.get("job-2")
+    assert job["status"] == "failed"
+    assert job["error"] == "RuntimeError: worker lost"
+
+def test_dispatch_job_interleaves_tenants(mocker, memory_job_store):
+    mock_chord = mocker.patch('celery_worker.chord')
+
+    def priorities(job_id, tenant, size):
+        dispatch_job([{"proxy": f"10.0.{i // 256}.{i % 256}:80", "type": "http"} for i in range(size)], job_id,
+                     chunk_size=10, tenant=tenant, queue="checks-enterprise")
+        header = mock_chord.call_args.args[0]
+        assert {signature.options["queue"] for signature in header} == {"checks-enterprise"}
+        return [signature.options["priority"] for signature in header]
+
+    # A large job fills tenant-a's backlog; later jobs from tenant-a queue behind it,
+    # while tenant-b's first chunks go ahead of all but tenant-a's first ones
+    assert priorities("big", "tenant-a", 150) == list(range(10)) + [9] * 5
+    assert priorities("more", "tenant-a", 20) == [9, 9]
+    assert priorities("small", "tenant-b", 20) == [0, 1]
+
+def test_finishing_tasks_queue_behind_each_tenants_next_chunk():
+    for task in (aggregate_results_task, fail_job_task, deliver_webhook_task):
+        assert task.priority == FINISH_PRIORITY
+    assert chunk_priority(0) < FINISH_PRIORITY < chunk_priority(2)
+
+def test_dispatch_stream_queues_chunks_as_entries_arrive(mocker, eager, memory_job_store):
+    chunks = []
+    read = []
+
+    def fake_check_entries(proxies_data, on_result=None):
+        # Chunks are checked while later entries haven't been read yet
+        chunks.append((len(read), [proxy_data["proxy"] for proxy_data in proxies_data]))
+        return [{"status": "alive", "proxy": proxy_data["proxy"]} for proxy_data in proxies_data]
+
+    def entries():
+        for i in range(7):
+            read.append(i)
+            yield {"proxy": f"10.0.0.{i % 5}:80", "type": "http"}
+
+    mocker.patch('celery_worker.check_entries', side_effect=fake_check_entries)
+    mock_deliver = mocker.patch('celery_worker.webhooks.deliver')
+
+    assert dispatch_stream(entries(), "job-6", "http://example.com/callback", chunk_size=3) == 7
+
+    assert chunks == [(3, ["10.0.0.0:80", "10.0.0.1:80", "10.0.0.2:80"]), (6, ["10.0.0.3:80", "10.0.0.4:80",
+                                                                               "10.0.0.0:80"]), (7, ["10.0.0.1:80"])]
+    job = memory_job_store.get("job-6")
+    assert (job["status"], job["done"], job["total"]) == ("completed", 7, 7)
+    _, page = memory_job_store.results("job-6")
+    assert [result["proxy"] for _, result in page] == [f"10.0.0.{i % 5}:80" for i in range(7)]
+    mock_deliver.assert_called_once()
+
+def test_dispatch_stream_fails_job_on_bad_input(mocker, eager, memory_job_store):
+    mocker.patch('celery_worker.check_entries', side_effect=lambda proxies_data, on_result=None: [{"status": "alive"}])
+    mock_deliver = mocker.patch('celery_worker.webhooks.deliver')
+
+    def entries():
+        yield {"proxy": "1.1.1.1:80", "type": "http"}
+        raise ValueError("Line 2 is not valid JSON.")
+
+    with pytest.raises(ValueError):
+        dispatch_stream(entries(), "job-7", "http://example.com/callback", chunk_size=1)
+
+    job = memory_job_store.get("job-7")
+    assert (job["status"], job["error"]) == ("failed", "ValueError: Line 2 is not valid JSON.")
+    mock_deliver.assert_not_called()
+
+def test_stream_chunks_of_failed_jobs_are_skipped(mocker, memory_job_store):
+    mock_check_entries = mocker.patch('celery_worker.check_entries')
+    memory_job_store.create("job-8", 1)
+    memory_job_store.add_pending("job-8", 1)
+    memory_job_store.finish("job-8", error="ValueError: bad input")
+    memory_job_store.adjust_backlog("tenant-a", 1)
+
+    check_stream_chunk_task.apply(args=([{"proxy": "1.1.1.1:80", "type": "http"}], "job-8", 0, None, None,
+                                        "tenant-a"))
+
+    mock_check_entries.assert_not_called()
+    assert memory_job_store.adjust_backlog("tenant-a", 0) == 0
+    assert memory_job_store.get("job-8")["status"] == "failed"
+
+def test_check_chunk_task_shrinks_tenant_backlog(mocker, memory_job_store):
+    mocker.patch('celery_worker.check_entries', return_value=[{"status": "alive"}])
+    memory_job_store.create("job-5", 1)
+    memory_job_store.adjust_backlog("tenant-a", 2)
+
+    check_chunk_task.apply(args=([{"proxy": "1.1.1.1:80", "type": "http"}], "job-5", 0, None, None, "tenant-a"))
+
+    assert memory_job_store.adjust_backlog("tenant-a", 0) == 1
+
+def test_check_chunk_task_writes_results_incrementally(mocker, memory_job_store):
+    mocker.patch('celery_worker.PROGRESS_INTERVAL', 0)
+    seen = []
+
+    def fake_check_proxy(proxy, *args, **kwargs):
+        # What the store holds for this job when each check starts
+        seen.append(memory_job_store.get("job-3")["done"])
+        return {"status": "alive", "country": None}
+
+    def fake_fill_geo_data(checked):
+        for _, result in checked:
+            result["country"] = "DE"
+
+    mocker.patch('celery_worker.check_proxy', side_effect=fake_check_proxy)
+    mocker.patch('celery_worker.fill_geo_data', side_effect=fake_fill_geo_data)
+    memory_job_store.create("job-3", 13)
+
+    check_chunk_task.apply(args=([{"proxy": f"1.1.1.{i}:80", "type": "http"} for i in range(3)], "job-3", 10))
+
+    assert seen == [0, 1, 2]
+    matching, page = memory_job_store.results("job-3")
+    assert matching == 3
+    assert [index for index, _ in page] == [10, 11, 12]
+    # The final write carries the geo fields filled in at the end of the chunk
+    assert all(result["country"] == "DE" for _, result in page)
+
+def test_queue_depths_reads_waiting_messages_from_broker():
+    with celery_app.connection_for_write() as connection:
+        producer = connection.Producer()
+        for _ in range(3):
+            producer.publish({"n": 1}, routing_key=WEBHOOK_QUEUE, declare=[connection.SimpleQueue(WEBHOOK_QUEUE).queue])
+
+    try:
+        assert queue_depths()[WEBHOOK_QUEUE] == 3
+    finally:
+        with celery_app.connection_for_write() as connection:
+            connection.SimpleQueue(WEBHOOK_QUEUE).clear()
+
+def test_finished_jobs_are_counted(mocker, eager, memory_job_store):
+    mocker.patch('celery_worker.check_entries', side_effect=lambda proxies_data, on_result=None: [{"status": "alive"}])
+    before = REGISTRY.get_sample_value('proxy_checker_jobs_total', {"status": "completed"}) or 0
+
+    dispatch_job([{"proxy": "10.0.0.1:80", "type": "http"}], "job-counted", None)
+
+    assert REGISTRY.get_sample_value('proxy_checker_jobs_total', {"status": "completed"}) == before + 1
@@ -1,19 +1,35 @@
+import socket
+import threading
+import time
+
 import pytest
 import requests
-from proxy_checker.checker import check_proxy, get_geo_data, dns_leak_test, ssl_verification
+from proxy_checker.checker import Deadline, check_proxy, percentile, fill_geo_data, get_geo_data, get_geo_data_batch, geo_cache_stats, dns_leak_test, ssl_verification
 
 # Mock data for successful proxy check
 MOCK_SUCCESS_IP_RESPONSE = {"origin": "1.1.1.1"}
 MOCK_SUCCESS_GEO_RESPONSE = {"country": "United States", "isp": "Some ISP", "as": "AS12345 Some ASN"}
 
+def route_requests(mocker, routes):
+    """
+    Mocks requests.Session.get, answering each call by the URL prefix it matches.
+    """
+    def fake_get(url, *args, **kwargs):
+        for prefix, response in routes.items():
+            if url.startswith(prefix):
+                return response
+        raise AssertionError(f"Unexpected request to {url}")
+    return mocker.patch('requests.Session.get', side_effect=fake_get)
+
 # Test case for a successful proxy check
 def test_check_proxy_success_enterprise_plan(mocker):
-    mocker.patch('requests.get', side_effect=[
-        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
-        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
-        mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}), # For dns_leak_test
-        mocker.Mock(status_code=200) # For ssl_verification
-    ])
+    # Enrichment stages run concurrently, so answer by URL rather than call order
+    route_requests(mocker, {
+        "http://httpbin.org": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        "http://ip-api.com": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
+        "https://ipleak.net": mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}), # For dns_leak_test
+        "https://www.google.com": mocker.Mock(status_code=200) # For ssl_verification
+    })
     
     proxy = "1.2.3.4:8080"
     proxy_type = "http"
@@ -33,7 +49,7 @@ def test_check_proxy_success_enterprise_plan(mocker):
     assert result["threat_type"] == "none"
 
 def test_check_proxy_success_basic_plan(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.get', side_effect=[
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
     ])
@@ -56,7 +72,7 @@ def test_check_proxy_success_basic_plan(mocker):
     assert "threat_type" not in result
 
 def test_check_proxy_success_pro_plan(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.get', side_effect=[
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
     ])
@@ -79,12 +95,13 @@ def test_check_proxy_success_pro_plan(mocker):
     assert "threat_type" not in result
 
 def test_check_proxy_success_ultra_plan(mocker):
-    mocker.patch('requests.get', side_effect=[
-        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
-        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
-        mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}), # For dns_leak_test
-        mocker.Mock(status_code=200) # For ssl_verification
-    ])
+    # Enrichment stages run concurrently, so answer by URL rather than call order
+    route_requests(mocker, {
+        "http://httpbin.org": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        "http://ip-api.com": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
+        "https://ipleak.net": mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}), # For dns_leak_test
+        "https://www.google.com": mocker.Mock(status_code=200) # For ssl_verification
+    })
     
     proxy = "1.2.3.4:8080"
     proxy_type = "http"
@@ -104,12 +121,13 @@ def test_check_proxy_success_ultra_plan(mocker):
     assert "threat_type" not in result
 
 def test_check_proxy_success_enterprise_plan(mocker):
-    mocker.patch('requests.get', side_effect=[
-        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
-        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
-        mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}), # For dns_leak_test
-        mocker.Mock(status_code=200) # For ssl_verification
-    ])
+    # Enrichment stages run concurrently, so answer by URL rather than call order
+    route_requests(mocker, {
+        "http://httpbin.org": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        "http://ip-api.com": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
+        "https://ipleak.net": mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}), # For dns_leak_test
+        "https://www.google.com": mocker.Mock(status_code=200) # For ssl_verification
+    })
     
     proxy = "1.2.3.4:8080"
     proxy_type = "http"
@@ -128,9 +146,114 @@ def test_check_proxy_success_enterprise_plan(mocker):
     assert result["blacklisted"] == False
     assert result["threat_type"] == "none"
 
+def test_check_proxy_reports_stage_latency(mocker):
+    route_requests(mocker, {
+        "http://httpbin.org": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        "http://ip-api.com": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
+        "https://ipleak.net": mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}),
+        "https://www.google.com": mocker.Mock(status_code=200)
+    })
+
+    result = check_proxy("1.2.3.4:8080", "http", user_plan="ENTERPRISE")
+
+    assert set(result["stage_latency_ms"]) == {"probe", "geo", "dns_leak", "ssl", "reputation"}
+    assert all(isinstance(value, int) for value in result["stage_latency_ms"].values())
+
+def test_check_proxy_latency_breakdown(mocker, preprobe_passes):
+    preprobe_passes.return_value = {"alive": True, "connect_ms": 12, "handshake_ms": 8, "tls_ms": 30}
+    mock_get = route_requests(mocker, {
+        "https://httpbin.org": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        "http://ip-api.com": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
+    })
+
+    result = check_proxy("1.2.3.4:8080", "http", target_url="https://httpbin.org/ip")
+
+    breakdown = result["latency_breakdown_ms"]
+    assert (breakdown["connect"], breakdown["handshake"], breakdown["tls"]) == (12, 8, 30)
+    assert breakdown["ttfb"] == result["latency_ms"]
+    assert breakdown["total"] >= breakdown["ttfb"]
+    assert "latency_samples_ms" not in result
+    assert preprobe_passes.call_args.kwargs["tls"] == True
+    assert mock_get.call_args_list[0].kwargs["stream"] == True
+
+def test_check_proxy_latency_samples(mocker):
+    delays = iter([0.05, 0.01, 0.02, 0.03])
+
+    def fake_get(url, *args, **kwargs):
+        if url.startswith("http://ip-api.com"):
+            return mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
+        time.sleep(next(delays))
+        return mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE)
+
+    mocker.patch('requests.Session.get', side_effect=fake_get)
+
+    result = check_proxy("1.2.3.4:8080", "http", samples=4)
+
+    samples = result["latency_samples_ms"]
+    assert samples["count"] == 4
+    assert 10 <= samples["min"] < 20
+    assert samples["p50"] == result["latency_ms"]
+    assert 20 <= samples["p50"] < 40
+    assert samples["p95"] >= 40
+    assert result["stage_latency_ms"]["probe"] >= 110
+
+def test_check_proxy_latency_samples_stop_at_failed_sample(mocker):
+    probes = []
+
+    def fake_get(url, *args, **kwargs):
+        if url.startswith("http://ip-api.com"):
+            return mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
+        probes.append(url)
+        if len(probes) == 2:
+            raise requests.exceptions.ReadTimeout("read timed out")
+        return mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE)
+
+    mocker.patch('requests.Session.get', side_effect=fake_get)
+
+    result = check_proxy("1.2.3.4:8080", "http", samples=3)
+
+    # The proxy answered the first request, so it is alive with the one sample it gave
+    assert result["status"] == "alive"
+    assert result["latency_samples_ms"]["count"] == 1
+    assert result["latency_samples_ms"]["p50"] == result["latency_ms"]
+    assert len(probes) == 2
+
+def test_percentile():
+    assert percentile([5], 95) == 5
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([4, 1, 3, 2], 0) == 1
+    assert percentile([1, 2, 3, 4], 100) == 4
+
+def test_check_proxy_enrichment_stages_run_concurrently(mocker):
+    mocker.patch('proxy_checker.checker.ENRICHMENT_TIMEOUT', 0.3)
+    release = threading.Event()
+
+    def slow_leak_test(proxies):
+        release.wait(5)
+        return False
+
+    route_requests(mocker, {
+        "http://httpbin.org": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        "http://ip-api.com": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
+        "https://www.google.com": mocker.Mock(status_code=200)
+    })
+    mocker.patch('proxy_checker.checker.dns_leak_test', side_effect=slow_leak_test)
+
+    start = time.monotonic()
+    result = check_proxy("1.2.3.4:8080", "http", user_plan="ULTRA")
+    elapsed = time.monotonic() - start
+    release.set()
+
+    assert elapsed < 2
+    assert result["status"] == "alive"
+    assert result["country"] == "United States" # Finished within the budget
+    assert result["ssl_verified"] == True
+    assert result["dns_leak_detected"] is None # Missed the budget
+    assert result["stage_latency_ms"]["dns_leak"] is None
+
 # Test case for proxy timeout
 def test_check_proxy_timeout(mocker):
-    mocker.patch('requests.get', side_effect=requests.exceptions.Timeout)
+    mocker.patch('requests.Session.get', side_effect=requests.exceptions.Timeout)
     
     proxy = "1.2.3.4:8080"
     proxy_type = "http"
@@ -139,9 +262,80 @@ def test_check_proxy_timeout(mocker):
     assert result["status"] == "dead"
     assert "Timeout" in result["error"]
 
+def test_check_proxy_preprobe_failure_fails_fast(mocker, preprobe_passes):
+    preprobe_passes.return_value = {"alive": False, "reason": "connection_refused",
+                                    "error": "ConnectionError: Connection refused by proxy"}
+    mock_get = mocker.patch('requests.Session.get')
+
+    result = check_proxy("1.2.3.4:8080", "http")
+
+    mock_get.assert_not_called()
+    assert result == {"status": "dead", "error": "ConnectionError: Connection refused by proxy",
+                      "dead_reason": "connection_refused"}
+    assert preprobe_passes.call_args.args[:4] == ("1.2.3.4:8080", "http", "httpbin.org", 80)
+
+def test_check_proxy_separate_connect_and_read_timeouts(mocker, preprobe_passes):
+    mock_get = mocker.patch('requests.Session.get', side_effect=[
+        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
+    ])
+
+    check_proxy("1.2.3.4:8080", "http", target_url="https://example.com:8443/ip", connect_timeout=1.5, read_timeout=7)
+
+    assert mock_get.call_args_list[0].kwargs["timeout"] == (1.5, 7)
+    assert preprobe_passes.call_args.args[2:4] == ("example.com", 8443)
+    assert preprobe_passes.call_args.args[6] == 1.5
+
+def test_check_proxy_auto_detects_type(mocker, preprobe_passes):
+    detect = mocker.patch('proxy_checker.checker.detect_proxy_type',
+                          return_value={"alive": True, "proxy_type": "socks5", "connect_ms": 1, "handshake_ms": 1})
+    mock_get = mocker.patch('requests.Session.get', side_effect=[
+        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
+    ])
+
+    result = check_proxy("1.2.3.4:1080", "auto")
+
+    assert result["status"] == "alive"
+    assert result["proxy_type"] == "SOCKS5"
+    assert mock_get.call_args_list[0].kwargs["proxies"]["http"] == "socks5://1.2.3.4:1080"
+    assert detect.call_args.args[:4] == ("1.2.3.4:1080", "httpbin.org", 80, None)
+    preprobe_passes.assert_not_called()
+
+def test_check_proxy_auto_detects_socks5_needing_auth(mocker):
+    mocker.patch('proxy_checker.checker.detect_proxy_type',
+                 return_value={"alive": False, "reason": "auth_required", "proxy_type": "socks5", "connect_ms": 1,
+                               "error": "ProxyError: SOCKS5 server accepted none of the offered auth methods"})
+
+    result = check_proxy("1.2.3.4:1080", "auto")
+
+    assert result == {"status": "dead", "error": "ProxyError: SOCKS5 server accepted none of the offered auth methods",
+                      "dead_reason": "auth_required", "proxy_type": "SOCKS5"}
+
+def test_check_proxy_auto_detection_failed(mocker):
+    mocker.patch('proxy_checker.checker.detect_proxy_type',
+                 return_value={"alive": False, "reason": "detection_failed",
+                               "error": "ProxyError: Could not detect the proxy protocol (HTTP: unrecognised reply)"})
+    mock_get = mocker.patch('requests.Session.get')
+
+    result = check_proxy("1.2.3.4:1080", "auto", auto_types=("http",))
+
+    mock_get.assert_not_called()
+    assert result["dead_reason"] == "detection_failed"
+
 # Test case for connection error
+def test_check_proxy_target_rate_limited(mocker):
+    mock_get = mocker.patch('requests.Session.get')
+    acquire = mocker.patch('proxy_checker.checker.acquire', return_value=False)
+
+    result = check_proxy("1.2.3.4:8080", "http")
+
+    assert result == {"status": "timed_out", "error": "RateLimited: No request slot for httpbin.org within 2s"}
+    acquire.assert_called_once_with("httpbin.org", None)
+    mock_get.assert_not_called()
+
 def test_check_proxy_connection_error(mocker):
-    mocker.patch('requests.get', side_effect=requests.exceptions.ConnectionError)
+    mocker.patch('requests.Session.get', side_effect=requests.exceptions.ConnectionError)
     
     proxy = "1.2.3.4:8080"
     proxy_type = "http"
@@ -152,7 +346,7 @@ def test_check_proxy_connection_error(mocker):
 
 # Test case for HTTP error (e.g., 404, 500)
 def test_check_proxy_http_error(mocker):
-    mocker.patch('requests.get', side_effect=requests.exceptions.HTTPError)
+    mocker.patch('requests.Session.get', side_effect=requests.exceptions.HTTPError)
     
     proxy = "1.2.3.4:8080"
     proxy_type = "http"
@@ -163,7 +357,7 @@ def test_check_proxy_http_error(mocker):
 
 # Test case for get_geo_data function
 def test_get_geo_data(mocker):
-    mocker.patch('requests.get', return_value=mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE))
+    mocker.patch('requests.Session.get', return_value=mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE))
     
     ip = "8.8.8.8"
     result = get_geo_data(ip)
@@ -173,15 +367,104 @@ def test_get_geo_data(mocker):
     assert result["as"] == "AS12345 Some ASN"
 
 def test_get_geo_data_failure(mocker):
-    mocker.patch('requests.get', side_effect=requests.exceptions.RequestException)
+    mocker.patch('requests.Session.get', side_effect=requests.exceptions.RequestException)
     
     ip = "invalid_ip"
     result = get_geo_data(ip)
     
     assert result == {}
 
+def test_get_geo_data_is_cached(mocker):
+    mock_get = mocker.patch('requests.Session.get', return_value=mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE))
+
+    assert get_geo_data("8.8.8.8")["country"] == "United States"
+    assert get_geo_data("8.8.8.8")["country"] == "United States"
+
+    assert mock_get.call_count == 1
+    assert geo_cache_stats()["hits"] == 1
+
+def test_get_geo_data_failure_is_negatively_cached(mocker):
+    mock_get = mocker.patch('requests.Session.get', side_effect=requests.exceptions.RequestException)
+
+    assert get_geo_data("8.8.8.8") == {}
+    assert get_geo_data("8.8.8.8") == {}
+
+    assert mock_get.call_count == 1
+
+def test_get_geo_data_rate_limited_is_not_cached(mocker):
+    mock_get = mocker.patch('requests.Session.get', return_value=mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE))
+    acquire = mocker.patch('proxy_checker.checker.acquire', return_value=False)
+
+    assert get_geo_data("8.8.8.8") == {}
+    mock_get.assert_not_called()
+
+    acquire.return_value = True
+    assert get_geo_data("8.8.8.8")["country"] == "United States"
+    acquire.assert_called_with('ip-api.com')
+
+def test_get_geo_data_batch_dedupes_and_uses_cache(mocker):
+    mocker.patch('requests.Session.get', return_value=mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE))
+    get_geo_data("8.8.8.8") # Cached from now on
+
+    mock_post = mocker.patch('requests.Session.post', return_value=mocker.Mock(
+        status_code=200, json=lambda: [{"country": "Germany", "isp": "ISP A", "as": "AS1"}, {}]))
+
+    result = get_geo_data_batch(["1.2.3.4", "8.8.8.8", "1.2.3.4", "5.6.7.8", "5.6.7.8"])
+
+    mock_post.assert_called_once()
+    assert mock_post.call_args.kwargs["json"] == ["1.2.3.4", "5.6.7.8"]
+    assert result == {
+        "1.2.3.4": {"country": "Germany", "isp": "ISP A", "as": "AS1"},
+        "8.8.8.8": MOCK_SUCCESS_GEO_RESPONSE,
+        "5.6.7.8": {},
+    }
+
+def test_get_geo_data_batch_splits_into_batches_of_100(mocker):
+    mock_post = mocker.patch('requests.Session.post', side_effect=lambda url, json, timeout: mocker.Mock(
+        status_code=200, json=lambda: [{"country": "X"}] * len(json)))
+
+    result = get_geo_data_batch([f"10.0.{i // 256}.{i % 256}" for i in range(250)])
+
+    assert mock_post.call_count == 3
+    assert len(result) == 250
+
+def test_get_geo_data_batch_skips_lookups_past_the_deadline(mocker):
+    mock_post = mocker.patch('requests.Session.post')
+    deadline = Deadline(1)
+    time.sleep(0.01)
+
+    result = get_geo_data_batch(["1.2.3.4", "5.6.7.8"], deadline)
+
+    mock_post.assert_not_called()
+    assert result == {"1.2.3.4": {}, "5.6.7.8": {}}
+    assert geo_cache_stats()["size"] == 0 # Nothing cached for the skipped IPs
+
+def test_fill_geo_data(mocker):
+    mock_batch = mocker.patch('proxy_checker.checker.get_geo_data_batch', return_value={
+        "1.2.3.4": {"country": "Germany", "isp": "ISP A", "as": "AS1"}
+    })
+    basic = {"status": "alive", "country": None}
+    pro = {"status": "alive", "country": None, "isp": None, "asn": None}
+    dead = {"status": "dead", "error": "Timeout: "}
+
+    fill_geo_data([("1.2.3.4:8080", basic), ("1.2.3.4:3128", pro), ("5.6.7.8:80", dead)])
+
+    assert list(mock_batch.call_args.args[0]) == ["1.2.3.4", "1.2.3.4"]
+    assert basic == {"status": "alive", "country": "Germany"}
+    assert pro == {"status": "alive", "country": "Germany", "isp": "ISP A", "asn": "AS1"}
+    assert dead == {"status": "dead", "error": "Timeout: "}
+
+def test_check_proxy_without_geo_lookup(mocker):
+    mock_get = mocker.patch('requests.Session.get', return_value=mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE))
+
+    result = check_proxy("1.2.3.4:8080", "http", user_plan="PRO", geo_lookup=False)
+
+    assert mock_get.call_count == 1
+    assert result["country"] is None
+    assert result["isp"] is None
+
 def test_check_proxy_anonymous_true(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.get', side_effect=[
         mocker.Mock(status_code=200, json=lambda: {"origin": "5.6.7.8"}), # Different IP
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
     ])
@@ -193,7 +476,7 @@ def test_check_proxy_anonymous_true(mocker):
     assert result["anonymous"] == True
 
 def test_check_proxy_anonymous_false(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.get', side_effect=[
         mocker.Mock(status_code=200, json=lambda: {"origin": "1.2.3.4"}), # Same IP
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
     ])
@@ -205,7 +488,7 @@ def test_check_proxy_anonymous_false(mocker):
     assert result["anonymous"] == False
 
 def test_check_proxy_type_https(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.get', side_effect=[
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
     ])
@@ -217,7 +500,7 @@ def test_check_proxy_type_https(mocker):
     assert result["proxy_type"] == "HTTPS"
 
 def test_check_proxy_with_authentication(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.get', side_effect=[
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
     ])
@@ -233,7 +516,7 @@ def test_check_proxy_with_authentication(mocker):
     assert result["proxy_type"] == "HTTP"
 
 def test_check_proxy_with_custom_target_url(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.get', side_effect=[
         mocker.Mock(status_code=200, json=lambda: {"origin": "1.1.1.1"}),
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
     ])
@@ -248,7 +531,7 @@ def test_check_proxy_with_custom_target_url(mocker):
     assert result["proxy_type"] == "HTTP"
 
 def test_check_proxy_socks5(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.get', side_effect=[
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
     ])
@@ -260,7 +543,7 @@ def test_check_proxy_socks5(mocker):
     assert result["proxy_type"] == "SOCKS5"
 
 def test_check_proxy_socks4(mocker):
-    mocker.patch('requests.get', side_effect=[
+    mocker.patch('requests.Session.get', side_effect=[
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
         mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE)
     ])
@@ -272,31 +555,118 @@ def test_check_proxy_socks4(mocker):
     assert result["proxy_type"] == "SOCKS4"
 
 def test_dns_leak_test_no_leak(mocker):
-    mocker.patch('requests.get', return_value=mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}))
+    mocker.patch('requests.Session.get', return_value=mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}))
     proxies = {"http": "http://1.2.3.4:8080"}
     assert dns_leak_test(proxies) == False
 
 def test_dns_leak_test_leak(mocker):
-    mocker.patch('requests.get', return_value=mocker.Mock(status_code=200, json=lambda: {"ip": "5.6.7.8"}))
+    mocker.patch('requests.Session.get', return_value=mocker.Mock(status_code=200, json=lambda: {"ip": "5.6.7.8"}))
     proxies = {"http": "http://1.2.3.4:8080"}
     assert dns_leak_test(proxies) == True
 
 def test_dns_leak_test_failure(mocker):
-    mocker.patch('requests.get', side_effect=requests.exceptions.RequestException)
+    mocker.patch('requests.Session.get', side_effect=requests.exceptions.RequestException)
     proxies = {"http": "http://1.2.3.4:8080"}
     assert dns_leak_test(proxies) == True
 
+def test_dns_leak_test_rate_limited(mocker):
+    mock_get = mocker.patch('requests.Session.get')
+    mocker.patch('proxy_checker.checker.acquire', return_value=False)
+
+    assert dns_leak_test({"http": "http://1.2.3.4:8080"}) is None
+    mock_get.assert_not_called()
+
 def test_ssl_verification_success(mocker):
-    mocker.patch('requests.get', return_value=mocker.Mock(status_code=200))
+    mocker.patch('requests.Session.get', return_value=mocker.Mock(status_code=200))
     proxy_url = "https://1.2.3.4:8080"
     assert ssl_verification(proxy_url) == True
 
 def test_ssl_verification_failure(mocker):
-    mocker.patch('requests.get', side_effect=requests.exceptions.SSLError)
+    mocker.patch('requests.Session.get', side_effect=requests.exceptions.SSLError)
     proxy_url = "https://1.2.3.4:8080"
     assert ssl_verification(proxy_url) == False
 
 def test_ssl_verification_request_exception(mocker):
-    mocker.patch('requests.get', side_effect=requests.exceptions.RequestException)
+    mocker.patch('requests.Session.get', side_effect=requests.exceptions.RequestException)
     proxy_url = "https://1.2.3.4:8080"
-    assert ssl_verification(proxy_url) == False
\ No newline at end of file
+    assert ssl_verification(proxy_url) == False
+def test_check_proxy_runs_only_selected_checks(mocker):
+    route_requests(mocker, {
+        "http://httpbin.org": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        "https://www.google.com": mocker.Mock(status_code=200)
+    })
+    mock_reputation = mocker.patch('proxy_checker.checker.get_reputation_data')
+
+    # Reputation is outside the ULTRA plan, so only the SSL probe runs
+    result = check_proxy("1.2.3.4:8080", "http", user_plan="ULTRA", checks=("ssl", "reputation"))
+
+    assert result["ssl_verified"] == True
+    for field in ("country", "isp", "asn", "dns_leak_detected", "reputation_score"):
+        assert field not in result
+    assert set(result["stage_latency_ms"]) == {"probe", "ssl"}
+    mock_reputation.assert_not_called()
+
+def test_check_proxy_with_no_checks_only_probes(mocker):
+    mock_get = route_requests(mocker, {
+        "http://httpbin.org": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE)
+    })
+
+    result = check_proxy("1.2.3.4:8080", "http", user_plan="ENTERPRISE", checks=())
+
+    assert result["status"] == "alive"
+    assert result["anonymous"] == True
+    assert mock_get.call_count == 1
+    assert "country" not in result
+
+def test_check_proxy_deadline_marks_unfinished_stages_unknown(mocker):
+    release = threading.Event()
+
+    def slow_reputation(ip):
+        release.wait(5)
+        return {"reputation_score": 85}
+
+    route_requests(mocker, {
+        "http://httpbin.org": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_IP_RESPONSE),
+        "http://ip-api.com": mocker.Mock(status_code=200, json=lambda: MOCK_SUCCESS_GEO_RESPONSE),
+        "https://ipleak.net": mocker.Mock(status_code=200, json=lambda: {"ip": "1.2.3.4"}),
+        "https://www.google.com": mocker.Mock(status_code=200)
+    })
+    mocker.patch('proxy_checker.checker.get_reputation_data', side_effect=slow_reputation)
+
+    start = time.monotonic()
+    result = check_proxy("1.2.3.4:8080", "http", user_plan="ENTERPRISE", deadline_ms=300)
+    elapsed = time.monotonic() - start
+    release.set()
+
+    assert elapsed < 1
+    assert result["status"] == "alive"
+    assert result["country"] == "United States"
+    assert result["ssl_verified"] == True
+    assert (result["reputation_score"], result["blacklisted"], result["threat_type"]) == ("unknown",) * 3
+    assert result["stage_latency_ms"]["reputation"] is None
+
+def test_check_proxy_deadline_caps_the_main_probe(mocker):
+    def slow_target(*args, **kwargs):
+        time.sleep(0.2)
+        raise requests.exceptions.ReadTimeout("read timed out")
+
+    mock_get = mocker.patch('requests.Session.get', side_effect=slow_target)
+
+    result = check_proxy("1.2.3.4:8080", "http", deadline_ms=150)
+
+    # Timeouts are cut to the time left, and running out of it isn't a verdict on the proxy
+    connect_timeout, read_timeout = mock_get.call_args.kwargs["timeout"]
+    assert connect_timeout <= 0.15 and read_timeout <= 0.15
+    assert result == {"status": "timed_out", "error": "Check did not finish within its 150ms deadline."}
+
+def test_check_proxy_deadline_caps_type_detection():
+    # A proxy that accepts connections and never answers
+    with socket.socket() as blackhole:
+        blackhole.bind(("127.0.0.1", 0))
+        blackhole.listen(8)
+        start = time.monotonic()
+        result = check_proxy(f"127.0.0.1:{blackhole.getsockname()[1]}", "auto", user_plan="PRO", deadline_ms=500)
+        elapsed = time.monotonic() - start
+
+    assert elapsed <= 0.7
+    assert result == {"status": "timed_out", "error": "Check did not finish within its 500ms deadline."}
@@ -0,0 +1,49 @@
+import gzip
+
+from proxy_checker.export import EXPORT_COLUMNS, batched, csv_lines, export_stream, iter_results
+from proxy_checker.job_store import SQLiteJobStore
+
+def test_iter_results_reads_one_page_at_a_time(mocker):
+    store = SQLiteJobStore()
+    store.create("job", 25)
+    store.put_results("job", 0, [{"status": "dead"}] * 25)
+    spy = mocker.spy(store, "results")
+
+    rows = list(iter_results(store, "job", page_size=10))
+
+    assert [index for index, _ in rows] == list(range(25))
+    assert [call.args[1:3] for call in spy.call_args_list] == [(0, 10), (10, 10), (20, 10)]
+
+def test_iter_results_is_lazy(mocker):
+    store = SQLiteJobStore()
+    store.create("job", 100)
+    store.put_results("job", 0, [{"status": "dead"}] * 100)
+    spy = mocker.spy(store, "results")
+
+    rows = iter_results(store, "job", page_size=10)
+    next(rows)
+
+    assert spy.call_count == 1
+
+def test_csv_lines_use_fixed_columns():
+    lines = list(csv_lines([(0, {"status": "alive", "latency_breakdown_ms": {"ttfb": 12}, "extra": "ignored"})]))
+
+    assert lines[0] == ",".join(EXPORT_COLUMNS) + "\r\n"
+    row = lines[1].rstrip("\r\n").split(",")
+    assert row[EXPORT_COLUMNS.index("status")] == "alive"
+    assert row[EXPORT_COLUMNS.index("latency_breakdown_ms.ttfb")] == "12"
+    assert "ignored" not in lines[1]
+
+def test_batched():
+    assert list(batched(["a", "b", "c"], size=2)) == ["ab", "c"]
+
+def test_export_stream_gzip_round_trip():
+    store = SQLiteJobStore()
+    store.create("job", 3)
+    store.put_results("job", 0, [{"status": "alive"}, {"status": "dead"}, {"error": "bad entry"}])
+
+    plain = "".join(export_stream(store, "job", "ndjson"))
+    compressed = b"".join(export_stream(store, "job", "ndjson", compress=True))
+
+    assert gzip.decompress(compressed).decode() == plain
+    assert len(plain.splitlines()) == 3
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from proxy_checker import async_checker, checker
+from proxy_checker.geo_db import GeoDatabase, build, main
+
+CSV_ROWS = """start_ip,end_ip,country,isp,asn
+1.0.0.0,1.0.0.255,Australia,Cloudflare,AS13335 Cloudflare
+8.8.8.0,8.8.8.255,United States,Google LLC,AS15169 Google LLC
+16843008,16843263,China,Some ISP,
+"""
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "ranges.csv"
+    path.write_text(CSV_ROWS)
+    return str(path)
+
+def test_lookup_from_csv(csv_path):
+    db = GeoDatabase.open(csv_path)
+
+    assert len(db) == 3
+    assert db.lookup("8.8.8.8") == {"country": "United States", "isp": "Google LLC", "as": "AS15169 Google LLC"}
+    assert db.lookup("1.0.0.0") == {"country": "Australia", "isp": "Cloudflare", "as": "AS13335 Cloudflare"}
+    assert db.lookup("1.1.1.255") == {"country": "China", "isp": "Some ISP", "as": None}
+
+def test_lookup_miss(csv_path):
+    db = GeoDatabase.open(csv_path)
+
+    assert db.lookup("0.255.255.255") == {}
+    assert db.lookup("8.8.9.0") == {}
+    assert db.lookup("255.255.255.255") == {}
+    assert db.lookup("2001:db8::1") == {}
+    assert db.lookup("not-an-ip") == {}
+
+def test_build_and_open_binary(csv_path, tmp_path):
+    output = str(tmp_path / "geo.bin")
+    assert build(csv_path, output) == 3
+
+    db = GeoDatabase.open(output)
+    assert db.lookup("8.8.4.4") == {}
+    assert db.lookup("8.8.8.200")["isp"] == "Google LLC"
+    db.close()
+
+def test_cli_build(csv_path, tmp_path, capsys):
+    output = str(tmp_path / "geo.bin")
+    main(["build", csv_path, output])
+
+    assert "Wrote 3 ranges" in capsys.readouterr().out
+    assert GeoDatabase.open(output).lookup("1.0.0.1")["country"] == "Australia"
+
+def test_overlapping_ranges_rejected(tmp_path):
+    path = tmp_path / "ranges.csv"
+    path.write_text("1.0.0.0,1.0.0.255,A,,\n1.0.0.128,1.0.1.0,B,,\n")
+
+    with pytest.raises(ValueError):
+        GeoDatabase.open(str(path))
+
+def test_get_geo_data_uses_local_database(csv_path, mocker):
+    mocker.patch('proxy_checker.checker.GEO_DB_PATH', csv_path)
+    mocker.patch('proxy_checker.checker._geo_db', None)
+    mock_get = mocker.patch('requests.Session.get')
+
+    assert checker.get_geo_data("8.8.8.8")["country"] == "United States"
+    mock_get.assert_not_called()
+
+def test_get_geo_data_async_uses_local_database(csv_path, mocker):
+    mocker.patch('proxy_checker.checker.GEO_DB_PATH', csv_path)
+    mocker.patch('proxy_checker.checker._geo_db', None)
+    mock_fetch = mocker.patch('proxy_checker.async_checker.fetch')
+
+    assert asyncio.run(async_checker.get_geo_data_async("8.8.8.8"))["country"] == "United States"
+    mock_fetch.assert_not_called()
@@ -0,0 +1,44 @@
+import gzip
+import io
+
+import pytest
+from proxy_checker.ingest import MAX_LINE_BYTES, iter_entries
+
+def test_ndjson_lines():
+    body = io.BytesIO(b'{"proxy": "1.2.3.4:8080", "type": "socks5"}\n\n{"proxy": "5.6.7.8:3128"}\n')
+
+    assert list(iter_entries(body, "ndjson", "http")) == [{"proxy": "1.2.3.4:8080", "type": "socks5"},
+                                                          {"proxy": "5.6.7.8:3128", "type": "http"}]
+
+def test_text_lines():
+    body = io.BytesIO(b"# exported list\n1.2.3.4:8080\r\nSOCKS5://5.6.7.8:1080\n\n9.9.9.9:80")
+
+    assert list(iter_entries(body, "text", "http")) == [{"proxy": "1.2.3.4:8080", "type": "http"},
+                                                        {"proxy": "5.6.7.8:1080", "type": "socks5"},
+                                                        {"proxy": "9.9.9.9:80", "type": "http"}]
+
+def test_gzip_body():
+    body = io.BytesIO(gzip.compress(b"".join(f"10.0.{i // 256}.{i % 256}:80\n".encode() for i in range(5000))))
+
+    entries = list(iter_entries(body, "text", "http", compressed=True))
+
+    assert len(entries) == 5000
+    assert entries[-1] == {"proxy": "10.0.19.135:80", "type": "http"}
+
+def test_entries_are_read_lazily():
+    body = io.BytesIO(b'{"proxy": "1.2.3.4:8080"}\nnot json\n')
+    entries = iter_entries(body, "ndjson", "http")
+
+    assert next(entries) == {"proxy": "1.2.3.4:8080", "type": "http"}
+    with pytest.raises(ValueError, match="Line 2 is not valid JSON."):
+        next(entries)
+
+@pytest.mark.parametrize("body, compressed, error", [
+    (b'["1.2.3.4:8080"]\n', False, "Line 1 must be a JSON object."),
+    (b"x" * (MAX_LINE_BYTES + 10), False, f"Line 1 is longer than {MAX_LINE_BYTES} bytes."),
+    (b"1.2.3.4:8080\n", True, "Request body is not valid gzip data"),
+    (b"1.1.1.1:80\n2.2.2.2:80\n3.3.3.3:80\n", False, "Maximum 2 proxies allowed per asynchronous request."),
+])
+def test_invalid_input(body, compressed, error):
+    with pytest.raises(ValueError, match=error.replace(".", r"\.")):
+        list(iter_entries(io.BytesIO(body), "ndjson" if body.startswith(b"[") else "text", "http", compressed, limit=2))
@@ -0,0 +1,223 @@
+import pytest
+from proxy_checker.job_store import RedisJobStore, SQLiteJobStore, open_job_store, result_status
+
+class FakeRedis:
+    """
+    The subset of redis-py the job store uses, with bytes replies like the real client.
+    """
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        fields = self.data.setdefault(key, {})
+        for name, item in (mapping or {field: value}).items():
+            fields[str(name).encode()] = str(item).encode()
+
+    def hincrby(self, key, field, amount):
+        fields = self.data.setdefault(key, {})
+        fields[field.encode()] = str(int(fields.get(field.encode(), b"0")) + amount).encode()
+        return int(fields[field.encode()])
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hmget(self, key, fields):
+        return [self.data.get(key, {}).get(str(field).encode()) for field in fields]
+
+    def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(member.encode() for member in members)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def hlen(self, key):
+        return len(self.data.get(key, {}))
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update({str(member).encode(): score for member, score in mapping.items()})
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.data.get(key, {}).pop(str(member).encode(), None)
+
+    def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def zrange(self, key, start, end):
+        members = sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+        return [member for member, _ in members[start:None if end == -1 else end + 1]]
+
+    def zunionstore(self, dest, keys):
+        self.data[dest] = {}
+        for key in keys:
+            self.data[dest].update(self.data.get(key, {}))
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store(request):
+    return SQLiteJobStore() if request.param == "sqlite" else RedisJobStore(FakeRedis())
+
+def test_unknown_job(store):
+    assert store.get("missing") is None
+    assert store.results("missing") == (0, [])
+
+def test_job_lifecycle(store):
+    store.create("job", 4)
+    assert store.get("job")["status"] == "pending"
+
+    store.put_results("job", 2, [{"status": "alive"}, {"status": "dead"}])
+    job = store.get("job")
+    assert (job["status"], job["done"], job["alive"], job["dead"], job["total"]) == ("progress", 2, 1, 1, 4)
+
+    store.put_results("job", 0, [{"error": "bad entry"}, {"status": "alive"}])
+    store.finish("job")
+    job = store.get("job")
+    assert (job["status"], job["done"], job["alive"], job["dead"]) == ("completed", 4, 2, 2)
+    assert store.results("job") == (4, [(0, {"error_code": "invalid_input", "error": "bad entry"}),
+                                        (1, {"status": "alive"}), (2, {"status": "alive"}), (3, {"status": "dead"})])
+
+def test_rewriting_an_index_replaces_it(store):
+    store.create("job", 1)
+    store.put_results("job", 0, [{"status": "alive", "country": None}])
+    store.put_results("job", 0, [{"status": "alive", "country": "DE"}])
+
+    assert store.get("job")["done"] == 1
+    assert store.results("job") == (1, [(0, {"status": "alive", "country": "DE"})])
+
+def test_rewriting_an_index_with_another_status_moves_it(store):
+    store.create("job", 1)
+    store.put_results("job", 0, [{"status": "dead"}])
+    store.put_results("job", 0, [{"status": "alive"}])
+
+    job = store.get("job")
+    assert (job["done"], job["alive"], job["dead"]) == (1, 1, 0)
+    assert store.results("job", statuses=["dead"]) == (0, [])
+    assert store.results("job", statuses=["alive"]) == (1, [(0, {"status": "alive"})])
+
+def test_paging_and_status_filters(store):
+    store.create("job", 10)
+    store.put_results("job", 0, [{"status": "alive" if i % 2 else "dead", "i": i} for i in range(10)])
+
+    matching, page = store.results("job", offset=3, limit=4)
+    assert matching == 10
+    assert [index for index, _ in page] == [3, 4, 5, 6]
+
+    matching, page = store.results("job", offset=1, limit=2, statuses=["alive"])
+    assert matching == 5
+    assert [index for index, _ in page] == [3, 5]
+
+    matching, page = store.results("job", statuses=["alive", "dead"], limit=3)
+    assert matching == 10
+    assert [index for index, _ in page] == [0, 1, 2]
+
+    assert store.results("job", limit=0) == (10, [])
+
+def test_failed_job(store):
+    store.create("job", 3)
+    store.finish("job", error="RuntimeError: worker lost")
+
+    job = store.get("job")
+    assert (job["status"], job["error"]) == ("failed", "RuntimeError: worker lost")
+
+def test_late_results_keep_a_finished_job_status(store):
+    store.create("failed-job", 3)
+    store.finish("failed-job", error="ValueError: bad line")
+    store.put_results("failed-job", 0, [{"status": "alive"}])
+    store.create("done-job", 1)
+    store.put_results("done-job", 0, [{"status": "alive"}])
+    store.finish("done-job")
+    store.put_results("done-job", 0, [{"status": "alive"}])  # A redelivered chunk
+
+    assert store.get("failed-job")["status"] == "failed"
+    assert store.get("done-job")["status"] == "completed"
+
+def test_results_are_stored_compactly():
+    client = FakeRedis()
+    store = RedisJobStore(client)
+    store.create("job", 1)
+    error = ("ConnectionError: HTTPConnectionPool(host='1.2.3.4', port=8080): Max retries exceeded with url: "
+             "http://httpbin.org/ip (Caused by ProxyError('Unable to connect to proxy', NewConnectionError("
+             "'<urllib3.connection.HTTPConnection object at 0x7f>: Failed to establish a new connection: "
+             "[Errno 111] Connection refused'))) (Note: SOCKS proxies require PySocks library)")
+    store.put_results("job", 0, [{"status": "dead", "error": error}])
+
+    stored = client.data["proxy_checker:job:job:results"][b"0"]
+    assert len(stored) < 50
+    assert store.results("job") == (1, [(0, {"status": "dead", "error_code": "connection_refused",
+                                             "error": "ConnectionError: Connection refused"})])
+
+def test_tenant_backlog(store):
+    assert store.adjust_backlog("tenant-a", 3) == 3
+    assert store.adjust_backlog("tenant-b", 1) == 1
+    assert store.adjust_backlog("tenant-a", -1) == 2
+    assert store.adjust_backlog("tenant-b", -5) == 0
+    assert store.adjust_backlog("tenant-b", 1) == 1
+
+def test_pending_chunks_of_a_streamed_job(store):
+    store.create("job", 0)
+    assert store.add_pending("job", 1) == 1
+    assert store.add_pending("job", 2, entries=75) == 3
+    assert store.release_pending("job") == 2
+    assert store.release_pending("job") == 1
+    assert store.release_pending("job") == 0
+    assert store.get("job")["total"] == 75
+
+def test_batch_buffer_is_shared_by_chunks(store):
+    store.create("job", 4)
+    assert store.add_batch("job", [(2, {"status": "alive"})])[0] == 1
+    pending, since_last = store.add_batch("job", [(0, {"status": "dead", "error": "Timeout: read timed out"})])
+
+    assert pending == 2
+    assert 0 <= since_last < 5
+    assert store.take_batch("job") == [(0, {"status": "dead", "error_code": "timeout", "error": "Timeout: read timed out"}),
+                                       (2, {"status": "alive"})]
+    assert store.take_batch("job") == []
+    assert store.add_batch("job", [])[0] == 0
+
+def test_webhook_stats(store):
+    store.count_webhooks("attempts")
+    store.count_webhooks("attempts")
+    store.count_webhooks("bytes_sent", 512)
+
+    assert store.webhook_stats() == {"attempts": 2, "bytes_sent": 512}
+
+def test_redis_keys_expire():
+    client = FakeRedis()
+    store = RedisJobStore(client, ttl=60)
+    store.create("job", 1)
+    store.put_results("job", 0, [{"status": "alive"}])
+
+    assert set(client.ttls) == set(client.data)
+    assert set(client.ttls.values()) == {60}
+
+def test_sqlite_file_store_is_shared_between_instances(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    SQLiteJobStore(str(path)).create("job", 2)
+    reader = open_job_store(f"sqlite:///{path}")
+
+    assert isinstance(reader, SQLiteJobStore)
+    assert reader.get("job")["total"] == 2
+
+def test_result_status():
+    assert result_status({"status": "timed_out"}) == "timed_out"
+    assert result_status({"error": "Missing 'proxy' or 'type' in one of the proxy objects."}) == "error"
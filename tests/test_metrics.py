@@ -0,0 +1,123 @@
+import asyncio
+import pytest
+from prometheus_client import REGISTRY
+from proxy_checker.cache import TTLCache
+from proxy_checker.checker import fill_geo_data
+from proxy_checker.metrics import (CHECKS_IN_FLIGHT, QueueDepthCollector, instrument_check, instrument_check_async,
+                                   observe_check)
+from proxy_checker.rate_limit import RateLimiter
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def samples(collector):
+    return {(s.name, tuple(sorted(s.labels.items()))): s.value for family in collector.collect() for s in family.samples}
+
+def test_observe_check_records_stages_and_outcome():
+    before_checks = sample('proxy_checker_checks_total', status="dead", error_code="timeout")
+    before_probe = sample('proxy_checker_stage_seconds_count', stage="probe")
+    before_preprobe = sample('proxy_checker_stage_seconds_sum', stage="preprobe")
+
+    observe_check({"status": "dead", "error": "Timeout: read timed out", "dead_reason": "timeout",
+                   "latency_breakdown_ms": {"connect": 20, "handshake": 30, "tls": None},
+                   "stage_latency_ms": {"probe": 1500, "geo": None}})
+
+    assert sample('proxy_checker_checks_total', status="dead", error_code="timeout") == before_checks + 1
+    assert sample('proxy_checker_stage_seconds_count', stage="probe") == before_probe + 1
+    assert sample('proxy_checker_stage_seconds_sum', stage="preprobe") == pytest.approx(before_preprobe + 0.05)
+
+def test_fill_geo_data_records_one_geo_stage_per_batch(mocker):
+    mocker.patch('proxy_checker.checker.get_geo_data_batch', return_value={"1.2.3.4": {"country": "Germany"}})
+    before = sample('proxy_checker_stage_seconds_count', stage="geo")
+
+    fill_geo_data([("1.2.3.4:8080", {"status": "alive", "country": None}),
+                   ("1.2.3.4:3128", {"status": "alive", "country": None})])
+
+    assert sample('proxy_checker_stage_seconds_count', stage="geo") == before + 1
+
+def test_observe_check_counts_alive_checks_without_error_code():
+    before = sample('proxy_checker_checks_total', status="alive", error_code="none")
+
+    observe_check({"status": "alive", "error": None})
+
+    assert sample('proxy_checker_checks_total', status="alive", error_code="none") == before + 1
+
+def test_instrument_check_tracks_checks_in_flight():
+    in_flight = []
+
+    @instrument_check
+    def check(proxy):
+        in_flight.append(CHECKS_IN_FLIGHT._value.get())
+        return {"status": "alive", "error": None}
+
+    assert check("1.1.1.1:80") == {"status": "alive", "error": None}
+    assert in_flight == [1]
+    assert CHECKS_IN_FLIGHT._value.get() == 0
+
+def test_instrument_check_times_dead_checks():
+    before = sample('proxy_checker_check_seconds_count', status="dead")
+
+    @instrument_check
+    def check(proxy):
+        return {"status": "dead", "error": "Timeout: TCP connect to proxy timed out after 3s",
+                "dead_reason": "connect_timeout"}
+
+    check("10.255.255.1:8080")
+
+    assert sample('proxy_checker_check_seconds_count', status="dead") == before + 1
+
+def test_instrument_check_async_tracks_checks_in_flight():
+    in_flight = []
+
+    @instrument_check_async
+    async def check(proxy):
+        in_flight.append(CHECKS_IN_FLIGHT._value.get())
+        return {"status": "dead", "error": "ProxyError: refused"}
+
+    assert asyncio.run(check("1.1.1.1:80"))["status"] == "dead"
+    assert in_flight == [1]
+    assert CHECKS_IN_FLIGHT._value.get() == 0
+
+def test_named_caches_count_their_events():
+    cache = TTLCache(10, name="test")
+    before_hits = sample('proxy_checker_cache_hits_total', cache="test")
+    before_misses = sample('proxy_checker_cache_misses_total', cache="test")
+
+    cache.get("a")
+    cache.set("a", 1, 60)
+    cache.get("a")
+    cache.get("a")
+
+    assert sample('proxy_checker_cache_hits_total', cache="test") == before_hits + 2
+    assert sample('proxy_checker_cache_misses_total', cache="test") == before_misses + 1
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (2, 1)
+
+def test_rate_limiter_counts_wait_seconds():
+    clock = [0.0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    limiter = RateLimiter({"metrics.example": (1, 1)}, clock=lambda: clock[0], sleep=sleep)
+    before_waited = sample('proxy_checker_rate_limit_waited_total', key="metrics.example")
+    before_seconds = sample('proxy_checker_rate_limit_wait_seconds_total', key="metrics.example")
+
+    assert limiter.acquire("metrics.example") and limiter.acquire("metrics.example")
+
+    assert sample('proxy_checker_rate_limit_waited_total', key="metrics.example") == before_waited + 1
+    assert sample('proxy_checker_rate_limit_wait_seconds_total', key="metrics.example") == \
+        pytest.approx(before_seconds + 1)
+
+def test_queue_depth_collector_reports_depths():
+    collector = QueueDepthCollector(lambda: {"checks": 7, "webhooks": 0})
+
+    values = samples(collector)
+
+    assert values[('proxy_checker_queue_depth', (('queue', 'checks'),))] == 7
+    assert values[('proxy_checker_queue_depth', (('queue', 'webhooks'),))] == 0
+
+def test_queue_depth_collector_survives_broker_errors():
+    def unreachable():
+        raise ConnectionError("broker down")
+
+    assert samples(QueueDepthCollector(unreachable)) == {}
@@ -0,0 +1,264 @@
+import socket
+import ssl
+import threading
+import time
+
+import pytest
+from proxy_checker.probe import detect_proxy_type, preprobe
+
+def _serve_once(reply: bytes = None, read: int = 0):
+    """
+    Accepts one connection on a local port, optionally reads `read` bytes and
+    sends `reply`, then holds the connection open until the test ends.
+    """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    done = threading.Event()
+
+    def run():
+        conn, _ = server.accept()
+        if read:
+            conn.recv(read)
+        if reply is not None:
+            conn.sendall(reply)
+        done.wait(5)
+        conn.close()
+        server.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return f"127.0.0.1:{server.getsockname()[1]}", done
+
+@pytest.fixture
+def serve():
+    events = []
+
+    def start(reply=None, read=0):
+        address, done = _serve_once(reply, read)
+        events.append(done)
+        return address
+
+    yield start
+    for done in events:
+        done.set()
+
+def _serve_protocol(speaks: str):
+    """
+    Fake proxy that accepts any number of connections and answers the
+    first bytes of each the way a `speaks` proxy would: SOCKS servers close
+    straight away on other versions, and an HTTP proxy waits for a whole
+    request line, then answers with a 400 page unless it is a CONNECT.
+    Returns (address, connection counter, stop).
+    """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    server.settimeout(0.1)
+    connections = []
+    stop = threading.Event()
+
+    def handle(conn):
+        with conn:
+            data = conn.recv(1024)
+            if speaks == 'http':
+                while data and b"\r\n" not in data:
+                    data += conn.recv(1024)
+                status = "200 Connection established" if data.startswith(b"CONNECT") else "400 Bad Request"
+                conn.sendall(f"HTTP/1.1 {status}\r\n\r\n".encode())
+            elif speaks == 'socks5' and data[:1] == b"\x05":
+                conn.sendall(b"\x05\x00")
+            elif speaks == 'socks4' and data[:1] == b"\x04":
+                conn.sendall(b"\x00\x5a\x00\x00\x00\x00\x00\x00")
+            else:
+                return
+            stop.wait(0.2)
+
+    def run():
+        while not stop.is_set():
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            connections.append(conn)
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+        server.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return f"127.0.0.1:{server.getsockname()[1]}", connections, stop
+
+@pytest.fixture
+def fake_proxy():
+    stops = []
+
+    def start(speaks):
+        address, connections, stop = _serve_protocol(speaks)
+        stops.append(stop)
+        return address, connections
+
+    yield start
+    for stop in stops:
+        stop.set()
+
+def _closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+def test_preprobe_socks5_alive(serve):
+    proxy = serve(reply=b"\x05\x00", read=3)
+    result = preprobe(proxy, "socks5", "httpbin.org", 80)
+
+    assert result["alive"] == True
+    assert isinstance(result["connect_ms"], int)
+    assert isinstance(result["handshake_ms"], int)
+
+def test_preprobe_http_alive_even_if_connect_refused_by_policy(serve):
+    proxy = serve(reply=b"HTTP/1.1 403 Forbidden\r\n\r\n", read=1024)
+    assert preprobe(proxy, "http", "httpbin.org", 80)["alive"] == True
+
+def test_preprobe_socks4_rejected(serve):
+    proxy = serve(reply=b"\x00\x5b\x00\x00\x00\x00\x00\x00", read=1024)
+    result = preprobe(proxy, "socks4", "httpbin.org", 80)
+
+    assert result["alive"] == False
+    assert result["reason"] == "handshake_failed"
+    assert result["error"] == "ProxyError: SOCKS4 connect failed: request rejected or failed"
+
+def test_preprobe_wrong_protocol(serve):
+    proxy = serve(reply=b"HTTP/1.1 400 Bad Request\r\n\r\n", read=3)
+    result = preprobe(proxy, "socks5", "httpbin.org", 80)
+
+    assert result["alive"] == False
+    assert result["reason"] == "handshake_failed"
+    assert "Not a SOCKS5 server" in result["error"]
+
+def test_preprobe_socks5_auth_required(serve):
+    proxy = serve(reply=b"\x05\xff", read=3)
+    result = preprobe(proxy, "socks5", "httpbin.org", 80)
+
+    assert result["alive"] == False
+    assert result["reason"] == "auth_required"
+    assert result["proxy_type"] == "socks5"
+
+def test_detect_socks5_auth_required(serve):
+    proxy = serve(reply=b"\x05\xff", read=3)
+    result = detect_proxy_type(proxy, "httpbin.org", 80, candidates=("socks5", "socks4"))
+
+    assert result["alive"] == False
+    assert result["reason"] == "auth_required"
+    assert result["proxy_type"] == "socks5"
+    assert result["error"] == "ProxyError: SOCKS5 server accepted none of the offered auth methods"
+
+def test_preprobe_handshake_timeout(serve):
+    proxy = serve()
+    result = preprobe(proxy, "socks5", "httpbin.org", 80, connect_timeout=0.2)
+
+    assert result["alive"] == False
+    assert result["reason"] == "handshake_timeout"
+    assert result["error"].startswith("Timeout:")
+
+def test_preprobe_connection_refused():
+    result = preprobe(_closed_port(), "http", "httpbin.org", 80)
+
+    assert result["alive"] == False
+    assert result["reason"] == "connection_refused"
+
+def test_preprobe_connect_timeout(mocker):
+    mocker.patch('socket.create_connection', side_effect=socket.timeout)
+    result = preprobe("10.255.255.1:8080", "http", "httpbin.org", 80, connect_timeout=1.5)
+
+    assert result == {"alive": False, "reason": "connect_timeout",
+                      "error": "Timeout: TCP connect to proxy timed out after 1.5s"}
+
+@pytest.mark.parametrize("proxy", ["127.0.0.1", "localhost:notaport"])
+def test_preprobe_invalid_address(proxy):
+    for result in (preprobe(proxy, "http", "httpbin.org", 80), detect_proxy_type(proxy, "httpbin.org", 80)):
+        assert result["alive"] == False
+        assert result["reason"] == "invalid_address"
+        assert result["error"] == f"ProxyError: Invalid proxy address '{proxy}', expected host:port"
+
+@pytest.mark.parametrize("speaks, connections", [("http", 1), ("socks5", 2), ("socks4", 3)])
+def test_detect_proxy_type(fake_proxy, speaks, connections):
+    proxy, accepted = fake_proxy(speaks)
+    result = detect_proxy_type(proxy, "httpbin.org", 80, connect_timeout=1)
+
+    assert result["alive"] == True
+    assert result["proxy_type"] == speaks
+    assert isinstance(result["handshake_ms"], int)
+    assert len(accepted) == connections
+
+def test_detect_line_buffered_http_proxy_without_waiting(fake_proxy):
+    proxy, _ = fake_proxy("http")
+    start = time.monotonic()
+    result = detect_proxy_type(proxy, "httpbin.org", 80, connect_timeout=3)
+
+    assert result["proxy_type"] == "http"
+    assert time.monotonic() - start < 1
+
+def test_detect_proxy_type_only_tries_candidates(fake_proxy):
+    proxy, _ = fake_proxy("socks5")
+    result = detect_proxy_type(proxy, "httpbin.org", 80, connect_timeout=0.5, candidates=("http",))
+
+    assert result["alive"] == False
+    assert result["reason"] == "detection_failed"
+    assert result["error"].startswith("ProxyError: Could not detect the proxy protocol (HTTP:")
+
+def test_detect_proxy_type_http_from_candidates_only(fake_proxy):
+    proxy, accepted = fake_proxy("http")
+    result = detect_proxy_type(proxy, "httpbin.org", 80, connect_timeout=1, candidates=("http",))
+
+    assert result["proxy_type"] == "http"
+    assert len(accepted) == 1
+
+def test_detect_proxy_type_unrecognised(serve):
+    proxy = serve(reply=b"SSH-2.0-OpenSSH_9.6\r\n")
+    result = detect_proxy_type(proxy, "httpbin.org", 80, connect_timeout=0.5, candidates=("socks5",))
+
+    assert result["alive"] == False
+    assert result["reason"] == "detection_failed"
+    assert "SOCKS5: unrecognised reply" in result["error"]
+
+def test_detect_proxy_type_connection_refused():
+    result = detect_proxy_type(_closed_port(), "httpbin.org", 80)
+
+    assert result["alive"] == False
+    assert result["reason"] == "connection_refused"
+
+def test_preprobe_tls_phase_through_socks4_tunnel(serve, mocker):
+    tls = mocker.patch('proxy_checker.probe._TLSSocket')
+    proxy = serve(reply=b"\x00\x5a\x00\x00\x00\x00\x00\x00", read=1024)
+    result = preprobe(proxy, "socks4", "httpbin.org", 443, tls=True)
+
+    assert result["alive"] == True
+    assert isinstance(result["tls_ms"], int)
+    assert tls.call_args.args[1] == "httpbin.org"
+
+def test_preprobe_tls_phase_unknown_without_tunnel(serve):
+    proxy = serve(reply=b"HTTP/1.1 403 Forbidden\r\n\r\n", read=1024)
+    result = preprobe(proxy, "http", "httpbin.org", 443, tls=True)
+
+    assert result["alive"] == True
+    assert result["tls_ms"] is None
+
+def test_preprobe_https_proxy_speaks_tls(tls_cert):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(*tls_cert)
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    received = []
+
+    def run():
+        conn, _ = server.accept()
+        with context.wrap_socket(conn, server_side=True) as tls:
+            received.append(tls.recv(1024))
+            tls.sendall(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        server.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    result = preprobe(f"127.0.0.1:{server.getsockname()[1]}", "https", "httpbin.org", 80)
+    thread.join(5)
+
+    assert result["alive"] == True
+    assert received[0].startswith(b"CONNECT httpbin.org:80 ")
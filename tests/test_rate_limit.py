@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+from proxy_checker.rate_limit import RateLimiter, TokenBucket, parse_limits
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_parse_limits():
+    assert parse_limits("ip-api.com=45/60, ip-api.com/batch=15/60,bad,httpbin.org=5") == {
+        "ip-api.com": (45.0, 60.0), "ip-api.com/batch": (15.0, 60.0), "httpbin.org": (5.0, 1.0)}
+
+def test_token_bucket_refills_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(2, 1.0, clock)
+
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(1.0)
+
+    clock.now = 0.5
+    assert bucket.take() == pytest.approx(0.5)
+    clock.now = 1.0
+    assert bucket.take() == 0
+
+def test_acquire_waits_for_a_token():
+    clock = FakeClock()
+    limiter = RateLimiter({"ip-api.com": (1, 1)}, max_wait=2, clock=clock, sleep=clock.sleep)
+
+    assert limiter.acquire("ip-api.com")
+    assert limiter.acquire("ip-api.com")
+
+    assert clock.now == pytest.approx(1.0)
+    assert limiter.stats()["ip-api.com"] == {"acquired": 2, "waited": 1, "wait_ms": 1000, "throttled": 0,
+                                             "shared_errors": 0}
+
+def test_acquire_gives_up_after_max_wait():
+    clock = FakeClock()
+    limiter = RateLimiter({"ip-api.com": (1, 60)}, max_wait=2, clock=clock, sleep=clock.sleep)
+
+    assert limiter.acquire("ip-api.com")
+    assert not limiter.acquire("ip-api.com")
+
+    # No point sleeping when the next token is due after the deadline
+    assert clock.now == 0
+    assert limiter.stats()["ip-api.com"]["throttled"] == 1
+
+def test_acquire_async_waits_on_the_event_loop():
+    def blocking_sleep(seconds):
+        raise AssertionError("acquire_async must not sleep in a thread")
+
+    limiter = RateLimiter({"ip-api.com": (1, 0.05)}, max_wait=1, sleep=blocking_sleep)
+    ticks = []
+
+    async def ticker():
+        for _ in range(3):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        results = await asyncio.gather(*(limiter.acquire_async("ip-api.com") for _ in range(3)), ticker())
+        return results[:3]
+
+    assert asyncio.run(run()) == [True, True, True]
+    # Other coroutines kept running while the acquires waited
+    assert len(ticks) == 3
+    assert limiter.stats()["ip-api.com"]["waited"] == 2
+
+def test_acquire_async_gives_up_after_max_wait():
+    limiter = RateLimiter({"ip-api.com": (1, 60)}, max_wait=0.1)
+
+    assert asyncio.run(limiter.acquire_async("ip-api.com"))
+    assert not asyncio.run(limiter.acquire_async("ip-api.com"))
+    assert limiter.stats()["ip-api.com"]["throttled"] == 1
+
+def test_unlimited_hosts_are_not_limited():
+    limiter = RateLimiter({"ip-api.com": (1, 60)}, max_wait=0)
+
+    assert all(limiter.acquire("httpbin.org") for _ in range(100))
+    assert limiter.stats() == {}
+
+def test_shared_buckets_are_used_when_reachable():
+    calls = []
+
+    class FakeRedis:
+        def register_script(self, script):
+            def run(keys, args):
+                calls.append((keys, args))
+                return b"0" if len(calls) == 1 else b"30.5"
+            return run
+
+    limiter = RateLimiter({"ip-api.com": (45, 60)}, shared=FakeRedis(), max_wait=1)
+
+    assert limiter.acquire("ip-api.com")
+    assert not limiter.acquire("ip-api.com")
+    assert calls[0] == (["proxy_checker:ratelimit:ip-api.com"], [45, 0.75])
+
+def test_falls_back_to_local_buckets_without_redis():
+    class BrokenRedis:
+        def register_script(self, script):
+            def run(keys, args):
+                raise ConnectionError("redis down")
+            return run
+
+    clock = FakeClock()
+    limiter = RateLimiter({"ip-api.com": (1, 60)}, shared=BrokenRedis(), max_wait=0, clock=clock, sleep=clock.sleep)
+
+    assert limiter.acquire("ip-api.com")
+    assert not limiter.acquire("ip-api.com")
+    assert limiter.stats()["ip-api.com"]["shared_errors"] == 2
@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+from proxy_checker import result_cache
+from proxy_checker.result_cache import cache_key, cached_check, result_cache_stats, result_ttl
+
+def counting_check(result):
+    calls = []
+
+    def check():
+        calls.append(1)
+        return dict(result)
+    return check, calls
+
+def test_cache_key_covers_auth_identity_and_options():
+    key = cache_key("1.2.3.4:8080", "http", "user", "secret", None, "PRO")
+
+    assert key == cache_key("1.2.3.4:8080", "http", "user", "secret", None, "PRO")
+    assert key != cache_key("1.2.3.4:8080", "http", "user", "other", None, "PRO")
+    assert key != cache_key("1.2.3.4:8080", "http", "user", "secret", "https://example.com", "PRO")
+    assert key != cache_key("1.2.3.4:8080", "http", "user", "secret", None, "ULTRA")
+    assert key != cache_key("1.2.3.4:8080", "http", "user", "secret", None, "PRO", samples=3)
+    assert "secret" not in key
+
+def test_result_ttl_depends_on_status(mocker):
+    mocker.patch('proxy_checker.result_cache.RESULT_CACHE_ALIVE_TTL', 60)
+    mocker.patch('proxy_checker.result_cache.RESULT_CACHE_DEAD_TTL', 30)
+
+    assert result_ttl({"status": "alive"}) == 60
+    assert result_ttl({"status": "dead"}) == 30
+    assert result_ttl({"status": "timed_out"}) == 0
+    assert result_ttl({"error": "bad entry"}) == 0
+    assert result_ttl({"status": "alive", "country": "unknown"}) == 0
+
+def test_repeated_checks_are_served_from_cache():
+    check, calls = counting_check({"status": "alive", "latency_ms": 100})
+
+    first = cached_check("key", check)
+    first["country"] = "changed by the caller"
+    second = cached_check("key", check)
+
+    assert len(calls) == 1
+    assert second == {"status": "alive", "latency_ms": 100}
+    assert result_cache_stats()["hits"] == 1
+
+def test_uncacheable_results_are_checked_again():
+    check, calls = counting_check({"status": "timed_out", "error": "deadline"})
+
+    cached_check("key", check)
+    cached_check("key", check)
+
+    assert len(calls) == 2
+
+def test_max_age(mocker):
+    now = mocker.patch('proxy_checker.result_cache.time.time', return_value=1000.0)
+    check, calls = counting_check({"status": "dead", "error": "Timeout: x"})
+    cached_check("key", check)
+
+    now.return_value = 1010.0
+    cached_check("key", check, max_age=20)
+    assert len(calls) == 1
+
+    cached_check("key", check, max_age=5)
+    assert len(calls) == 2
+
+    cached_check("key", check, max_age=0)
+    assert len(calls) == 3
+
+def test_concurrent_checks_are_coalesced():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_check():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"status": "alive"}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cached_check("key", slow_check)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(cached_check("key", slow_check))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    # Followers miss the cache and join the check in flight
+    while result_cache_stats()["coalesced"] < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{"status": "alive"}] * 4
+    assert len({id(result) for result in results}) == 4
+
+def test_failed_check_is_not_cached():
+    def broken_check():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cached_check("key", broken_check)
+
+    check, calls = counting_check({"status": "alive"})
+    cached_check("key", check)
+    assert len(calls) == 1
+    assert result_cache._inflight == {}
+
+def test_result_is_cached_while_its_check_is_still_in_flight(mocker):
+    in_flight_when_cached = []
+    set_entry = result_cache._result_cache.set
+
+    def record(key, value, ttl):
+        in_flight_when_cached.append(key in result_cache._inflight)
+        set_entry(key, value, ttl)
+
+    mocker.patch.object(result_cache._result_cache, 'set', side_effect=record)
+    cached_check("key", lambda: {"status": "alive"})
+
+    assert in_flight_when_cached == [True]
+    assert result_cache._inflight == {}
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+from proxy_checker.results import (CheckResult, ErrorCode, classify_error, decode_result, encode_result,
+                                   render_result, short_detail)
+
+REFUSED = ("ConnectionError: HTTPConnectionPool(host='1.2.3.4', port=8080): Max retries exceeded with url: "
+           "http://httpbin.org/ip (Caused by ProxyError('Unable to connect to proxy', NewConnectionError("
+           "'<urllib3.connection.HTTPConnection object at 0x7f3a>: Failed to establish a new connection: "
+           "[Errno 111] Connection refused'))) (Note: SOCKS proxies require PySocks library)")
+
+ALIVE = {
+    "status": "alive", "latency_ms": 321, "proxy_type": "HTTP", "country": "Germany", "anonymous": True,
+    "isp": None, "asn": "AS3320", "dns_leak_detected": False, "ssl_verified": True,
+    "latency_breakdown_ms": {"connect": 40, "handshake": 35, "tls": None, "ttfb": 321, "total": 330},
+    "stage_latency_ms": {"probe": 330, "dns_leak": 412},
+}
+
+@pytest.mark.parametrize("result, code", [
+    ({"status": "dead", "error": REFUSED}, ErrorCode.CONNECTION_REFUSED),
+    ({"status": "dead", "error": "Timeout: TCP connect to proxy timed out after 3s", "dead_reason": "connect_timeout"},
+     ErrorCode.CONNECT_TIMEOUT),
+    ({"status": "dead", "error": "ProxyError: SOCKS5 authentication failed", "dead_reason": "handshake_failed"},
+     ErrorCode.HANDSHAKE_FAILED),
+    ({"status": "dead", "error": "HTTPError: 407 Client Error"}, ErrorCode.HTTP_ERROR),
+    ({"status": "dead", "error": "Timeout: Read timed out."}, ErrorCode.TIMEOUT),
+    ({"status": "timed_out", "error": "Check did not finish within the 30s request deadline."},
+     ErrorCode.DEADLINE_EXCEEDED),
+    ({"error": "Missing 'proxy' or 'type' in one of the proxy objects."}, ErrorCode.INVALID_INPUT),
+])
+def test_classify_error(result, code):
+    assert classify_error(result["error"], result.get("status"), result.get("dead_reason")) == code
+
+def test_short_detail():
+    assert short_detail(REFUSED) == "Connection refused"
+    assert short_detail("Timeout: HTTPConnectionPool(host='1.2.3.4', port=80): Read timed out. (read timeout=5)") == \
+        "Read timed out. (read timeout=5)"
+    assert short_detail("ProxyError: SOCKS5 authentication failed") == "SOCKS5 authentication failed"
+    assert len(short_detail("HTTPError: " + "x" * 500)) == 120
+
+def test_pack_round_trip():
+    packed = encode_result(ALIVE)
+
+    assert decode_result(packed) == ALIVE
+    # Positional values, no key names
+    assert "latency_ms" not in json.dumps(packed)
+
+def test_pack_keeps_absent_fields_absent():
+    assert decode_result(encode_result({"status": "alive", "country": None})) == {"status": "alive", "country": None}
+
+def test_pack_keeps_unknown_fields():
+    assert decode_result(encode_result({"status": "alive", "cached": True})) == {"status": "alive", "cached": True}
+
+def test_packed_dead_result_is_short():
+    packed = encode_result({"status": "dead", "error": REFUSED})
+
+    assert len(json.dumps(packed)) < len(REFUSED) / 5
+    assert decode_result(packed) == {"status": "dead", "error_code": "connection_refused",
+                                     "error": "ConnectionError: Connection refused"}
+
+def test_render_result():
+    result = {"status": "dead", "error": REFUSED}
+
+    assert render_result(result) == {"status": "dead", "error_code": "connection_refused", "error": REFUSED}
+    assert render_result(result, compact=True) == {"status": "dead", "error_code": "connection_refused",
+                                                   "detail": "Connection refused"}
+    assert render_result(ALIVE, compact=True)["latency_breakdown_ms"]["tls"] is None
+    assert "isp" not in render_result(ALIVE, compact=True)
+
+def test_check_result_uses_slots():
+    record = CheckResult.from_dict(ALIVE)
+
+    assert not hasattr(record, "__dict__")
+    assert not hasattr(record, "error_code")
@@ -0,0 +1,64 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from proxy_checker import sessions
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    # Answers both origin requests and absolute-URI proxy requests
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = json.dumps({"origin": "9.9.9.9", "path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture(autouse=True)
+def fresh_sessions():
+    sessions.reset_sessions()
+    yield
+    sessions.reset_sessions()
+
+def test_service_session_is_shared_and_reuses_connections(server):
+    session = sessions.get_session("geo")
+    assert sessions.get_session("geo") is session
+
+    for _ in range(3):
+        assert session.get(f"http://{server}/json").status_code == 200
+
+    stats = sessions.session_stats()["services"]["geo"]
+    assert stats == {"requests": 3, "connections": 1, "reused": 2, "reuse_ratio": 0.6667}
+
+def test_proxy_session_reuses_connection_to_http_proxy(server):
+    proxies = {"http": f"http://{server}", "https": f"http://{server}"}
+
+    with sessions.ProxySession(proxies) as session:
+        # Plain-HTTP requests to different hosts all go over the one proxy connection
+        assert session.get("http://httpbin.org/ip").json()["path"] == "http://httpbin.org/ip"
+        assert session.get("http://example.com/").json()["path"] == "http://example.com/"
+
+    stats = sessions.session_stats()["proxy"]
+    assert stats["sessions"] == 1
+    assert stats["requests"] == 2
+    assert stats["connections"] == 1
+
+def test_session_pool_sizes_are_reported():
+    stats = sessions.session_stats()
+    assert stats["pool_connections"] == sessions.SESSION_POOL_CONNECTIONS
+    assert stats["pool_maxsize"] == sessions.SESSION_POOL_MAXSIZE
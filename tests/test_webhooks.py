@@ -0,0 +1,140 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from celery_worker import celery_app, check_chunk_task, deliver_webhook_task, dispatch_job
+from proxy_checker import webhooks
+
+@pytest.fixture
+def eager():
+    celery_app.conf.task_always_eager = True
+    yield
+    celery_app.conf.task_always_eager = False
+
+@pytest.fixture
+def receiver():
+    """
+    A local stand-in for a customer's callback endpoint. It records every
+    payload it is sent, and answers with the statuses queued in
+    receiver.statuses (200 once they run out).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            server.received.append({"payload": json.loads(body), "encoding": self.headers.get("Content-Encoding")})
+            self.send_response(server.statuses.pop(0) if server.statuses else 200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.received = []
+    server.statuses = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/callback"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_deliver_posts_json(receiver):
+    webhooks.deliver(receiver.url, {"job_id": "job", "results": []})
+
+    assert receiver.received == [{"payload": {"job_id": "job", "results": []}, "encoding": None}]
+    stats = webhooks.delivery_stats()
+    assert (stats["attempts"], stats["delivered"], stats["failed"]) == (1, 1, 0)
+    assert stats["bytes_sent"] > 0
+
+def test_deliver_gzips_large_payloads(receiver, mocker):
+    mocker.patch('proxy_checker.webhooks.WEBHOOK_GZIP_MIN_BYTES', 100)
+    payload = {"job_id": "job", "results": [{"status": "alive", "proxy": f"10.0.0.{i}:80"} for i in range(50)]}
+
+    webhooks.deliver(receiver.url, payload)
+
+    assert receiver.received == [{"payload": payload, "encoding": "gzip"}]
+    assert webhooks.delivery_stats()["bytes_sent"] < len(json.dumps(payload))
+
+def test_deliver_errors(receiver):
+    receiver.statuses = [503, 404]
+
+    with pytest.raises(webhooks.DeliveryError, match="HTTPError: receiver answered 503") as excinfo:
+        webhooks.deliver(receiver.url, {})
+    assert excinfo.value.retryable
+
+    with pytest.raises(webhooks.DeliveryError, match="HTTPError: receiver answered 404") as excinfo:
+        webhooks.deliver(receiver.url, {})
+    assert not excinfo.value.retryable
+
+def test_deliver_unreachable_receiver():
+    with pytest.raises(webhooks.DeliveryError, match="^ConnectionError: ") as excinfo:
+        webhooks.deliver("http://127.0.0.1:1/callback", {}, timeout=1)
+    assert excinfo.value.retryable
+
+def test_backoff_delay_grows_and_is_capped(mocker):
+    mocker.patch('proxy_checker.webhooks.WEBHOOK_BACKOFF_BASE', 5)
+    mocker.patch('proxy_checker.webhooks.WEBHOOK_BACKOFF_MAX', 60)
+
+    assert 2.5 <= webhooks.backoff_delay(0) <= 5
+    assert 10 <= webhooks.backoff_delay(2) <= 20
+    assert 30 <= webhooks.backoff_delay(10) <= 60
+
+def test_final_callback_retries_until_delivered(receiver, eager, mocker, memory_job_store):
+    mocker.patch('proxy_checker.webhooks.backoff_delay', return_value=0)
+    receiver.statuses = [500, 502]
+    memory_job_store.create("job", 1)
+    memory_job_store.put_results("job", 0, [{"status": "alive"}])
+    memory_job_store.finish("job")
+
+    deliver_webhook_task.delay(receiver.url, "job")
+
+    assert len(receiver.received) == 3
+    assert receiver.received[-1]["payload"] == {"job_id": "job", "status": "completed", "results": [{"status": "alive"}]}
+    assert memory_job_store.get("job")["callback"] == {"status": "delivered", "attempts": 3}
+    stats = webhooks.delivery_stats()
+    assert (stats["attempts"], stats["retried"], stats["delivered"]) == (3, 2, 1)
+
+def test_final_callback_gives_up_on_client_errors(receiver, eager, memory_job_store):
+    receiver.statuses = [410]
+    memory_job_store.create("job", 0)
+    memory_job_store.finish("job")
+
+    deliver_webhook_task.delay(receiver.url, "job")
+
+    assert len(receiver.received) == 1
+    assert memory_job_store.get("job")["callback"] == {"status": "failed", "attempts": 1,
+                                                      "last_error": "HTTPError: receiver answered 410"}
+    assert webhooks.delivery_stats()["failed"] == 1
+
+def test_chunk_sends_batch_callbacks(receiver, eager, mocker, memory_job_store):
+    mocker.patch('celery_worker.check_proxy', side_effect=lambda proxy, *args, **kwargs: {"status": "alive"})
+    mocker.patch('celery_worker.fill_geo_data')
+    memory_job_store.create("job", 15)
+
+    check_chunk_task.apply(args=([{"proxy": "1.1.1.1:80", "type": "http"}] * 5, "job", 10,
+                                 {"url": receiver.url, "batch_size": 2, "batch_seconds": None}))
+
+    batches = [[result["index"] for result in request["payload"]["results"]] for request in receiver.received]
+    assert batches == [[10, 11], [12, 13]]
+    assert all(request["payload"]["status"] == "partial" for request in receiver.received)
+    # The rest waits for more results from the job's other chunks, or for the job to finish
+    assert [index for index, _ in memory_job_store.take_batch("job")] == [14]
+
+def test_batch_callbacks_span_chunks(receiver, eager, mocker, memory_job_store):
+    mocker.patch('celery_worker.check_proxy', side_effect=lambda proxy, *args, **kwargs: {"status": "alive"})
+    mocker.patch('celery_worker.fill_geo_data')
+    proxies = [{"proxy": f"10.0.0.{i}:80", "type": "http"} for i in range(6)]
+
+    dispatch_job(proxies, "job", receiver.url, chunk_size=3, callback_batch_size=4)
+
+    payloads = [request["payload"] for request in receiver.received]
+    assert [(payload["status"], [result.get("index") for result in payload["results"]]) for payload in payloads] == [
+        ("partial", [0, 1, 2, 3]),
+        ("partial", [4, 5]),
+        ("completed", [None] * 6),
+    ]